@@ -1,126 +1,205 @@
 """Planning Staff - Birdieland Réaumur"""
 
 import streamlit as st
+import base64
+import bisect
 import datetime
 import hashlib
-from dataclasses import dataclass
+import hmac
+import itertools
+import json
+import os
+import re
+import time
+import zlib
+from dataclasses import dataclass, replace
+
+import numpy as np
 
 APP_VERSION = "3.3.0"
 
 st.set_page_config(page_title="Planning Staff - Birdieland", layout="wide")
 
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+# ── Feuilles de style statiques ──────────────────────────────────────────
+
+@st.cache_resource(show_spinner=False)
+def _static_hash(name):
+    """Hash court du contenu d'un fichier de static/ (invalide le cache navigateur)."""
+    with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:10]
+
+
+def read_static(name):
+    """Contenu texte d'un fichier de static/ (pour les pages HTML autonomes)."""
+    with open(os.path.join(STATIC_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+# Polices attendues par fonts.css. Les fichiers ne sont pas encore livrés :
+# tant qu'il en manque un, Google Fonts reste chargé (cf. static/fonts/README.md)
+FONT_FILES = ('Montserrat-Variable.woff2', 'SpaceGrotesk-Variable.woff2')
+GOOGLE_FONTS_URL = ("https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;600;700"
+                    "&family=Space+Grotesk:wght@300;400;600&display=swap")
+
+
+@st.cache_resource(show_spinner=False)
+def _fonts_bundled():
+    return all(os.path.exists(os.path.join(STATIC_DIR, 'fonts', name)) for name in FONT_FILES)
+
+
+def stylesheets(*names):
+    """Balises <link> vers des feuilles de static/, versionnées par leur contenu.
+
+    Servies par Streamlit sur app/static/ et mises en cache par le navigateur :
+    chaque rerun n'envoie que ces balises, pas le CSS. Sans les polices
+    embarquées, fonts.css est précédée du lien Google Fonts.
+    """
+    fallback = ''
+    if 'fonts.css' in names and not _fonts_bundled():
+        fallback = f'<link rel="stylesheet" href="{GOOGLE_FONTS_URL}">'
+    return fallback + ''.join(
+        f'<link rel="stylesheet" href="app/static/{name}?v={_static_hash(name)}">'
+        for name in names
+    )
+
 
 # ── Authentification ──────────────────────────────────────────────────────
 
-def _auth_token():
-    """Génère un token de session basé sur les credentials."""
-    login = st.secrets["auth"]["login"]
-    password = st.secrets["auth"]["password"]
-    return hashlib.sha256(f"{login}:{password}:birdieland".encode()).hexdigest()[:20]
+# Comptes locaux : {login: {'salt', 'hash', 'role', 'employee'}}. Sans fichier,
+# le compte unique de st.secrets["auth"] sert de compte manager.
+USERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.streamlit', 'users.json')
+AUTH_KEY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.streamlit', 'auth.key')
+PASSWORD_ITERATIONS = 200_000
+SESSION_TTL = 7 * 24 * 3600     # durée de validité d'un token de session (s)
+ROLES = {'manager': "Manager", 'staff': "Staff (lecture seule)"}
+
+
+def hash_password(password, salt=None):
+    """(sel, hash) hexadécimaux PBKDF2-SHA256 ; sel aléatoire si non fourni."""
+    salt = bytes.fromhex(salt) if salt else os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PASSWORD_ITERATIONS)
+    return salt.hex(), digest.hex()
+
+
+def verify_password(password, record):
+    """Compare le mot de passe au hash salé d'un compte, en temps constant."""
+    _, digest = hash_password(password, record['salt'])
+    return hmac.compare_digest(digest, record['hash'])
+
+
+def load_users(path=USERS_FILE):
+    """Comptes du fichier local, ou compte manager unique issu de st.secrets."""
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            users = json.load(f)
+        if users:
+            return users
+    if "auth" in st.secrets:
+        salt, digest = hash_password(st.secrets["auth"]["password"])
+        return {st.secrets["auth"]["login"]: {'salt': salt, 'hash': digest, 'role': 'manager', 'employee': ''}}
+    return {}
+
+
+@st.cache_resource
+def _users():
+    """Comptes chargés une fois par processus (vidé par save_users)."""
+    return load_users()
+
+
+def _write_atomic(path, text, mode=0o644):
+    """Écriture par fichier temporaire + rename (jamais de fichier à moitié écrit), droits `mode`.
+
+    Secrets (comptes, clé de session) : mode=0o600, lisibles par le seul propriétaire.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    os.fchmod(fd, mode)  # un .tmp préexistant garde sinon ses droits
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def save_users(users, path=USERS_FILE):
+    _write_atomic(path, json.dumps(users, indent=2, ensure_ascii=False), mode=0o600)
+    _users.clear()
+
+
+def set_user(users, login, password, role, employee=''):
+    """Crée ou met à jour un compte (mot de passe vide → inchangé)."""
+    record = dict(users.get(login, {}), role=role, employee=employee)
+    if password:
+        record['salt'], record['hash'] = hash_password(password)
+    users[login] = record
+    return users
+
+
+@st.cache_resource
+def _token_key():
+    """Clé HMAC des tokens : st.secrets["auth"]["token_key"], sinon fichier local généré."""
+    if "auth" in st.secrets and st.secrets["auth"].get("token_key"):
+        return st.secrets["auth"]["token_key"].encode('utf-8')
+    if not os.path.exists(AUTH_KEY_FILE):
+        _write_atomic(AUTH_KEY_FILE, os.urandom(32).hex(), mode=0o600)
+    with open(AUTH_KEY_FILE, encoding='ascii') as f:
+        return bytes.fromhex(f.read().strip())
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def issue_token(login, role, now=None):
+    """Token signé « charge.signature », charge = login|rôle|expiration."""
+    expires = int((now or time.time()) + SESSION_TTL)
+    payload = _b64(f"{login}|{role}|{expires}".encode('utf-8'))
+    signature = _b64(hmac.new(_token_key(), payload.encode('ascii'), hashlib.sha256).digest())
+    return f"{payload}.{signature}"
+
+
+def verify_token(token, now=None):
+    """(login, rôle, expiration) d'un token valide et non expiré, sinon None."""
+    payload, _, signature = token.partition('.')
+    expected = _b64(hmac.new(_token_key(), payload.encode('ascii', 'replace'), hashlib.sha256).digest())
+    if not hmac.compare_digest(expected.encode('ascii'), signature.encode('utf-8')):
+        return None
+    try:
+        login, role, expires = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)).decode('utf-8').split('|')
+        expires = int(expires)
+    except ValueError:
+        return None
+    if expires < (now or time.time()):
+        return None
+    user = _users().get(login)
+    if not user or user['role'] != role:
+        return None  # compte supprimé ou rôle modifié depuis l'émission
+    return login, role, expires
+
+
+def _open_session(login, role, expires):
+    st.session_state["authenticated"] = True
+    st.session_state["user"] = login
+    st.session_state["role"] = role
+    st.session_state["auth_expires"] = expires
 
 
 def check_auth():
-    """Vérifie le login/mot de passe via st.secrets, avec persistance par token URL."""
-    if st.session_state.get("authenticated"):
+    """Vérifie la session : drapeau de session, token signé dans l'URL, sinon formulaire."""
+    if st.session_state.get("authenticated") and st.session_state.get("auth_expires", 0) > time.time():
         return True
 
     # Vérifier si un token valide est dans l'URL (survit au refresh)
     token_param = st.query_params.get("session")
-    if token_param and token_param == _auth_token():
-        st.session_state["authenticated"] = True
-        return True
+    if token_param:
+        session = verify_token(token_param)
+        if session:
+            _open_session(*session)
+            return True
 
-    st.markdown(f"""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;600;700&family=Space+Grotesk:wght@300;400;600&display=swap');
-
-    #MainMenu, header, footer {{ visibility: hidden; }}
-    .stAppDeployButton {{ display: none; }}
-
-    .stApp {{
-        background: #080808;
-        min-height: 100vh;
-        font-family: 'Space Grotesk', sans-serif;
-    }}
-    .block-container {{
-        max-width: 400px !important;
-        padding: 10vh 2rem 2rem !important;
-        margin: 0 auto !important;
-    }}
-    .bl-header {{
-        text-align: center;
-        margin-bottom: 40px;
-    }}
-    .bl-logo {{
-        font-family: 'Montserrat', sans-serif;
-        font-size: 32px;
-        font-weight: 700;
-        color: #ffffff;
-        letter-spacing: 6px;
-        text-transform: uppercase;
-    }}
-    .bl-sub {{
-        font-family: 'Space Grotesk', sans-serif;
-        font-size: 11px;
-        color: rgba(255,255,255,0.4);
-        letter-spacing: 3px;
-        text-transform: uppercase;
-        margin-top: 6px;
-    }}
-    .bl-divider {{
-        border: none;
-        border-top: 1px solid rgba(255,255,255,0.1);
-        margin: 0 25% 36px;
-    }}
-    .stTextInput label {{
-        color: rgba(255,255,255,0.45) !important;
-        font-family: 'Space Grotesk', sans-serif !important;
-        font-size: 10px !important;
-        font-weight: 600 !important;
-        letter-spacing: 2px !important;
-        text-transform: uppercase !important;
-    }}
-    .stTextInput input {{
-        background: rgba(255,255,255,0.04) !important;
-        border: 1px solid rgba(255,255,255,0.15) !important;
-        border-radius: 6px !important;
-        color: #ffffff !important;
-        font-family: 'Space Grotesk', sans-serif !important;
-        font-size: 15px !important;
-    }}
-    .stTextInput input:focus {{
-        border-color: rgba(255,255,255,0.5) !important;
-        box-shadow: none !important;
-        background: rgba(255,255,255,0.07) !important;
-    }}
-    .stTextInput input::placeholder {{ color: rgba(255,255,255,0.2) !important; }}
-    .stButton > button {{
-        background: #ffffff !important;
-        color: #080808 !important;
-        border: none !important;
-        border-radius: 6px !important;
-        width: 100% !important;
-        padding: 14px !important;
-        font-family: 'Montserrat', sans-serif !important;
-        font-size: 11px !important;
-        letter-spacing: 3px !important;
-        text-transform: uppercase !important;
-        font-weight: 700 !important;
-        margin-top: 12px !important;
-        transition: background 0.2s !important;
-    }}
-    .stButton > button:hover {{
-        background: #e0e0e0 !important;
-    }}
-    .bl-version {{
-        text-align: center;
-        font-size: 10px;
-        color: rgba(255,255,255,0.2);
-        letter-spacing: 2px;
-        margin-top: 32px;
-        font-family: 'Space Grotesk', sans-serif;
-    }}
-    </style>
+    st.markdown(stylesheets("fonts.css", "login.css") + """
     <div class="bl-header">
         <div class="bl-logo">Birdieland</div>
         <div class="bl-sub">Staff Planning &middot; Réaumur</div>
@@ -132,11 +211,11 @@ def check_auth():
     password = st.text_input("Mot de passe", type="password")
 
     if st.button("Accéder au planning"):
-        expected_login = st.secrets["auth"]["login"]
-        expected_password = st.secrets["auth"]["password"]
-        if login == expected_login and password == expected_password:
-            st.session_state["authenticated"] = True
-            st.query_params["session"] = _auth_token()
+        user = _users().get(login)
+        if user and verify_password(password, user):
+            token = issue_token(login, user['role'])
+            _open_session(*verify_token(token))
+            st.query_params["session"] = token
             st.rerun()
         else:
             st.error("Identifiant ou mot de passe incorrect")
@@ -144,8 +223,32 @@ def check_auth():
     st.markdown(f'<div class="bl-version">v{APP_VERSION}</div>', unsafe_allow_html=True)
     return False
 
+
+def logout():
+    for key in ("authenticated", "user", "role", "auth_expires"):
+        st.session_state.pop(key, None)
+    st.query_params.pop("session", None)
+
 # ── Données staff ──────────────────────────────────────────────────────────
 
+# Compétences : un bit par compétence dans Employee.skills
+SKILLS = ('manager', 'coach', 'senior')
+SKILL_LABELS = {'manager': "Manager", 'coach': "Coach", 'senior': "CDI senior"}
+
+
+def skill_mask(*names):
+    """Bitset des compétences nommées : skill_mask('manager', 'senior')."""
+    mask = 0
+    for name in names:
+        mask |= 1 << SKILLS.index(name)
+    return mask
+
+
+def skill_names(mask):
+    """Libellés des compétences d'un bitset."""
+    return [SKILL_LABELS[name] for i, name in enumerate(SKILLS) if mask >> i & 1]
+
+
 @dataclass
 class Employee:
     name: str
@@ -154,11 +257,20 @@ class Employee:
     available_days: set  # 0=Lun, 1=Mar, ..., 6=Dim
     is_alternant: bool = False
     max_daily_hours: float = 10.0
+    default_shift: str = ''    # 'matin', 'soir', 'flex' (matin, 1er à basculer soir) ou '' (auto)
+    availability: dict = None  # {jour: masque 96 quarts d'heure} ; jour absent → journée entière
+    preferences: dict = None   # {jour: masque 96 quarts d'heure} plages préférées
+    hourly_rate: float = 0.0   # taux horaire brut propre (0 → taux du contrat, cf. CONTRACT_RATES)
+    skills: int = 0            # bitset de SKILLS (cf. skill_mask)
+    labor_profile: str = 'general'  # profil de règles du droit du travail (cf. LABOR_PROFILES)
 
 STAFF = [
-    Employee("Baptiste Le Moing", "Manager", 42, {0,1,2,3,4,5,6}),
-    Employee("Joseph Watrinet", "Coach", 42, {0,1,2,3,4,5,6}),
-    Employee("Alexandre Corchia", "", 35, {0,1,2,3,4,5,6}),
+    Employee("Baptiste Le Moing", "Manager", 42, {0,1,2,3,4,5,6}, default_shift='matin',
+             skills=skill_mask('manager', 'senior')),
+    Employee("Joseph Watrinet", "Coach", 42, {0,1,2,3,4,5,6}, default_shift='flex',
+             skills=skill_mask('coach', 'senior')),
+    Employee("Alexandre Corchia", "", 35, {0,1,2,3,4,5,6}, default_shift='soir',
+             skills=skill_mask('senior')),
     Employee("Hippolyte Amy", "Alternant", 21, {0,1,2}, is_alternant=True, max_daily_hours=8.0),
     Employee("Maxime Bancquart", "", 21, {3,4,5}),
 ]
@@ -211,6 +323,98 @@ SUNDAY_ROTATION = {
 }
 
 
+# ── Calendrier des absences (dates réelles) ──────────────────────────────
+
+ABSENCE_TYPES = {
+    'vacances': 'Vacances',
+    'maladie': 'Maladie',
+    'formation': 'Formation',
+}
+
+
+class AbsenceCalendar:
+    """Absences datées par employé (vacances, maladie, formation).
+
+    Chaque employé a une liste triée d'intervalles disjoints (début, fin
+    inclusifs, en ordinaux de date) : une recherche bisect par employé-jour.
+    """
+
+    def __init__(self):
+        self._starts = {}     # nom → [début, ...] trié
+        self._intervals = {}  # nom → [(début, fin, type), ...] même ordre
+
+    @classmethod
+    def from_records(cls, records):
+        """Construit le calendrier depuis une liste de dicts (session)."""
+        calendar = cls()
+        for rec in records:
+            calendar.add(rec['employee'], rec['start'], rec['end'], rec['kind'])
+        return calendar
+
+    def add(self, name, start, end, kind='vacances'):
+        """Ajoute une absence. La nouvelle saisie remplace les jours qu'elle chevauche."""
+        s, e = start.toordinal(), end.toordinal()
+        if e < s:
+            s, e = e, s
+        starts = self._starts.setdefault(name, [])
+        intervals = self._intervals.setdefault(name, [])
+
+        # Intervalles chevauchants : indices [lo, hi)
+        lo = bisect.bisect_left(starts, s)
+        if lo > 0 and intervals[lo - 1][1] >= s:
+            lo -= 1
+        hi = bisect.bisect_right(starts, e)
+
+        # Conserver les morceaux qui dépassent de part et d'autre
+        pieces = []
+        for i_s, i_e, i_kind in intervals[lo:hi]:
+            if i_s < s:
+                pieces.append((i_s, s - 1, i_kind))
+            if i_e > e:
+                pieces.append((e + 1, i_e, i_kind))
+        pieces.append((s, e, kind))
+        pieces.sort()
+
+        intervals[lo:hi] = pieces
+        starts[lo:hi] = [p[0] for p in pieces]
+
+    def lookup(self, name, date):
+        """Type d'absence de l'employé à cette date, ou None."""
+        starts = self._starts.get(name)
+        if not starts:
+            return None
+        d = date.toordinal()
+        i = bisect.bisect_right(starts, d) - 1
+        if i < 0:
+            return None
+        _, end, kind = self._intervals[name][i]
+        return kind if d <= end else None
+
+    def week_off_days(self, monday):
+        """{nom: {jour: type}} des absences de la semaine commençant ce lundi."""
+        result = {}
+        for name in self._starts:
+            for day in range(7):
+                kind = self.lookup(name, monday + datetime.timedelta(days=day))
+                if kind:
+                    result.setdefault(name, {})[day] = kind
+        return result
+
+
+def monday_of(date):
+    """Lundi de la semaine contenant cette date."""
+    return date - datetime.timedelta(days=date.weekday())
+
+
+def next_monday(today=None):
+    """Prochain lundi strictement après aujourd'hui."""
+    today = today or datetime.date.today()
+    days_until_monday = (7 - today.weekday()) % 7
+    if days_until_monday == 0:
+        days_until_monday = 7
+    return today + datetime.timedelta(days=days_until_monday)
+
+
 def time_str(h, m):
     return f"{h}:{m:02d}"
 
@@ -224,6 +428,167 @@ def from_minutes(minutes):
     return h, m
 
 
+def parse_minutes(t):
+    """'9:45' → 585."""
+    h, m = t.split(':')
+    return int(h) * 60 + int(m)
+
+
+# ── Horaires exceptionnels (événements, tournois, saisons) ───────────────
+
+MIN_STAFF = 1      # personnes présentes pendant l'ouverture
+MIN_CLOSERS = 2    # personnes à la fermeture (Lun-Sam)
+
+# Table d'ouverture d'une semaine : une ligne par jour
+# (ouverture, fermeture en minutes, effectif min, fermeture min)
+OPEN, CLOSE, STAFF_MIN, CLOSERS_MIN = range(4)
+DEFAULT_OPENING = np.array([
+    (to_minutes(sh, sm), to_minutes(eh, em), MIN_STAFF, MIN_CLOSERS if day != 6 else 1)
+    for day, (sh, sm, eh, em) in sorted(HORAIRES.items())
+], dtype=np.int16)
+
+
+def opening_hours(day, opening=None):
+    """(h, m, h, m) d'ouverture du jour, comme HORAIRES, selon la table `opening`."""
+    if opening is None:
+        return HORAIRES[day]
+    return (*from_minutes(int(opening[day, OPEN])), *from_minutes(int(opening[day, CLOSE])))
+
+
+def is_closed(day, opening=None):
+    return opening is not None and opening[day, CLOSE] <= opening[day, OPEN]
+
+
+class OpeningExceptions:
+    """Horaires exceptionnels datés : une date ou une plage (inclusive) avec
+    sa propre fenêtre d'ouverture et ses minimums d'effectif.
+
+    Les jours sans exception gardent HORAIRES. Une saisie postérieure prime
+    sur celles qu'elle chevauche. horizon_array précalcule la table d'un
+    horizon entier : la recherche d'une date est alors un simple indice.
+    """
+
+    def __init__(self):
+        self._records = []  # (début, fin en ordinaux, ouverture, fermeture, effectif min, fermeture min, libellé)
+
+    def __bool__(self):
+        return bool(self._records)
+
+    def add(self, start, end, open_min, close_min, min_staff=MIN_STAFF, min_closers=MIN_CLOSERS, label=''):
+        """Ajoute une exception ; ouverture == fermeture → établissement fermé."""
+        s, e = start.toordinal(), end.toordinal()
+        if e < s:
+            s, e = e, s
+        if close_min <= open_min:
+            open_min = close_min = min_staff = min_closers = 0
+        self._records.append((s, e, open_min, close_min, min_staff, min_closers, label))
+
+    def horizon_array(self, first_monday, num_weeks):
+        """Table d'ouverture (semaines, 7, 4) de l'horizon, exceptions appliquées.
+
+        Chaque saisie est peinte sur sa tranche de jours : O(saisies + jours).
+        """
+        table = np.tile(DEFAULT_OPENING, (num_weeks, 1)).reshape(num_weeks * 7, 4)
+        first = first_monday.toordinal()
+        for s, e, open_min, close_min, min_staff, min_closers, _ in self._records:
+            lo, hi = max(s - first, 0), min(e - first + 1, num_weeks * 7)
+            if lo < hi:
+                table[lo:hi] = (open_min, close_min, min_staff, min_closers)
+        return table.reshape(num_weeks, 7, 4)
+
+    def week_opening(self, monday):
+        """Table (7, 4) de la semaine, ou None si elle suit HORAIRES."""
+        opening = self.horizon_array(monday, 1)[0]
+        return None if np.array_equal(opening, DEFAULT_OPENING) else opening
+
+    def week_labels(self, monday):
+        """{jour: libellé} des exceptions de la semaine commençant ce lundi."""
+        first = monday.toordinal()
+        labels = {}
+        for s, e, open_min, close_min, _, _, label in self._records:
+            for day in range(max(s - first, 0), min(e - first + 1, 7)):
+                hours = (f"{time_str(*from_minutes(open_min))}-{time_str(*from_minutes(close_min))}"
+                         if close_min > open_min else "fermé")
+                labels[day] = f"{label} ({hours})" if label else hours
+        return labels
+
+
+def opening_exceptions(rows):
+    """Lignes saisies (session) → (OpeningExceptions, [erreurs]).
+
+    Chaque ligne : {'start', 'end' (dates, fin vide → un seul jour), 'open',
+    'close' ("9:45", vides → fermé, fin avant minuit), 'min_staff',
+    'min_closers', 'label'}.
+    """
+    exceptions, errors = OpeningExceptions(), []
+    for row in rows:
+        start = row.get('start')
+        if not start:
+            continue
+        label = (row.get('label') or '').strip()
+        open_text, close_text = (row.get('open') or '').strip(), (row.get('close') or '').strip()
+        if open_text or close_text:
+            try:
+                open_min, close_min = parse_minutes(open_text), parse_minutes(close_text)
+            except ValueError:
+                open_min = close_min = None
+            if open_min is None or not 0 <= open_min < close_min < 24 * 60:
+                errors.append(f"{label or start.strftime('%d/%m/%Y')} : horaires illisibles "
+                              f"({open_text}-{close_text})")
+                continue
+        else:
+            open_min = close_min = 0  # fermé
+        exceptions.add(
+            start, row.get('end') or start, open_min, close_min,
+            MIN_STAFF if row.get('min_staff') is None else int(row['min_staff']),
+            MIN_CLOSERS if row.get('min_closers') is None else int(row['min_closers']),
+            label,
+        )
+    return exceptions, errors
+
+
+# ── Disponibilités au quart d'heure (masques 96 bits par jour) ───────────
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+FULL_DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+
+
+def window_mask(start_min, end_min):
+    """Masque des quarts d'heure touchés par [début, fin) en minutes."""
+    lo = max(start_min // SLOT_MINUTES, 0)
+    hi = min(-(-end_min // SLOT_MINUTES), SLOTS_PER_DAY)
+    if hi <= lo:
+        return 0
+    return ((1 << (hi - lo)) - 1) << lo
+
+
+def windows(spec):
+    """{jour: "17:00-23:15, 9:45-12:00"} → {jour: masque}, pour availability/preferences."""
+    masks = {}
+    for day, text in spec.items():
+        mask = 0
+        for part in text.split(','):
+            start, end = part.strip().split('-')
+            mask |= window_mask(parse_minutes(start), parse_minutes(end))
+        masks[day] = mask
+    return masks
+
+
+def day_availability(emp, day):
+    """Masque de disponibilité d'un employé ce jour (0 si jour non travaillé)."""
+    if day not in emp.available_days:
+        return 0
+    if emp.availability and day in emp.availability:
+        return emp.availability[day]
+    return FULL_DAY_MASK
+
+
+def fits_availability(emp, day, start_min, end_min):
+    """True si [début, fin) est entièrement dans les disponibilités du jour."""
+    return window_mask(start_min, end_min) & ~day_availability(emp, day) == 0
+
+
 def hours_between(h1, m1, h2, m2):
     return (to_minutes(h2, m2) - to_minutes(h1, m1)) / 60
 
@@ -238,113 +603,118 @@ def make_shift(shift_type, start_h, start_m, end_h, end_m):
     }
 
 
-def get_off_days(week_num, meeting_week=False):
-    """Retourne les jours off pour une semaine donnée, avec gestion réunion."""
+def get_off_days(week_num, meeting_week=False, rotation=None):
+    """Retourne les jours off pour une semaine donnée, avec gestion réunion.
+
+    `rotation` : rotation appliquée depuis la recherche ({'rotation',
+    'sunday'} par semaine du cycle, cf. search_rotations) à la place de
+    ROTATION ; elle garde déjà les managers le lundi des réunions.
+    """
+    if rotation is not None:
+        return rotation['rotation'][week_num]
     if week_num == 3 and meeting_week:
         return ROTATION_MEETING_W3
     return ROTATION[week_num]
 
 
-def assign_shifts(available, day, schedule, week_num):
+def assign_shifts(available, day, schedule, week_num, opening=None):
     """Assigne matin/soir pour un jour Mon-Sam.
 
-    Règles :
-    - Alexandre → toujours soir
-    - Baptiste → toujours matin
-    - Joseph → flexible (matin par défaut, soir si nécessaire)
-    - Part-timers → soir par défaut, matin si un CDI a transition soir→matin
+    Règles (selon Employee.default_shift) :
+    - 'soir' (Alexandre) → toujours soir
+    - 'matin' (Baptiste) → toujours matin
+    - 'flex' (Joseph) → matin par défaut, premier à basculer soir si nécessaire
+    - autres CDI → matin si possible ; part-timers → soir par défaut,
+      matin si personne d'autre ne peut ouvrir
     - Anti-transition : si quelqu'un a fait soir la veille, il ne peut pas faire matin
-    - Minimum : 1 matin + 2 soir
+    - Disponibilités : ouvrir (resp. fermer) exige le quart d'heure d'ouverture
+      (resp. de fermeture) dans les disponibilités du jour
+    - Minimum : 1 matin + 2 soir (effectif et fermeture min de la table `opening`)
     """
+    sh, sm, eh, em = opening_hours(day, opening)
+    min_closers = MIN_CLOSERS if opening is None else int(opening[day, CLOSERS_MIN])
+    min_staff = MIN_STAFF if opening is None else int(opening[day, STAFF_MIN])
+    min_evening = max(min_closers, min_staff)
+    open_bit = window_mask(to_minutes(sh, sm), to_minutes(sh, sm) + 1)
+    close_bit = window_mask(to_minutes(eh, em) - 1, to_minutes(eh, em))
+
     morning_staff = []
     evening_staff = []
+    can_morning = {}
+    can_evening = {}
 
     for emp in available:
+        avail = day_availability(emp, day)
         # Vérifier si transition soir→matin interdite
-        can_do_morning = True
-        if day > 0:
+        can_do_morning = bool(avail & open_bit)
+        if day > 0 and can_do_morning:
             yesterday = schedule[emp.name][day - 1]
             if yesterday and yesterday.get('hours', 0) > 0 and yesterday['type'] == 'soir':
                 # Vérifier repos : fin soir veille → début matin lendemain
-                end_parts = yesterday['end'].split(':')
-                if end_parts[0]:
-                    end_min = int(end_parts[0]) * 60 + int(end_parts[1])
-                    sh, sm = HORAIRES[day][:2]
-                    start_min = to_minutes(sh, sm)
-                    rest = 24 * 60 - end_min + start_min
+                if yesterday['end']:
+                    rest = 24 * 60 - parse_minutes(yesterday['end']) + to_minutes(sh, sm)
                     if rest < 11 * 60:
                         can_do_morning = False
+        can_morning[emp.name] = can_do_morning
+        can_evening[emp.name] = bool(avail & close_bit)
 
         # Assignation selon les règles
-        if emp.name == "Alexandre Corchia":
+        if not can_evening[emp.name]:
+            morning_staff.append(emp)  # seule l'ouverture est dans ses disponibilités
+        elif emp.default_shift == 'soir':
             evening_staff.append(emp)
-        elif emp.name == "Baptiste Le Moing":
+        elif emp.default_shift == 'matin':
             morning_staff.append(emp)
-        elif emp.name == "Joseph Watrinet":
-            if can_do_morning:
-                # Joseph matin par défaut, sera déplacé soir si nécessaire
-                morning_staff.append(emp)
-            else:
-                evening_staff.append(emp)
-        elif emp.name in CDI_NAMES:
-            # Autres CDIs (extras CDI éventuels)
+        elif emp.default_shift == 'flex' or emp.name in CDI_NAMES:
+            # Joseph / autres CDIs : matin par défaut, soir si transition interdite
             if can_do_morning:
                 morning_staff.append(emp)
             else:
                 evening_staff.append(emp)
         else:
-            # Part-timers : soir par défaut, matin si nécessaire
-            if can_do_morning:
-                evening_staff.append(emp)  # soir par défaut
-            else:
-                evening_staff.append(emp)
+            # Part-timers : soir par défaut
+            evening_staff.append(emp)
 
-    # Garantir au moins 2 soir pour la fermeture
-    # Déplacer Joseph vers soir si nécessaire
-    while len(evening_staff) < 2 and morning_staff:
-        # Préférer déplacer Joseph (flexible), puis part-timers
-        joseph = [e for e in morning_staff if e.name == "Joseph Watrinet"]
-        non_baptiste = [e for e in morning_staff if e.name != "Baptiste Le Moing"]
-        if joseph:
-            evening_staff.append(joseph[0])
-            morning_staff.remove(joseph[0])
-        elif non_baptiste:
-            evening_staff.append(non_baptiste[0])
-            morning_staff.remove(non_baptiste[0])
+    # Garantir au moins 2 soir pour la fermeture (et l'effectif min l'après-midi)
+    while len(evening_staff) < min_evening and morning_staff:
+        # Préférer déplacer les flexibles (Joseph), puis les autres sauf 'matin'
+        movable = [e for e in morning_staff if e.default_shift != 'matin' and can_evening[e.name]]
+        flex = [e for e in movable if e.default_shift == 'flex']
+        if flex:
+            evening_staff.append(flex[0])
+            morning_staff.remove(flex[0])
+        elif movable:
+            evening_staff.append(movable[0])
+            morning_staff.remove(movable[0])
         else:
             break
 
-    # Si aucun matin et au moins 1 soir peut basculer
-    if not morning_staff and len(evening_staff) > 2:
-        # Chercher un part-timer qui peut faire matin
-        for emp in list(evening_staff):
-            if emp.name not in CDI_NAMES:
-                # Vérifier la transition
-                can_morning = True
-                if day > 0:
-                    yesterday = schedule[emp.name][day - 1]
-                    if yesterday and yesterday.get('hours', 0) > 0 and yesterday['type'] == 'soir':
-                        end_parts = yesterday['end'].split(':')
-                        if end_parts[0]:
-                            end_min = int(end_parts[0]) * 60 + int(end_parts[1])
-                            sh, sm = HORAIRES[day][:2]
-                            start_min = to_minutes(sh, sm)
-                            rest = 24 * 60 - end_min + start_min
-                            if rest < 11 * 60:
-                                can_morning = False
-                if can_morning:
-                    morning_staff.append(emp)
-                    evening_staff.remove(emp)
-                    break
+    # Matin sous l'effectif min et soir en surplus : un part-timer bascule
+    while len(morning_staff) < min_staff and len(evening_staff) > min_evening:
+        movable = [e for e in evening_staff if e.name not in CDI_NAMES and can_morning[e.name]]
+        if not movable:
+            break
+        morning_staff.append(movable[0])
+        evening_staff.remove(movable[0])
 
     return morning_staff, evening_staff
 
 
-def generate_week(week_num, extras=None, meeting_week=False, vacation=None, custom_off_days=None):
-    """Génère le planning pour une semaine du cycle de rotation."""
+def _lift_availability(emp, relax):
+    """Copie de l'employé disponible toute la journée les jours ('dispo', nom, jour) levés."""
+    lifted = {d for kind, name, d in relax if kind == 'dispo' and name == emp.name}
+    if not lifted:
+        return emp
+    availability = {d: m for d, m in (emp.availability or {}).items() if d not in lifted}
+    return replace(emp, available_days=set(emp.available_days) | lifted, availability=availability or None)
+
+
+def _week_inputs(week_num, extras=None, meeting_week=False, vacation=None, custom_off_days=None,
+                 absences=None, monday=None, dated_off=None, relax=None, rotation=None):
+    """Staff, jours off (rotation + congés) et absences datées d'une semaine (cf. generate_week)."""
     base_staff = [emp for emp in STAFF if emp.name != vacation] if vacation else list(STAFF)
     all_staff = base_staff + (extras or [])
-    off_days = get_off_days(week_num, meeting_week)
+    off_days = get_off_days(week_num, meeting_week, rotation)
     # Fusionner les jours d'absence custom (vacances par jour)
     if custom_off_days:
         off_days = dict(off_days)  # copie
@@ -353,22 +723,72 @@ def generate_week(week_num, extras=None, meeting_week=False, vacation=None, cust
                 off_days[emp_name] = off_days[emp_name] | days
             else:
                 off_days[emp_name] = days
+    if absences and monday:
+        dated_off = absences.week_off_days(monday)
+    dated_off = dated_off or {}
+    if relax:
+        all_staff = [_lift_availability(emp, relax) for emp in all_staff]
+        off_days = {n: {d for d in days if ('off', n, d) not in relax} for n, days in off_days.items()}
+        dated_off = {n: {d: k for d, k in days.items() if ('absence', n, d) not in relax}
+                     for n, days in dated_off.items()}
+    return all_staff, off_days, dated_off
+
+
+def _edge_bits(day, opening=None):
+    """Quarts d'heure d'ouverture et de fermeture du jour (il faut pouvoir l'un ou l'autre)."""
+    sh, sm, eh, em = opening_hours(day, opening)
+    open_min, close_min = to_minutes(sh, sm), to_minutes(eh, em)
+    return window_mask(open_min, open_min + 1) | window_mask(close_min - 1, close_min)
+
+
+def _day_status(emp, day, edge_bits, off_days, dated_off):
+    """Type de la case non travaillée de l'employé ce jour (jour ouvert), None s'il est disponible."""
+    if not day_availability(emp, day) & edge_bits:
+        return 'indispo'
+    if emp.name in off_days and day in off_days[emp.name]:
+        return 'conge'
+    return dated_off.get(emp.name, {}).get(day)
+
+
+def generate_week(week_num, extras=None, meeting_week=False, vacation=None, custom_off_days=None,
+                  absences=None, monday=None, targets=None, dated_off=None, breaks=False, opening=None,
+                  relax=None, rotation=None):
+    """Génère le planning pour une semaine du cycle de rotation.
+
+    Si `absences` (AbsenceCalendar) et `monday` sont fournis, les absences
+    datées de la semaine sont appliquées en plus de la rotation.
+    `targets` ({nom: heures}) remplace les heures contrat comme cible
+    hebdo (report du compteur d'heures). `dated_off` ({nom: {jour: type}})
+    fournit directement les absences datées déjà résolues pour la semaine.
+    Avec `breaks`, les pauses de 20 min sont placées (place_breaks).
+    `opening` : table d'ouverture (7, 4) de la semaine (horaires
+    exceptionnels, cf. OpeningExceptions), HORAIRES par défaut.
+    `relax` : contraintes levées par le diagnostic (cf. diagnose_week) :
+    ('off', nom, jour), ('absence', nom, jour), ('dispo', nom, jour).
+    `rotation` : rotation appliquée à la place de ROTATION et SUNDAY_ROTATION
+    (cf. get_off_days).
+    """
+    all_staff, off_days, dated_off = _week_inputs(week_num, extras, meeting_week, vacation, custom_off_days,
+                                                  absences, monday, dated_off, relax, rotation)
     schedule = {emp.name: [None] * 7 for emp in all_staff}
     weekly_hours = {emp.name: 0.0 for emp in all_staff}
 
     for day in range(7):
-        sh, sm, eh, em = HORAIRES[day]
+        if is_closed(day, opening):
+            for emp in all_staff:
+                schedule[emp.name][day] = {'type': 'ferme', 'start': '', 'end': '', 'hours': 0}
+            continue
+        sh, sm, eh, em = opening_hours(day, opening)
         open_min = to_minutes(sh, sm)
         close_min = to_minutes(eh, em)
 
-        # Qui est disponible ce jour ?
+        # Qui est disponible ce jour ? (il faut pouvoir ouvrir ou fermer)
+        edge_bits = _edge_bits(day, opening)
         available = []
         for emp in all_staff:
-            if day not in emp.available_days:
-                schedule[emp.name][day] = {'type': 'indispo', 'start': '', 'end': '', 'hours': 0}
-                continue
-            if emp.name in off_days and day in off_days[emp.name]:
-                schedule[emp.name][day] = {'type': 'conge', 'start': '', 'end': '', 'hours': 0}
+            kind = _day_status(emp, day, edge_bits, off_days, dated_off)
+            if kind:
+                schedule[emp.name][day] = {'type': kind, 'start': '', 'end': '', 'hours': 0}
                 continue
             available.append(emp)
 
@@ -377,7 +797,7 @@ def generate_week(week_num, extras=None, meeting_week=False, vacation=None, cust
 
         # ── Dimanche : 1 seul CDI en journée complète ──
         if day == 6:
-            preferred = SUNDAY_ROTATION.get(week_num)
+            preferred = (SUNDAY_ROTATION if rotation is None else rotation['sunday']).get(week_num)
             available_names = {e.name for e in available}
             if preferred and preferred in available_names:
                 chosen = next(e for e in available if e.name == preferred)
@@ -397,7 +817,7 @@ def generate_week(week_num, extras=None, meeting_week=False, vacation=None, cust
             continue
 
         # ── Jours Lun-Sam : assignation matin/soir ──
-        morning_staff, evening_staff = assign_shifts(available, day, schedule, week_num)
+        morning_staff, evening_staff = assign_shifts(available, day, schedule, week_num, opening)
 
         # Assigner les shifts matin (depuis l'ouverture)
         for emp in morning_staff:
@@ -429,7 +849,7 @@ def generate_week(week_num, extras=None, meeting_week=False, vacation=None, cust
     schedule, weekly_hours = fix_rest_time(schedule, weekly_hours, all_staff)
 
     # ── Ajustement final des heures ──
-    schedule, weekly_hours = adjust_hours(schedule, weekly_hours, all_staff)
+    schedule, weekly_hours = adjust_hours(schedule, weekly_hours, all_staff, targets, opening, breaks)
 
     # ── Ajustements manuels par semaine ──
     if week_num == 1:
@@ -439,11 +859,242 @@ def generate_week(week_num, extras=None, meeting_week=False, vacation=None, cust
     elif week_num == 3:
         schedule, weekly_hours = _override_week3(schedule, weekly_hours)
 
+    # ── Horaires exceptionnels (les ajustements par semaine visent HORAIRES) ──
+    if opening is not None:
+        schedule, weekly_hours = fit_opening(schedule, weekly_hours, opening, all_staff)
+
+    # ── Disponibilités au quart d'heure ──
+    schedule, weekly_hours = respect_availability(schedule, weekly_hours, all_staff)
+
+    # ── Pauses ──
+    if breaks:
+        schedule, weekly_hours = place_breaks(schedule, weekly_hours, all_staff, opening=opening)
+
     return schedule, weekly_hours
 
 
+# ── Génération en cache et horizon multi-semaines ────────────────────────
+
+_WEEK_CACHE_MAX = 1024
+
+
+@st.cache_resource(show_spinner=False)
+def _week_cache():
+    """Cache partagé entre reruns et sessions : clé figée → (schedule, heures)."""
+    return {}
+
+
+def _freeze(obj):
+    """Forme hashable et déterministe d'une entrée de generate_week."""
+    if isinstance(obj, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (set, frozenset)):
+        return tuple(sorted(obj))
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(v) for v in obj)
+    if isinstance(obj, Employee):
+        return (obj.name, obj.role, obj.contract_hours, _freeze(obj.available_days),
+                obj.is_alternant, obj.max_daily_hours, obj.default_shift,
+                _freeze(obj.availability), _freeze(obj.preferences), obj.hourly_rate, obj.skills)
+    return obj
+
+
+def copy_schedule(schedule):
+    """Copie indépendante d'un planning (les shifts sont des dicts modifiables)."""
+    return {name: [dict(e) if e else e for e in days] for name, days in schedule.items()}
+
+
+def generate_week_cached(week_num, extras=None, meeting_week=False, vacation=None, custom_off_days=None,
+                         absences=None, monday=None, targets=None, breaks=False, opening=None, rotation=None):
+    """generate_week mémoïsé sur les entrées effectives de la semaine.
+
+    Les absences datées sont résolues pour la semaine avant de former la clé :
+    deux semaines du même type sans absence partagent la même entrée. Le
+    résultat est une copie que l'appelant peut modifier.
+    """
+    dated_off = absences.week_off_days(monday) if absences and monday else None
+    key = (week_num, bool(meeting_week), vacation, _freeze(extras), _freeze(custom_off_days),
+           _freeze(dated_off), _freeze(targets), bool(breaks),
+           None if opening is None else opening.tobytes(), _freeze(rotation))
+    cache = _week_cache()
+    hit = cache.get(key)
+    if hit is None:
+        hit = generate_week(week_num, extras=extras, meeting_week=meeting_week, vacation=vacation,
+                            custom_off_days=custom_off_days, targets=targets, dated_off=dated_off,
+                            breaks=breaks, opening=opening, rotation=rotation)
+        if len(cache) >= _WEEK_CACHE_MAX:
+            cache.clear()
+        cache[key] = hit
+    schedule, weekly_hours = hit
+    return copy_schedule(schedule), dict(weekly_hours)
+
+
+def _reusable_day(previous, day, all_staff, opening, off_days, dated_off, breaks=False):
+    """True si les cases du jour de `previous` valent encore avec les entrées de la semaine.
+
+    Mêmes cases non travaillées (congé, indispo, absence, fermeture), des
+    shifts dans les disponibilités qui finissent au plus tard à la
+    fermeture, au moins un à l'ouverture et le minimum à la fermeture.
+    Un présent sans shift n'est admis que le dimanche (un seul CDI de garde).
+    Les pauses doivent correspondre à `breaks` : une pause sur chaque shift
+    d'au moins 6h avec, aucune sans.
+    """
+    closed = is_closed(day, opening)
+    if not closed:
+        sh, sm, eh, em = opening_hours(day, opening)
+        open_min, close_min = to_minutes(sh, sm), to_minutes(eh, em)
+        edge_bits = _edge_bits(day, opening)
+    first_start, closers = None, 0
+    for emp in all_staff:
+        entry = (previous.get(emp.name) or [None] * 7)[day]
+        if not entry:
+            return False
+        status = 'ferme' if closed else _day_status(emp, day, edge_bits, off_days, dated_off)
+        if entry.get('hours', 0) <= 0:
+            expected = status or ('conge' if day == 6 else None)
+            # Publié sans motif (mask_absences) : toute absence datée convient
+            if entry['type'] != expected and not (entry['type'] == 'absent' and expected in ABSENCE_TYPES):
+                return False
+            continue
+        if status:
+            return False
+        start, end = parse_minutes(entry['start']), parse_minutes(entry['end'])
+        if end > close_min or (emp.availability and not fits_availability(emp, day, start, end)):
+            return False
+        if bool(entry.get('break_start')) != (breaks and end - start >= BREAK_AFTER_MINUTES):
+            return False
+        first_start = start if first_start is None else min(first_start, start)
+        closers += end == close_min
+    if closed or first_start is None:
+        return True
+    required = int((DEFAULT_OPENING if opening is None else opening)[day, CLOSERS_MIN])
+    return first_start <= open_min and closers >= required
+
+
+def _short_rest(today, tomorrow):
+    """True si moins de 11h de repos séparent deux shifts de jours consécutifs."""
+    if not (today and today.get('hours', 0) > 0 and tomorrow and tomorrow.get('hours', 0) > 0):
+        return False
+    return 24 * 60 - parse_minutes(today['end']) + parse_minutes(tomorrow['start']) < MIN_REST_MINUTES
+
+
+def warm_start(previous, week_num, extras=None, meeting_week=False, vacation=None, custom_off_days=None,
+               absences=None, monday=None, targets=None, breaks=False, opening=None, rotation=None):
+    """Planning de la semaine en repartant de `previous` (planning publié).
+
+    `previous` : planning de la même semaine, de la même semaine du cycle ou
+    de la semaine calendaire précédente. Les jours dont les entrées n'ont pas
+    changé et dont la couverture tient (_reusable_day) reprennent ses
+    shifts tels quels ; seuls les autres jours viennent d'une génération
+    complète (generate_week_cached, mêmes arguments), faite seulement s'il
+    y en a. Un employé dont la cible d'heures (`targets`) s'écarte de ses
+    heures publiées d'au moins un quart d'heure voit tous ses jours
+    travaillés régénérés, pour que la cible s'applique. Retourne
+    (planning, heures, jours repris).
+    """
+    all_staff, off_days, dated_off = _week_inputs(week_num, extras, meeting_week, vacation, custom_off_days,
+                                                  absences, monday, rotation=rotation)
+    retarget = [emp.name for emp in all_staff if targets and emp.name in targets and previous.get(emp.name)
+                and abs(targets[emp.name] - sum(e.get('hours', 0) for e in previous[emp.name] if e)) >= 0.25]
+    reused = [d for d in range(7) if _reusable_day(previous, d, all_staff, opening, off_days, dated_off, breaks)
+              and not any(previous[n][d].get('hours', 0) > 0 for n in retarget)]
+    fresh = {}
+
+    def regenerated():
+        if not fresh:
+            fresh.update(generate_week_cached(
+                week_num, extras=extras, meeting_week=meeting_week, vacation=vacation,
+                custom_off_days=custom_off_days, absences=absences, monday=monday, targets=targets,
+                breaks=breaks, opening=opening, rotation=rotation,
+            )[0])
+        return fresh
+
+    def source(d):
+        return previous if d in reused else regenerated()
+
+    # Raccord jour repris / jour régénéré : pas de repos < 11h qu'aucun des deux plannings n'avait
+    names = [emp.name for emp in all_staff]
+    spliced = True
+    while spliced and len(reused) < 7:
+        spliced = False
+        for d in list(reused):
+            for x, y in ((d - 1, d), (d, d + 1)):
+                if x < 0 or y > 6 or (x in reused) == (y in reused):
+                    continue
+                if any(_short_rest(source(x)[n][x], source(y)[n][y])
+                       and not _short_rest(previous[n][x], previous[n][y])
+                       and not _short_rest(regenerated()[n][x], regenerated()[n][y]) for n in names):
+                    reused.remove(d)
+                    spliced = True
+                    break
+            if spliced:
+                break
+    def kept(name, d):
+        entry = dict(previous[name][d])
+        if entry['type'] == 'absent':  # motif masqué à la publication : repris des absences de la semaine
+            entry['type'] = dated_off[name][d]
+        return entry
+
+    schedule = {emp.name: [kept(emp.name, d) if d in reused else regenerated()[emp.name][d]
+                           for d in range(7)] for emp in all_staff}
+    weekly_hours = {name: sum(e.get('hours', 0) for e in days if e) for name, days in schedule.items()}
+    return schedule, weekly_hours, reused
+
+
+def generate_horizon(start_date, num_weeks, first_week_type, extras=None, vacation=None, absences=None,
+                     breaks=False, exceptions=None, overrides=None, staff_list=None, rotation=None):
+    """Génère `num_weeks` semaines consécutives depuis le lundi `start_date`.
+
+    Retourne une liste de (lundi, semaine du cycle, schedule, weekly_hours).
+    La réunion direction est détectée par date (semaine 3 uniquement).
+    `exceptions` (OpeningExceptions) : horaires exceptionnels datés.
+    `overrides` : modifications manuelles par semaine du cycle
+    {1: [...], 2: [...], 3: [...]}, appliquées comme sur la semaine affichée ;
+    `staff_list` : équipe de l'horizon (extras appelés compris, avec une
+    ligne vide les semaines sans eux), par défaut STAFF hors vacances plus `extras`.
+    `rotation` : rotation appliquée (cf. get_off_days).
+    """
+    horizon = []
+    current_monday = start_date
+    openings = horizon_openings(exceptions, start_date, num_weeks)
+    staff_list = staff_list or [emp for emp in STAFF if emp.name != vacation] + list(extras or [])
+    for w in range(num_weeks):
+        week_type = cycle_week_type(current_monday, start_date, first_week_type)
+        mw = is_meeting_week(current_monday) if week_type == 3 else False
+        schedule, weekly_hours = generate_week_cached(
+            week_type, extras=extras, meeting_week=mw, vacation=vacation,
+            absences=absences, monday=current_monday, breaks=breaks, opening=openings[w], rotation=rotation,
+        )
+        if overrides and overrides.get(week_type):
+            schedule, weekly_hours = apply_manual_overrides(schedule, weekly_hours, overrides[week_type])
+            if breaks:
+                schedule, weekly_hours = place_breaks(schedule, weekly_hours, staff_list, opening=openings[w])
+        for emp in staff_list:  # extra appelé une autre semaine du cycle : ligne vide
+            if emp.name not in schedule:
+                schedule[emp.name], weekly_hours[emp.name] = [None] * 7, 0.0
+        horizon.append((current_monday, week_type, schedule, weekly_hours))
+        current_monday += datetime.timedelta(weeks=1)
+    return horizon
+
+
+def horizon_openings(exceptions, first_monday, num_weeks):
+    """Table d'ouverture de chaque semaine de l'horizon (None : HORAIRES)."""
+    if not exceptions:
+        return [None] * num_weeks
+    table = exceptions.horizon_array(first_monday, num_weeks)
+    return [None if np.array_equal(week, DEFAULT_OPENING) else week for week in table]
+
+
 # ── Helpers pour ajuster les shifts ──────────────────────────────────────
 
+def _is_present(schedule, name, day):
+    """False si l'employé est absent du planning ou en absence datée ce jour."""
+    if name not in schedule:
+        return False
+    entry = schedule[name][day]
+    return not (entry and entry['type'] in ABSENCE_TYPES)
+
+
 def _reduce_shift(entry, hours_to_remove):
     """Réduit un shift : soir → commence plus tard, matin → finit plus tôt."""
     parts_key = 'start' if entry['type'] == 'soir' else 'end'
@@ -477,17 +1128,19 @@ def _override_week1(schedule, weekly_hours):
     """
     alex = "Alexandre Corchia"
     for day, h in [(0, 2.0), (1, 1.0), (2, 1.0), (5, 1.0)]:
-        entry = schedule[alex][day]
+        entry = schedule[alex][day] if alex in schedule else None
         if entry and entry['hours'] > 0:
             _reduce_shift(entry, h)
             weekly_hours[alex] -= h
-    schedule[alex][6] = make_shift('soir', 14, 15, 19, 15)
-    weekly_hours[alex] += schedule[alex][6]['hours']
+    if _is_present(schedule, alex, 6):
+        schedule[alex][6] = make_shift('soir', 14, 15, 19, 15)
+        weekly_hours[alex] += schedule[alex][6]['hours']
 
     joseph = "Joseph Watrinet"
-    old_h = schedule[joseph][5]['hours'] if schedule[joseph][5] and schedule[joseph][5].get('hours', 0) > 0 else 0
-    schedule[joseph][5] = make_shift('matin', 9, 15, 17, 15)
-    weekly_hours[joseph] += schedule[joseph][5]['hours'] - old_h
+    if _is_present(schedule, joseph, 5):
+        old_h = schedule[joseph][5]['hours'] if schedule[joseph][5] and schedule[joseph][5].get('hours', 0) > 0 else 0
+        schedule[joseph][5] = make_shift('matin', 9, 15, 17, 15)
+        weekly_hours[joseph] += schedule[joseph][5]['hours'] - old_h
 
     return schedule, weekly_hours
 
@@ -499,15 +1152,18 @@ def _override_week2(schedule, weekly_hours):
     """
     alex = "Alexandre Corchia"
     for day, h in [(0, 2.0), (3, 1.0), (4, 1.0), (5, 1.0)]:
-        entry = schedule[alex][day]
+        entry = schedule[alex][day] if alex in schedule else None
         if entry and entry['hours'] > 0:
             _reduce_shift(entry, h)
             weekly_hours[alex] -= h
-    schedule[alex][6] = make_shift('soir', 14, 15, 19, 15)
-    weekly_hours[alex] += schedule[alex][6]['hours']
+    if _is_present(schedule, alex, 6):
+        schedule[alex][6] = make_shift('soir', 14, 15, 19, 15)
+        weekly_hours[alex] += schedule[alex][6]['hours']
 
     joseph, maxime = "Joseph Watrinet", "Maxime Bancquart"
     for day in [3, 4]:
+        if not (_is_present(schedule, joseph, day) and _is_present(schedule, maxime, day)):
+            continue
         sh, sm = HORAIRES[day][:2]
         eh, em = HORAIRES[day][2:]
         # Joseph → matin
@@ -533,6 +1189,8 @@ def _override_week3(schedule, weekly_hours):
     """
     joseph, baptiste = "Joseph Watrinet", "Baptiste Le Moing"
     sh, sm, eh, em = HORAIRES[6]
+    if not (_is_present(schedule, joseph, 6) and _is_present(schedule, baptiste, 6)):
+        return schedule, weekly_hours
 
     # Retirer les shifts dimanche existants
     for name in [baptiste, joseph]:
@@ -578,17 +1236,206 @@ def _override_week3(schedule, weekly_hours):
     return schedule, weekly_hours
 
 
+def respect_availability(schedule, weekly_hours, staff_list=None):
+    """Raccourcit les shifts qui débordent des disponibilités au quart d'heure.
+
+    Un soir garde sa fin (fermeture) et commence au début de la plage
+    disponible qui la contient ; un matin ou une journée garde son début.
+    Si l'ancre elle-même est indisponible, le shift est retiré.
+    """
+    staff_list = staff_list or STAFF
+    for emp in staff_list:
+        if not emp.availability or emp.name not in schedule:
+            continue
+        for d, entry in enumerate(schedule[emp.name]):
+            if not (entry and entry.get('hours', 0) > 0):
+                continue
+            start, end = parse_minutes(entry['start']), parse_minutes(entry['end'])
+            avail = day_availability(emp, d)
+            if window_mask(start, end) & ~avail == 0:
+                continue
+            lo = start // SLOT_MINUTES
+            hi = -(-end // SLOT_MINUTES)
+            if entry['type'] == 'soir':
+                cut = hi
+                while cut > lo and avail >> (cut - 1) & 1:
+                    cut -= 1
+                start = max(start, cut * SLOT_MINUTES)
+            else:
+                cut = lo
+                while cut < hi and avail >> cut & 1:
+                    cut += 1
+                end = min(end, cut * SLOT_MINUTES)
+
+            old_h = entry['hours']
+            if end <= start:
+                schedule[emp.name][d] = {'type': 'indispo', 'start': '', 'end': '', 'hours': 0}
+                weekly_hours[emp.name] -= old_h
+                continue
+            entry['start'] = time_str(*from_minutes(start))
+            entry['end'] = time_str(*from_minutes(end))
+            entry['hours'] = min(round((end - start) / 60 * 4) / 4, old_h)
+            weekly_hours[emp.name] += entry['hours'] - old_h
+    return schedule, weekly_hours
+
+
+def fit_opening(schedule, weekly_hours, opening, staff_list=None):
+    """Recale les shifts des jours à horaires exceptionnels sur la table `opening`.
+
+    Un soir finit à la fermeture, un matin commence à l'ouverture, en gardant
+    leur durée dans la limite de la fenêtre ; une journée part de l'ouverture
+    et couvre la fenêtre dans la limite de la durée max de l'employé (les
+    heures restent celles du shift). Un jour fermé n'a aucun shift.
+    """
+    staff_list = staff_list or STAFF
+    for day in range(7):
+        if np.array_equal(opening[day], DEFAULT_OPENING[day]):
+            continue
+        open_min, close_min = int(opening[day, OPEN]), int(opening[day, CLOSE])
+        for emp in staff_list:
+            days = schedule.get(emp.name)
+            entry = days[day] if days else None
+            if not (entry and entry.get('hours', 0) > 0):
+                continue
+            old_h = entry['hours']
+            if close_min <= open_min:
+                days[day] = {'type': 'ferme', 'start': '', 'end': '', 'hours': 0}
+                weekly_hours[emp.name] -= old_h
+                continue
+            length = parse_minutes(entry['end']) - parse_minutes(entry['start'])
+            if entry['type'] == 'soir':
+                start, end = max(open_min, close_min - length), close_min
+            elif entry['type'] == 'journee':
+                start, end = open_min, min(close_min, open_min + int(emp.max_daily_hours * 60))
+            else:
+                start, end = open_min, min(close_min, open_min + length)
+            days[day] = make_shift(entry['type'], *from_minutes(start), *from_minutes(end))
+            weekly_hours[emp.name] += days[day]['hours'] - old_h
+    return schedule, weekly_hours
+
+
+# ── Pauses (20 min dès 6h de travail) ────────────────────────────────────
+
+BREAK_AFTER_MINUTES = 6 * 60    # pause obligatoire dès 6h de travail
+BREAK_MINUTES = 20
+BREAK_PAID = False
+BREAK_EDGE_MINUTES = 60         # pas de pause dans la 1re ni la dernière heure du shift
+CLOSING_RUSH_MINUTES = 60       # dernière heure Lun-Sam : 2 personnes (règle fermeture)
+
+
+def required_coverage(day, opening=None, demand=None):
+    """Effectif minimum par minute du jour : 1 pendant l'ouverture, 2 la dernière heure Lun-Sam.
+
+    Avec `opening`, fenêtre et minimums viennent de la table du jour. Avec
+    `demand` (effectif prévu par quart d'heure du jour, week_demand), le
+    minimum monte au besoin prévu pendant l'ouverture.
+    """
+    row = DEFAULT_OPENING[day] if opening is None else opening[day]
+    open_min, close_min = int(row[OPEN]), int(row[CLOSE])
+    required = np.zeros(24 * 60, dtype=np.int16)
+    required[open_min:close_min] = row[STAFF_MIN]
+    rush = max(close_min - CLOSING_RUSH_MINUTES, open_min)
+    required[rush:close_min] = max(row[STAFF_MIN], row[CLOSERS_MIN])
+    if demand is not None:
+        need = np.repeat(np.asarray(demand, dtype=np.int16), SLOT_MINUTES)
+        required[open_min:close_min] = np.maximum(required[open_min:close_min], need[open_min:close_min])
+    return required
+
+
+def coverage_profile(schedule, day, staff_list=None, with_breaks=True):
+    """Fonction en escalier : personnes présentes à chaque minute (pauses déduites)."""
+    staff_list = staff_list or STAFF
+    delta = np.zeros(24 * 60 + 1, dtype=np.int16)
+    for emp in staff_list:
+        days = schedule.get(emp.name)
+        entry = days[day] if days else None
+        if not (entry and entry.get('hours', 0) > 0):
+            continue
+        delta[parse_minutes(entry['start'])] += 1
+        delta[parse_minutes(entry['end'])] -= 1
+        if with_breaks and entry.get('break_start'):
+            b = parse_minutes(entry['break_start'])
+            delta[b] -= 1
+            delta[b + entry['break_min']] += 1
+    return np.cumsum(delta[:-1])
+
+
+def place_breaks(schedule, weekly_hours, staff_list=None, paid=BREAK_PAID, opening=None):
+    """Place une pause de 20 min dans chaque shift d'au moins 6h, en décalant les pauses.
+
+    Balayage par jour : la couverture (coverage_profile) est calculée une fois,
+    puis les shifts sont traités du créneau de pause le plus contraint au plus
+    large. Chaque pause prend le quart d'heure le plus central de sa fenêtre
+    légale (au plus 6h de travail avant et après) qui garde la couverture
+    au-dessus de required_coverage ; à défaut, celui qui la dégrade le moins.
+    Une pause non payée est retirée des heures du shift et de la semaine.
+    Les shifts qui ont déjà une pause sont conservés tels quels.
+    """
+    staff_list = staff_list or STAFF
+    for day in range(7):
+        todo = []
+        for emp in staff_list:
+            days = schedule.get(emp.name)
+            entry = days[day] if days else None
+            if not (entry and entry.get('hours', 0) > 0) or entry.get('break_start'):
+                continue
+            start, end = parse_minutes(entry['start']), parse_minutes(entry['end'])
+            if end - start < BREAK_AFTER_MINUTES:
+                continue
+            lo = max(start + BREAK_EDGE_MINUTES, end - BREAK_AFTER_MINUTES - BREAK_MINUTES)
+            hi = min(start + BREAK_AFTER_MINUTES, end - BREAK_EDGE_MINUTES - BREAK_MINUTES)
+            lo = -(-lo // SLOT_MINUTES) * SLOT_MINUTES
+            candidates = list(range(lo, hi + 1, SLOT_MINUTES)) or [lo]
+            middle = (lo + hi) / 2
+            candidates.sort(key=lambda b: abs(b - middle))
+            todo.append((len(candidates), start, emp, entry, candidates))
+        if not todo:
+            continue
+
+        coverage = coverage_profile(schedule, day, staff_list)
+        required = required_coverage(day, opening)
+        todo.sort(key=lambda t: (t[0], t[1]))
+        for _, _, emp, entry, candidates in todo:
+            best, best_slack = None, None
+            for b in candidates:
+                slack = int((coverage[b:b + BREAK_MINUTES] - 1 - required[b:b + BREAK_MINUTES]).min())
+                if best_slack is None or slack > best_slack:
+                    best, best_slack = b, slack
+                if slack >= 0:
+                    best = b
+                    break
+            coverage[best:best + BREAK_MINUTES] -= 1
+            entry['break_start'] = time_str(*from_minutes(best))
+            entry['break_min'] = BREAK_MINUTES
+            entry['break_paid'] = paid
+            if not paid:
+                entry['hours'] -= BREAK_MINUTES / 60
+                weekly_hours[emp.name] -= BREAK_MINUTES / 60
+    return schedule, weekly_hours
+
+
+def unpaid_break_minutes(entry):
+    """Minutes de pause non payée d'un shift (0 sans pause)."""
+    if entry and entry.get('break_start') and not entry.get('break_paid'):
+        return entry['break_min']
+    return 0
+
+
 def apply_manual_overrides(schedule, weekly_hours, overrides):
-    """Applique les modifications manuelles de shifts."""
+    """Applique les modifications manuelles de shifts.
+
+    Un employé sans ligne dans le planning (extra du vivier appelé par une
+    réparation) y est ajouté.
+    """
     for ov in overrides:
         name = ov['employee']
         day = ov['day']
         if name not in schedule:
-            continue
+            schedule[name], weekly_hours[name] = [None] * 7, 0.0
         old = schedule[name][day]
         old_h = old['hours'] if old and old.get('hours', 0) > 0 else 0
-        if ov['type'] == 'conge':
-            schedule[name][day] = {'type': 'conge', 'start': '', 'end': '', 'hours': 0}
+        if ov['type'] == 'conge' or ov['type'] in ABSENCE_TYPES:
+            schedule[name][day] = {'type': ov['type'], 'start': '', 'end': '', 'hours': 0}
             weekly_hours[name] -= old_h
         else:
             s_parts = ov['start'].split(':')
@@ -662,15 +1509,35 @@ def fix_rest_time(schedule, weekly_hours, staff_list=None):
     return schedule, weekly_hours
 
 
-def adjust_hours(schedule, weekly_hours, staff_list=None):
-    """Ajuste les shifts pour rapprocher les heures hebdo des contrats."""
+def expected_break_hours(entry):
+    """Heures de pause non payée que place_breaks retirera de ce shift (0 sinon)."""
+    if BREAK_PAID or not (entry and entry.get('hours', 0) > 0) or entry.get('break_start'):
+        return 0.0
+    span = parse_minutes(entry['end']) - parse_minutes(entry['start'])
+    return BREAK_MINUTES / 60 if span >= BREAK_AFTER_MINUTES else 0.0
+
+
+def adjust_hours(schedule, weekly_hours, staff_list=None, targets=None, opening=None, breaks=False):
+    """Ajuste les shifts pour rapprocher les heures hebdo des contrats.
+
+    Une cible fournie dans `targets` s'applique aussi aux temps partiels.
+    Les shifts restent ancrés sur l'ouverture / la fermeture de `opening`.
+    Avec `breaks`, la cible porte sur les heures payées : les pauses non
+    payées que place_breaks posera ensuite (expected_break_hours) sont
+    déduites avant de calculer l'écart.
+    """
     staff_list = staff_list or STAFF
     for emp in staff_list:
-        target = emp.contract_hours
-        if emp.contract_hours <= 21:
+        if targets and emp.name in targets:
+            target = targets[emp.name]
+        elif emp.contract_hours <= 21:
             continue
+        else:
+            target = emp.contract_hours
 
         current = weekly_hours[emp.name]
+        if breaks:
+            current -= sum(expected_break_hours(entry) for entry in schedule[emp.name])
         diff = target - current
 
         if abs(diff) < 0.25:
@@ -696,7 +1563,7 @@ def adjust_hours(schedule, weekly_hours, staff_list=None):
             new_hours = max(new_hours, 5.0)
             new_hours = round(new_hours * 4) / 4
 
-            sh, sm, eh, em = HORAIRES[d]
+            sh, sm, eh, em = opening_hours(d, opening)
 
             if entry['type'] == 'soir':
                 start = to_minutes(eh, em) - int(new_hours * 60)
@@ -714,82 +1581,188 @@ def adjust_hours(schedule, weekly_hours, staff_list=None):
     return schedule, weekly_hours
 
 
-def check_labor_law(schedule, weekly_hours, staff_list=None):
-    """Vérifie la conformité avec le droit du travail français."""
-    staff_list = staff_list or STAFF
-    warnings = []
-    staffing_issues = []
+# ── Règles du droit du travail (profils compilés) ────────────────────────
 
-    for emp in staff_list:
-        # Max heures par jour
-        for d in range(7):
-            entry = schedule[emp.name][d]
-            if entry and entry.get('hours', 0) > emp.max_daily_hours + 0.01:
-                label = '8h alternant' if emp.is_alternant else '10h'
-                warnings.append(
-                    f"{emp.name} : {entry['hours']:.1f}h le {JOURS[d]} (max {label})"
-                )
+@dataclass(frozen=True)
+class LaborRule:
+    """Règle déclarative d'un profil : `kind` (cf. _RULE_FACTORIES) et sa limite.
 
-        # Max 48h/semaine
-        total = weekly_hours[emp.name]
-        if total > 48:
-            warnings.append(f"{emp.name} : {total:.1f}h/semaine (max 48h)")
+    `cdi_only` restreint la règle aux CDI (CDI_NAMES).
+    """
+    kind: str
+    limit: float = 0
+    cdi_only: bool = False
+
+
+LABOR_PROFILES = {
+    'general': (
+        LaborRule('daily_max', 10), LaborRule('availability'), LaborRule('weekly_max', 48),
+        LaborRule('consecutive_days', 6), LaborRule('min_rest', 11),
+        LaborRule('consecutive_off', 2, cdi_only=True),
+    ),
+    'apprenti_mineur': (
+        LaborRule('daily_max', 8), LaborRule('availability'), LaborRule('weekly_max', 35),
+        LaborRule('consecutive_days', 5), LaborRule('min_rest', 12), LaborRule('latest_end', 22),
+        LaborRule('consecutive_off', 2),
+    ),
+    'hcr': (
+        LaborRule('daily_max', 11), LaborRule('availability'), LaborRule('weekly_max', 48),
+        LaborRule('consecutive_days', 6), LaborRule('min_rest', 11), LaborRule('days_off', 2),
+        LaborRule('consecutive_off', 2, cdi_only=True),
+    ),
+}
+LABOR_PROFILE_LABELS = {
+    'general': "Code du travail",
+    'apprenti_mineur': "Apprenti de moins de 18 ans",
+    'hcr': "Convention HCR",
+}
 
-        # Max 6 jours consécutifs
-        consecutive = 0
-        max_consecutive = 0
-        for d in range(7):
-            entry = schedule[emp.name][d]
-            if entry and entry.get('hours', 0) > 0:
-                consecutive += 1
-                max_consecutive = max(max_consecutive, consecutive)
-            else:
-                consecutive = 0
-        if max_consecutive > 6:
-            warnings.append(f"{emp.name} : {max_consecutive} jours consécutifs (max 6)")
 
-        # Min 11h repos entre shifts
-        for d in range(6):
-            entry_today = schedule[emp.name][d]
-            entry_tomorrow = schedule[emp.name][d + 1]
-            if (entry_today and entry_today.get('hours', 0) > 0 and
-                    entry_tomorrow and entry_tomorrow.get('hours', 0) > 0):
-                end_parts = entry_today['end'].split(':')
-                start_parts = entry_tomorrow['start'].split(':')
-                if end_parts[0] and start_parts[0]:
-                    end_min = int(end_parts[0]) * 60 + int(end_parts[1])
-                    start_min = int(start_parts[0]) * 60 + int(start_parts[1])
-                    rest = (24 * 60 - end_min + start_min) / 60
-                    if rest < 11:
-                        warnings.append(
-                            f"{emp.name} : {rest:.1f}h de repos entre "
-                            f"{JOURS[d]} et {JOURS[d+1]} (min 11h)"
-                        )
-
-    # Vérifier 2 jours de repos consécutifs (CDI uniquement)
+def _daily_max_rule(rule):
+    def check(emp, f):
+        limit = min(rule.limit, emp.max_daily_hours)
+        label = f"{limit:g}h alternant" if emp.is_alternant else f"{limit:g}h"
+        return [f"{emp.name} : {h:.1f}h le {JOURS[d]} (max {label})"
+                for d, h in enumerate(f['hours']) if h > limit + 0.01]
+    return check
+
+
+def _availability_rule(rule):
+    def check(emp, f):
+        return [f"{emp.name} : {e['start']}-{e['end']} le {JOURS[d]} hors disponibilités"
+                for d, e in f['worked'] if not fits_availability(emp, d, f['starts'][d], f['ends'][d])]
+    return check
+
+
+def _weekly_max_rule(rule):
+    def check(emp, f):
+        if f['total'] > rule.limit:
+            return [f"{emp.name} : {f['total']:.1f}h/semaine (max {rule.limit:g}h)"]
+        return []
+    return check
+
+
+def _consecutive_days_rule(rule):
+    def check(emp, f):
+        if f['longest_run'] > rule.limit:
+            return [f"{emp.name} : {f['longest_run']} jours consécutifs (max {rule.limit:g})"]
+        return []
+    return check
+
+
+def _min_rest_rule(rule):
+    def check(emp, f):
+        return [f"{emp.name} : {rest:.1f}h de repos entre {JOURS[d]} et {JOURS[d + 1]} (min {rule.limit:g}h)"
+                for d, rest in f['rests'] if rest < rule.limit]
+    return check
+
+
+def _latest_end_rule(rule):
+    def check(emp, f):
+        return [f"{emp.name} : fin à {e['end']} le {JOURS[d]} (pas de travail après {rule.limit:g}h)"
+                for d, e in f['worked'] if f['ends'][d] > rule.limit * 60]
+    return check
+
+
+def _days_off_rule(rule):
+    def check(emp, f):
+        if len(f['off']) < rule.limit:
+            return [f"{emp.name} : {len(f['off'])} jour(s) de repos (min {rule.limit:g})"]
+        return []
+    return check
+
+
+def _consecutive_off_rule(rule):
+    def check(emp, f):
+        # Repos consécutifs, Dimanche(6) + Lundi(0) compris
+        off = set(f['off'])
+        if not off or any(all((d + i) % 7 in off for i in range(int(rule.limit))) for d in off):
+            return []
+        return [f"{emp.name} : pas de {rule.limit:g} jours de repos consécutifs "
+                f"(off : {', '.join(JOURS[d] for d in f['off'])})"]
+    return check
+
+
+_RULE_FACTORIES = {
+    'daily_max': _daily_max_rule,
+    'availability': _availability_rule,
+    'weekly_max': _weekly_max_rule,
+    'consecutive_days': _consecutive_days_rule,
+    'min_rest': _min_rest_rule,
+    'latest_end': _latest_end_rule,
+    'days_off': _days_off_rule,
+    'consecutive_off': _consecutive_off_rule,
+}
+
+
+def _week_features(days, total):
+    """Un seul passage sur la semaine d'un employé : tout ce que lisent les règles."""
+    hours, starts, ends = [0.0] * 7, [0] * 7, [0] * 7
+    worked, off, rests = [], [], []
+    run = longest_run = 0
+    for d, entry in enumerate(days):
+        if entry and entry.get('hours', 0) > 0:
+            hours[d] = entry['hours']
+            starts[d], ends[d] = parse_minutes(entry['start']), parse_minutes(entry['end'])
+            if worked and worked[-1][0] == d - 1:
+                rests.append((d - 1, (24 * 60 - ends[d - 1] + starts[d]) / 60))
+            worked.append((d, entry))
+            run += 1
+            longest_run = max(longest_run, run)
+        else:
+            if entry:
+                hours[d] = entry.get('hours', 0)
+            off.append(d)
+            run = 0
+    return {'hours': hours, 'starts': starts, 'ends': ends, 'worked': worked, 'off': off,
+            'rests': rests, 'longest_run': longest_run, 'total': total}
+
+
+def compile_profile(rules):
+    """Compile des règles en une fonction (employé, semaine, total) → [alertes].
+
+    La semaine est lue une seule fois (_week_features) ; chaque règle n'est
+    plus qu'un prédicat sur ces grandeurs.
+    """
+    checks = [(rule.cdi_only, _RULE_FACTORIES[rule.kind](rule)) for rule in rules]
+
+    def check(emp, days, total):
+        features = _week_features(days, total)
+        warnings = []
+        for cdi_only, predicate in checks:
+            if not cdi_only or emp.name in CDI_NAMES:
+                warnings.extend(predicate(emp, features))
+        return warnings
+    return check
+
+
+COMPILED_PROFILES = {key: compile_profile(rules) for key, rules in LABOR_PROFILES.items()}
+
+
+def check_labor_law(schedule, weekly_hours, staff_list=None, opening=None, profiles=None):
+    """Vérifie la conformité avec le droit du travail français.
+
+    Chaque employé est contrôlé par son profil (Employee.labor_profile, ou
+    `profiles` {nom: profil}, cf. LABOR_PROFILES). `opening` : table
+    d'ouverture de la semaine (fermeture et minimum de personnes à la
+    fermeture par jour), HORAIRES par défaut.
+    """
+    staff_list = staff_list or STAFF
+    profiles = profiles or {}
+    warnings = []
+    staffing_issues = []
+
     for emp in staff_list:
-        if emp.name not in CDI_NAMES:
-            continue
-        off_days = [d for d in range(7) if not (schedule[emp.name][d]
-                    and schedule[emp.name][d].get('hours', 0) > 0)]
-        has_consecutive = any(
-            off_days[i + 1] - off_days[i] == 1
-            for i in range(len(off_days) - 1)
-        )
-        # Wrap-around : Dimanche(6) + Lundi(0) = consécutifs
-        if not has_consecutive and 6 in off_days and 0 in off_days:
-            has_consecutive = True
-        if not has_consecutive and off_days:
-            warnings.append(
-                f"{emp.name} : pas de 2 jours de repos consécutifs "
-                f"(off : {', '.join(JOURS[d] for d in off_days)})"
-            )
+        check = COMPILED_PROFILES[profiles.get(emp.name, emp.labor_profile)]
+        warnings.extend(check(emp, schedule[emp.name], weekly_hours[emp.name]))
 
-    # Vérifier 2 personnes à la fermeture (Lun-Sam uniquement, pas dimanche)
+    # Vérifier 2 personnes à la fermeture Lun-Sam (1 le dimanche ; jours
+    # exceptionnels : minimum de la table d'ouverture)
     for d in range(7):
-        if d == 6:  # Dimanche : pas de contrainte 2 personnes fermeture
+        required = int((DEFAULT_OPENING if opening is None else opening)[d, CLOSERS_MIN])
+        if is_closed(d, opening):
             continue
-        sh, sm, eh, em = HORAIRES[d]
+        sh, sm, eh, em = opening_hours(d, opening)
         closing_time = time_str(eh, em)
         closers = []
         for emp in staff_list:
@@ -797,216 +1770,2825 @@ def check_labor_law(schedule, weekly_hours, staff_list=None):
             if entry and entry.get('end') == closing_time and entry.get('hours', 0) > 0:
                 closers.append(emp.name.split()[0])
 
-        if len(closers) < 2:
+        if len(closers) < required:
             staffing_issues.append({
                 'day': JOURS[d],
                 'closers': closers,
                 'count': len(closers),
+                'required': required,
             })
 
+    # Effectif min pendant l'ouverture (« Min. présents » de la table), pauses ignorées
+    table = DEFAULT_OPENING if opening is None else opening
+    for d in range(7):
+        if is_closed(d, opening):
+            continue
+        open_min, close_min, minimum = int(table[d, OPEN]), int(table[d, CLOSE]), int(table[d, STAFF_MIN])
+        cover = coverage_profile(schedule, d, staff_list, with_breaks=False)[open_min:close_min]
+        short = np.flatnonzero(np.diff(np.concatenate(([0], (cover < minimum).astype(np.int8), [0]))))
+        for start, end in zip(short[::2], short[1::2]):
+            warnings.append(
+                f"{JOURS[d]} : {int(cover[start:end].min())} présent(s) de "
+                f"{time_str(*from_minutes(open_min + start))} à {time_str(*from_minutes(open_min + end))} "
+                f"(min {minimum})"
+            )
+
+    # Pauses sans relève (couverture sous le minimum pendant la pause)
+    for d in range(7):
+        on_break = [
+            emp for emp in staff_list
+            if schedule[emp.name][d] and schedule[emp.name][d].get('break_start')
+            and schedule[emp.name][d].get('hours', 0) > 0
+        ]
+        if not on_break:
+            continue
+        short = coverage_profile(schedule, d, staff_list) < required_coverage(d, opening)
+        for emp in on_break:
+            entry = schedule[emp.name][d]
+            b = parse_minutes(entry['break_start'])
+            if short[b:b + entry['break_min']].any():
+                warnings.append(
+                    f"{emp.name} : pause {entry['break_start']} le {JOURS[d]} sans relève"
+                )
+
     return warnings, staffing_issues
 
 
-# ── Export Connecteam ─────────────────────────────────────────────────────
+# ── Compétences requises (bitsets au quart d'heure) ──────────────────────
 
-def time_24_to_12(t):
-    """Convertit '09:45' → '09:45am', '15:00' → '03:00pm', '23:15' → '11:15pm'."""
-    parts = t.split(':')
-    h, m = int(parts[0]), int(parts[1])
-    if h == 0:
-        return f"12:{m:02d}am"
-    elif h < 12:
-        return f"{h:02d}:{m:02d}am"
-    elif h == 12:
-        return f"12:{m:02d}pm"
-    else:
-        return f"{h - 12:02d}:{m:02d}pm"
+@dataclass
+class SkillRule:
+    """Au moins une personne ayant l'une des compétences `skills` présente.
 
+    `windows` : {jour: masque 96 quarts d'heure} des plages concernées
+    (cf. windows) ; None → le dernier quart d'heure avant la fermeture.
+    """
+    label: str
+    skills: int
+    windows: dict = None
 
-SHIFT_TITLES = {'matin': 'Matin', 'soir': 'Soir', 'journee': 'Journée'}
 
+def skill_rules(lessons=None):
+    """Règles par défaut : manager ou CDI senior à la fermeture, coach pendant
+    les cours réservés (`lessons` : {jour: "10:00-12:00, 18:00-20:00"})."""
+    rules = [SkillRule("Manager ou CDI senior à la fermeture", skill_mask('manager', 'senior'))]
+    lessons = {d: text for d, text in (lessons or {}).items() if text and text.strip()}
+    if lessons:
+        rules.append(SkillRule("Coach pendant les cours", skill_mask('coach'), windows(lessons)))
+    return rules
 
-def export_connecteam_csv(start_date, num_weeks, first_week_type, extras=None, vacation=None):
-    """Génère un CSV Connecteam pour une plage de dates."""
-    base_staff = [emp for emp in STAFF if emp.name != vacation] if vacation else list(STAFF)
-    all_staff = base_staff + (extras or [])
-    header = "Date,Start,End,Timezone,Unpaid break,Paid break,Shift title,Job,Sub item,Shift tags,Users,Address,Note,Number of users,Require Approval,Tasks"
-    rows = [header]
 
-    current_monday = start_date
-    for week_offset in range(num_weeks):
-        week_type = ((first_week_type - 1 + week_offset) % 3) + 1
-        # Détection réunion automatique par date
-        mw = is_meeting_week(current_monday) if week_type == 3 else False
-        schedule, _ = generate_week(week_type, extras=extras, meeting_week=mw, vacation=vacation)
+def mask_slots(mask):
+    """Masque 96 quarts d'heure → tableau booléen (96,)."""
+    raw = np.frombuffer(mask.to_bytes(SLOTS_PER_DAY // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder='little').astype(bool)
 
-        for day in range(7):
-            current_date = current_monday + datetime.timedelta(days=day)
-            for emp in all_staff:
-                entry = schedule[emp.name][day]
-                if not entry or entry.get('hours', 0) == 0:
+
+def skill_profile(schedule, day, staff_list=None, with_breaks=True):
+    """Compétences présentes par quart d'heure (96) : OU des bitsets des présents.
+
+    Un quart d'heure ne compte que les personnes présentes sur tout le
+    quart d'heure (pauses déduites).
+    """
+    staff_list = staff_list or STAFF
+    present = np.zeros(24 * 60, dtype=np.uint64)
+    for emp in staff_list:
+        days = schedule.get(emp.name)
+        entry = days[day] if days else None
+        if not (emp.skills and entry and entry.get('hours', 0) > 0):
+            continue
+        bits = np.uint64(emp.skills)
+        start, end = parse_minutes(entry['start']), parse_minutes(entry['end'])
+        if with_breaks and entry.get('break_start'):
+            b = parse_minutes(entry['break_start'])
+            present[start:b] |= bits
+            present[b + entry['break_min']:end] |= bits
+        else:
+            present[start:end] |= bits
+    return np.bitwise_and.reduce(present.reshape(SLOTS_PER_DAY, SLOT_MINUTES), axis=1)
+
+
+def check_skills(schedule, staff_list=None, rules=None, opening=None):
+    """Plages où une règle de compétence n'est pas tenue.
+
+    Retourne [{'day', 'rule', 'start', 'end'}], une entrée par plage
+    continue de quarts d'heure sans la compétence requise.
+    """
+    rules = skill_rules() if rules is None else rules
+    issues = []
+    slots = np.arange(SLOTS_PER_DAY)
+    for day in range(7):
+        if is_closed(day, opening):
+            continue
+        present = skill_profile(schedule, day, staff_list)
+        close_slot = to_minutes(*opening_hours(day, opening)[2:]) // SLOT_MINUTES
+        for rule in rules:
+            if rule.windows is None:
+                needed = slots == close_slot - 1
+            else:
+                needed = mask_slots(rule.windows.get(day, 0))
+            missing = needed & ((present & np.uint64(rule.skills)) == 0)
+            runs = np.flatnonzero(np.diff(np.concatenate(([0], missing.astype(np.int8), [0]))))
+            for lo, hi in zip(runs[::2], runs[1::2]):
+                issues.append({
+                    'day': JOURS[day],
+                    'rule': rule.label,
+                    'start': time_str(*from_minutes(int(lo) * SLOT_MINUTES)),
+                    'end': time_str(*from_minutes(int(hi) * SLOT_MINUTES)),
+                })
+    return issues
+
+
+# ── Compteur d'heures annualisé ─────────────────────────────────────────
+
+def cycle_week_type(monday, ref_monday, ref_week_type):
+    """Semaine du cycle (1-3) d'un lundi, connaissant celle d'un lundi de référence."""
+    offset = (monday - ref_monday).days // 7
+    return ((ref_week_type - 1 + offset) % 3) + 1
+
+
+def year_horizon(year):
+    """(premier lundi, nombre de semaines) couvrant l'année civile."""
+    first = monday_of(datetime.date(year, 1, 1))
+    last = monday_of(datetime.date(year, 12, 31))
+    return first, (last - first).days // 7 + 1
+
+
+class HourLedger:
+    """Compteur d'heures par employé sur un horizon de semaines (une année).
+
+    Écart hebdo = planifié + écart pointé + absences créditées - contrat,
+    cumulé dans `balance` (tableau employés × semaines). Le solde de fin de
+    semaine, plafonné à `max_carry`, corrige la cible de la semaine suivante.
+    Les semaines pointées comptent leurs heures réelles, figées par record_timesheet.
+    """
+
+    def __init__(self, start_monday, first_week_type=1, num_weeks=52, staff=None,
+                 extras=None, absences=None, max_carry=4.0, breaks=False, exceptions=None, rotation=None):
+        self.start_monday = start_monday
+        self.first_week_type = first_week_type
+        self.num_weeks = num_weeks
+        self.staff = list(staff or STAFF)
+        self.extras = extras
+        self.absences = absences
+        self.max_carry = max_carry
+        self.breaks = breaks
+        self.rotation = rotation
+        self.openings = horizon_openings(exceptions, start_monday, num_weeks)
+        self.index = {emp.name: i for i, emp in enumerate(self.staff)}
+        self.contract = np.array([emp.contract_hours for emp in self.staff], dtype=float)
+
+        shape = (len(self.staff), num_weeks)
+        self.planned = np.zeros(shape)
+        self.credited = np.zeros(shape)
+        self.clocked = np.zeros(shape)  # écart pointé - prévu (record_timesheet)
+        self.actual = {}                # semaine → heures pointées figées (record_timesheet)
+        self.balance = np.zeros(shape)  # solde cumulé en fin de semaine
+        self.overrides = {}             # semaine → modifications manuelles
+        self.recorded = {}              # semaine → heures du planning affiché (record_week)
+        self._computed = 0              # semaines [0, _computed) à jour
+        self.recompute()
+
+    def monday(self, week):
+        return self.start_monday + datetime.timedelta(weeks=week)
+
+    def week_of(self, date):
+        """Indice de la semaine contenant cette date, ou None hors horizon."""
+        week = (date - self.start_monday).days // 7
+        return week if 0 <= week < self.num_weeks else None
+
+    def week_type(self, week):
+        return cycle_week_type(self.monday(week), self.start_monday, self.first_week_type)
+
+    def carry(self, week):
+        """Solde reporté en début de semaine (par employé)."""
+        if week == 0:
+            return np.zeros(len(self.staff))
+        return self.balance[:, week - 1]
+
+    def absence_credit(self, week):
+        """Heures créditées pour les absences datées (1 jour = contrat / jours travaillés)."""
+        credit = np.zeros(len(self.staff))
+        if self.absences is None:
+            return credit
+        monday = self.monday(week)
+        week_type = self.week_type(week)
+        off = get_off_days(week_type, is_meeting_week(monday) if week_type == 3 else False, self.rotation)
+        for i, emp in enumerate(self.staff):
+            per_day = emp.contract_hours / min(5, len(emp.available_days))
+            for day in emp.available_days:
+                if day in off.get(emp.name, ()):
                     continue
-                if entry['type'] in ('conge', 'indispo'):
+                if self.absences.lookup(emp.name, monday + datetime.timedelta(days=day)):
+                    credit[i] += per_day
+        return np.minimum(credit, self.contract)
+
+    def targets(self, week, credit=None):
+        """Cibles hebdo {nom: heures} : contrat - absences - report plafonné."""
+        if credit is None:
+            credit = self.absence_credit(week)
+        carry = np.clip(self.carry(week), -self.max_carry, self.max_carry)
+        target = self.contract - credit - carry
+        return {emp.name: float(t) for emp, t in zip(self.staff, target)}
+
+    def _week_plan(self, week, credit):
+        """Planning de la semaine (cibles du compteur, modifications manuelles, pauses)."""
+        monday = self.monday(week)
+        week_type = self.week_type(week)
+        mw = is_meeting_week(monday) if week_type == 3 else False
+        schedule, weekly_hours = generate_week_cached(
+            week_type, extras=self.extras, meeting_week=mw,
+            absences=self.absences, monday=monday, targets=self.targets(week, credit),
+            breaks=self.breaks, opening=self.openings[week], rotation=self.rotation,
+        )
+        if self.overrides.get(week):
+            schedule, weekly_hours = apply_manual_overrides(schedule, weekly_hours, self.overrides[week])
+            if self.breaks:
+                schedule, weekly_hours = place_breaks(schedule, weekly_hours, self.staff,
+                                                      opening=self.openings[week])
+        return schedule, weekly_hours
+
+    def plan_of(self, monday):
+        """Planning prévu de la semaine de ce lundi, ou None hors horizon."""
+        week = self.week_of(monday)
+        if week is None:
+            return None
+        return self._week_plan(week, self.absence_credit(week))[0]
+
+    def _compute_week(self, week):
+        credit = self.absence_credit(week)
+        weekly_hours = self.recorded.get(week) or self._week_plan(week, credit)[1]
+        planned = np.array([weekly_hours.get(emp.name, 0.0) for emp in self.staff])
+        worked = self.actual.get(week, planned)
+        self.planned[:, week] = planned
+        self.clocked[:, week] = worked - planned
+        self.credited[:, week] = credit
+        self.balance[:, week] = self.carry(week) + worked + credit - self.contract
+
+    def recompute(self, from_week=0, to_week=None):
+        """Recalcule les semaines à partir de `from_week`.
+
+        S'arrête dès qu'une semaine déjà calculée, au-delà de `to_week` (dernière
+        semaine modifiée), retrouve son ancien solde : les suivantes, qui n'en
+        dépendent que par ce report, sont inchangées.
+        """
+        last = from_week if to_week is None else to_week
+        for week in range(from_week, self.num_weeks):
+            previous = self.balance[:, week].copy()
+            self._compute_week(week)
+            if last <= week and week + 1 < self._computed and np.array_equal(previous, self.balance[:, week]):
+                return
+        self._computed = self.num_weeks
+
+    def set_overrides(self, week, overrides):
+        """Enregistre les modifications manuelles d'une semaine et recalcule la suite."""
+        self.overrides[week] = list(overrides)
+        self.recompute(week)
+
+    def record_week(self, week, weekly_hours):
+        """Heures réellement planifiées d'une semaine (congé, absences par jour,
+        modifications manuelles compris), qui remplacent la génération du compteur."""
+        weekly_hours = {emp.name: float(weekly_hours.get(emp.name, 0.0)) for emp in self.staff}
+        if self.recorded.get(week) != weekly_hours:
+            self.recorded[week] = weekly_hours
+            self.recompute(week)
+
+    def record_timesheet(self, shifts):
+        """Reporte les heures pointées (reconcile_timesheet) dans le compteur.
+
+        Les heures réelles d'une semaine pointée (prévu actuel + écart pointé -
+        prévu) sont figées avant de recalculer : le report qui change ensuite la
+        cible des semaines suivantes ne modifie plus leurs heures pointées.
+        Recalcule une seule fois de la première à la dernière semaine pointée.
+        Les employés hors compteur (extras) et les dates hors horizon sont ignorés.
+        """
+        clocked = np.zeros_like(self.clocked)
+        weeks = set()
+        for name, date, delta in zip(shifts['employee'], shifts['date'], shifts['delta_hours']):
+            week = self.week_of(date)
+            i = self.index.get(name)
+            if week is None or i is None:
+                continue
+            clocked[i, week] += delta
+            weeks.add(week)
+        if not weeks:
+            return
+        weeks = sorted(weeks)
+        for week in weeks:
+            self.actual[week] = self.planned[:, week] + clocked[:, week]
+        self.recompute(weeks[0], weeks[-1])
+
+    def balance_of(self, name, week):
+        """Solde de l'employé en fin de semaine."""
+        return float(self.balance[self.index[name], week])
+
+
+# ── Équité des rotations sur un horizon long ─────────────────────────────
+
+FAIRNESS_COLUMNS = ['Dimanches', 'Fermetures', 'Soirs', 'Jours', 'Heures',
+                    'Réunion', 'Week-ends off', 'Repos < 12h', 'Série max']
+
+
+def fairness_stats(horizon, staff_list=None):
+    """Compteurs par employé sur un horizon issu de generate_horizon.
+
+    Dimanches, fermetures et soirs travaillés, jours et heures, semaines dont
+    les congés changent à cause de la réunion, week-ends complets off, repos
+    de moins de 12h entre deux shifts, plus longue série de jours travaillés.
+    Les séries et repos sont suivis d'une semaine à l'autre.
+    """
+    staff_list = staff_list or STAFF
+    names = [emp.name for emp in staff_list]
+    stats = {name: dict.fromkeys(FAIRNESS_COLUMNS, 0) for name in names}
+    closing = [time_str(*HORAIRES[d][2:]) for d in range(7)]
+    streak = dict.fromkeys(names, 0)
+    last_end = dict.fromkeys(names)  # fin du dernier shift, en minutes depuis le début de l'horizon
+
+    for w, (monday, week_type, schedule, weekly_hours) in enumerate(horizon):
+        meeting_changed = set()
+        if week_type == 3 and is_meeting_week(monday):
+            meeting_changed = {n for n, days in ROTATION_MEETING_W3.items() if days != ROTATION[3].get(n)}
+
+        for name in names:
+            counts = stats[name]
+            days = schedule.get(name)
+            if days is None:  # absent de la semaine (vacances)
+                streak[name] = 0
+                continue
+            if name in meeting_changed:
+                counts['Réunion'] += 1
+            counts['Heures'] += weekly_hours.get(name, 0.0)
+            if not (days[5] and days[5].get('hours', 0) > 0) and not (days[6] and days[6].get('hours', 0) > 0):
+                counts['Week-ends off'] += 1
+
+            for d, entry in enumerate(days):
+                if not (entry and entry.get('hours', 0) > 0):
+                    streak[name] = 0
                     continue
+                counts['Jours'] += 1
+                streak[name] += 1
+                counts['Série max'] = max(counts['Série max'], streak[name])
+                if d == 6:
+                    counts['Dimanches'] += 1
+                if entry['type'] == 'soir':
+                    counts['Soirs'] += 1
+                if entry['end'] == closing[d]:
+                    counts['Fermetures'] += 1
+                day_offset = (w * 7 + d) * 24 * 60
+                start = day_offset + parse_minutes(entry['start'])
+                if last_end[name] is not None and start - last_end[name] < 12 * 60:
+                    counts['Repos < 12h'] += 1
+                last_end[name] = day_offset + parse_minutes(entry['end'])
+
+    return stats
+
+
+def fairness_spread(stats, names):
+    """Écart max - min de chaque compteur entre les employés donnés."""
+    present = [stats[n] for n in names if n in stats]
+    if not present:
+        return {}
+    return {col: max(s[col] for s in present) - min(s[col] for s in present) for col in FAIRNESS_COLUMNS}
+
+
+# ── Recherche de rotations (N CDI, cycle de N semaines) ─────────────────
+
+# Paires de jours off consécutifs, en masques de bits : Lun+Mar, …, Sam+Dim, Dim+Lun
+OFF_PAIRS = tuple((1 << p) | (1 << (p + 1) % 7) for p in range(7))
+SUNDAY_BIT = 1 << 6
+ROTATION_WEIGHTS = {'sundays': 10.0, 'weekends': 5.0, 'coverage': 1.0}
+
+
+def _lead_trail(mask):
+    """Jours travaillés avant le premier jour off et après le dernier."""
+    days = [d for d in range(7) if mask >> d & 1]
+    return days[0], 6 - days[-1]
+
+
+def _min_week_coverage(num_cdis, max_off):
+    """Plus petite somme des carrés du nombre de CDI off par jour (Lun-Sam) sur une semaine."""
+    best = None
+    for pairs in itertools.combinations_with_replacement(range(7), num_cdis):
+        counts = [sum(OFF_PAIRS[p] >> d & 1 for p in pairs) for d in range(6)]
+        if max(counts) <= max_off and any(not OFF_PAIRS[p] & SUNDAY_BIT for p in pairs):
+            total = sum(c * c for c in counts)
+            best = total if best is None else min(best, total)
+    return best
+
+
+def _sunday_plans(n, weeks, first_of_class):
+    """Répartitions équilibrées des dimanches (un CDI par semaine), à symétrie près.
+
+    Chaque CDI travaille weeks // n ou weeks // n + 1 dimanches. Dans une
+    classe de CDI interchangeables, un membre n'entre en jeu qu'après son
+    prédécesseur (first_of_class[i] : indice du précédent, -1 sinon).
+    """
+    low, high = weeks // n, -(-weeks // n)
+    counts = [0] * n
+    plan = []
+
+    def extend(w):
+        if sum(max(0, low - c) for c in counts) > weeks - w:
+            return
+        if w == weeks:
+            yield list(plan)
+            return
+        for s in range(n):
+            if counts[s] >= high or (first_of_class[s] >= 0 and not counts[first_of_class[s]]):
+                continue
+            counts[s] += 1
+            plan.append(s)
+            yield from extend(w + 1)
+            plan.pop()
+            counts[s] -= 1
+
+    yield from extend(0)
+
+
+def search_rotations(cdis=None, weeks=3, first_monday=None, meeting_names=None, max_off=None,
+                     max_consecutive=6, top_k=5, max_nodes=100_000):
+    """Cherche et classe des rotations de jours off pour `cdis` sur `weeks` semaines.
+
+    Règles : chaque CDI a 2 jours off consécutifs par semaine (Dim+Lun
+    compris), un seul CDI travaille le dimanche (les autres sont en congé)
+    et les dimanches sont répartis à une unité près, au plus `max_off` CDI
+    off le même jour du lundi au samedi, les CDI de `meeting_names`
+    (managers par défaut) sont là le lundi des semaines de réunion
+    (is_meeting_week, sur deux cycles pour couvrir les cycles impairs) et
+    personne ne travaille plus de `max_consecutive` jours de suite, cycle
+    rebouclé compris.
+
+    Les plans de dimanches sont énumérés à symétrie près (_sunday_plans),
+    puis les paires de jours off sont cherchées semaine par semaine par
+    séparation et évaluation : le score (ROTATION_WEIGHTS : écart de
+    week-ends off, déséquilibre des absences par jour) est minoré à chaque
+    nœud, et les CDI restés interchangeables sont ordonnés
+    lexicographiquement. `max_nodes` est partagé entre les plans de
+    dimanches ; s'il est atteint, les meilleures rotations trouvées sont
+    rendues ('exhaustive' à False).
+    Retourne {'rotations': [{'rotation', 'sunday', 'score', 'parts'}],
+    'nodes', 'exhaustive'} ; 'rotation' et 'sunday' ont le format de
+    ROTATION et SUNDAY_ROTATION (semaines numérotées à partir de 1).
+    """
+    if cdis is None:
+        cdis = [emp.name for emp in STAFF if emp.name in CDI_NAMES]
+    if meeting_names is None:
+        managers = {emp.name for emp in STAFF if emp.skills & skill_mask('manager')}
+        meeting_names = [name for name in cdis if name in managers]
+    meeting_names = set(meeting_names)
+    # Réunion d'abord : les CDI d'une même classe sont contigus
+    cdis = sorted(cdis, key=lambda name: name not in meeting_names)
+    n = len(cdis)
+    if max_off is None:
+        max_off = max(1, -(-2 * n // 7))
+    first_monday = first_monday or next_monday()
+    meeting_weeks = {w for w in range(weeks) for k in range(2)
+                     if is_meeting_week(first_monday + datetime.timedelta(weeks=w + k * weeks))}
+    in_meeting = [name in meeting_names for name in cdis]
+    same_class = [i - 1 if i and in_meeting[i] == in_meeting[i - 1] else -1 for i in range(n)]
+    week_min = _min_week_coverage(n, max_off)
+    result = {'rotations': [], 'nodes': 0, 'exhaustive': True}
+    if week_min is None or not n:
+        return result
+    lead_trail = [_lead_trail(mask) if mask else (7, 7) for mask in range(128)]
+    pair_days = [[d for d in range(6) if OFF_PAIRS[p] >> d & 1] for p in range(7)]
+    w_weekends, w_coverage = ROTATION_WEIGHTS['weekends'], ROTATION_WEIGHTS['coverage']
+
+    pairs = [[0] * n for _ in range(weeks)]
+    counts = [0] * 6
+    lead0, trail = [0] * n, [0] * n
+    weekends = [0] * n
+    best = []  # [(score, rang, solution)] trié
+    state = {'nodes': 0, 'limit': max_nodes, 'cut': False, 'coverage': 0, 'sq': 0}
+
+    def worst():
+        return best[-1][0] if len(best) >= top_k else float('inf')
+
+    def record(plan):
+        parts = {
+            'sundays': max(plan.count(i) for i in range(n)) - min(plan.count(i) for i in range(n)),
+            'weekends': max(weekends) - min(weekends),
+            'coverage': state['coverage'],
+        }
+        score = sum(ROTATION_WEIGHTS[k] * v for k, v in parts.items())
+        if score >= worst():
+            return
+        solution = {
+            'rotation': {w + 1: {cdis[i]: {d for d in range(7) if OFF_PAIRS[pairs[w][i]] >> d & 1}
+                                 for i in range(n)} for w in range(weeks)},
+            'sunday': {w + 1: cdis[plan[w]] for w in range(weeks)},
+            'score': score,
+            'parts': parts,
+        }
+        bisect.insort(best, (score, state['nodes'], solution), key=lambda item: item[:2])
+        del best[top_k:]
+
+    def search(plan, prev, tied, w, i, base):
+        if state['nodes'] >= state['limit']:
+            state['cut'] = True
+            return
+        state['nodes'] += 1
+        if i == n:
+            sq, state['sq'] = state['sq'], 0
+            saved_counts = list(counts)
+            counts[:] = [0] * 6
+            state['coverage'] += sq - week_min
+            if w + 1 == weeks:
+                record(plan)
+            else:
+                search(plan, prev, tied, w + 1, 0, base)
+            state['coverage'] -= sq - week_min
+            counts[:] = saved_counts
+            state['sq'] = sq
+            return
+        remaining = weeks - w - 1
+        # Les week-ends off (paires avec le samedi) d'abord à ceux qui en ont eu le moins
+        behind = weekends[i] == min(weekends)
+        order = sorted(range(7), key=lambda p: (sum(counts[d] for d in pair_days[p]), (p in (4, 5)) != behind))
+        for p in order:
+            if plan[w] == i and OFF_PAIRS[p] & SUNDAY_BIT:
+                continue
+            mask = OFF_PAIRS[p] | (0 if plan[w] == i else SUNDAY_BIT)
+            if in_meeting[i] and w in meeting_weeks and mask & 1:
+                continue
+            if tied[i] and p < pairs[w][prev[i]]:
+                continue
+            if any(counts[d] >= max_off for d in pair_days[p]):
+                continue
+            lead, last = lead_trail[mask]
+            if w and trail[i] + lead > max_consecutive:
+                continue
+            if not remaining and last + (lead0[i] if w else lead) > max_consecutive:
+                continue
+            added = sum(2 * counts[d] + 1 for d in pair_days[p])
+            weekend = mask & 0b1100000 == 0b1100000
+            weekends[i] += weekend
+            bound = (base + (state['coverage'] + max(0, state['sq'] + added - week_min)) * w_coverage
+                     + w_weekends * max(0, max(weekends) - min(weekends) - remaining))
+            if bound < worst():
+                for d in pair_days[p]:
+                    counts[d] += 1
+                state['sq'] += added
+                saved = trail[i], lead0[i]
+                trail[i] = last
+                if w == 0:
+                    lead0[i] = lead
+                pairs[w][i] = p
+                next_tied = tied
+                if i + 1 == n:
+                    next_tied = [t and pairs[w][j] == pairs[w][prev[j]] for j, t in enumerate(tied)]
+                search(plan, prev, next_tied, w, i + 1, base)
+                trail[i], lead0[i] = saved
+                state['sq'] -= added
+                for d in pair_days[p]:
+                    counts[d] -= 1
+            weekends[i] -= weekend
+
+    plans = list(_sunday_plans(n, weeks, same_class))
+    for k, plan in enumerate(plans):
+        # Budget partagé entre les plans de dimanches restants
+        state['limit'] = state['nodes'] + (max_nodes - state['nodes']) // (len(plans) - k)
+        sundays = [tuple(w for w in range(weeks) if plan[w] == i) for i in range(n)]
+        # Reste interchangeable : même classe et mêmes dimanches
+        prev = [j if j >= 0 and sundays[j] == sundays[i] else -1 for i, j in enumerate(same_class)]
+        spread = max(plan.count(i) for i in range(n)) - min(plan.count(i) for i in range(n))
+        search(plan, prev, [j >= 0 for j in prev], 0, 0, ROTATION_WEIGHTS['sundays'] * spread)
+    result['exhaustive'] = not state['cut']
+    result['rotations'] = [solution for _, _, solution in best]
+    result['nodes'] = state['nodes']
+    return result
+
+
+# ── Coût salarial : taux, majorations, heures sup ────────────────────────
+
+# Taux horaire brut (€) et coefficient de charges patronales par type de contrat
+CONTRACT_RATES = {
+    'cdi': {'taux': 13.50, 'charges': 1.42},
+    'partiel': {'taux': 12.50, 'charges': 1.42},
+    'alternant': {'taux': 8.00, 'charges': 1.00},  # contrat aidé : charges quasi nulles
+    'extra': {'taux': 14.00, 'charges': 1.45},
+}
 
-                date_str = current_date.strftime('%m/%d/%Y')
-                start = time_24_to_12(entry['start'])
-                end = time_24_to_12(entry['end'])
-                title = SHIFT_TITLES.get(entry['type'], entry['type'])
+SUNDAY_PREMIUM = 0.20      # +20% le dimanche
+LATE_PREMIUM = 0.25        # +25% après 22:00 les jours de fermeture tardive
+LATE_FROM = 22 * 60
+LEGAL_WEEK = 35.0          # durée légale
+OVERTIME_BANDS = ((35.0, 43.0, 0.25), (43.0, float('inf'), 0.50))  # (de, à, majoration)
+COMPLEMENTARY_BANDS = ((0.0, 0.10, 0.10), (0.10, float('inf'), 0.25))  # temps partiel, en part du contrat
+APPRENTICE_OVERTIME_BANDS = ((0.0, 8.0, 0.25), (8.0, float('inf'), 0.50))  # alternants, au-delà du contrat
 
-                rows.append(
-                    f"{date_str},{start},{end},,,,{title},,,,{emp.name},,,,,,"
-                )
 
-        current_monday += datetime.timedelta(weeks=1)
+def contract_type(emp):
+    """'cdi', 'alternant', 'extra' ou 'partiel'."""
+    if emp.is_alternant:
+        return 'alternant'
+    if emp.name in CDI_NAMES:
+        return 'cdi'
+    if emp.role == "Extra":
+        return 'extra'
+    return 'partiel'
 
-    return '\n'.join(rows)
 
+def _premium_masks():
+    """Majoration par minute pour chaque jour (7 × 1440) et ses sommes cumulées (7 × 1441).
 
-# ── Interface Streamlit ────────────────────────────────────────────────────
+    Le coût majoré d'un shift [début, fin) vaut cum[jour, fin] - cum[jour, début].
+    """
+    masks = np.zeros((7, 24 * 60))
+    masks[6] += SUNDAY_PREMIUM
+    for day, (_, _, eh, em) in HORAIRES.items():
+        if to_minutes(eh, em) > LATE_FROM:
+            masks[day, LATE_FROM:] += LATE_PREMIUM
+    cum = np.zeros((7, 24 * 60 + 1))
+    cum[:, 1:] = np.cumsum(masks, axis=1)
+    return masks, cum
 
-def _birdieland_css():
-    return """
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;600;700&family=Space+Grotesk:wght@300;400;600&display=swap');
 
-    #MainMenu, footer { visibility: hidden; }
-    .stAppDeployButton { display: none; }
+PREMIUM_MASKS, PREMIUM_CUMSUM = _premium_masks()
 
-    .stApp {
-        background: #080808 !important;
-        min-height: 100vh;
-        font-family: 'Space Grotesk', sans-serif !important;
-    }
-    .block-container { padding-top: 2rem !important; }
-
-    /* Textes */
-    .stApp, .stMarkdown, p, li { color: rgba(255,255,255,0.85) !important; }
-    h1, h2, h3, h4 {
-        font-family: 'Montserrat', sans-serif !important;
-        color: #ffffff !important;
-        letter-spacing: 2px !important;
-        text-transform: uppercase;
+
+def shift_arrays(horizon, staff_list=None):
+    """Minutes de début et de fin des shifts travaillés : tableaux (semaines, employés, 7).
+
+    Les cases sans shift valent 0/0 (durée nulle).
+    """
+    staff_list = staff_list or STAFF
+    shape = (len(horizon), len(staff_list), 7)
+    starts = np.zeros(shape, dtype=np.int16)
+    ends = np.zeros(shape, dtype=np.int16)
+    for w, (_, _, schedule, _) in enumerate(horizon):
+        for e, emp in enumerate(staff_list):
+            days = schedule.get(emp.name)
+            if days is None:
+                continue
+            for d, entry in enumerate(days):
+                if entry and entry.get('hours', 0) > 0:
+                    starts[w, e, d] = parse_minutes(entry['start'])
+                    ends[w, e, d] = parse_minutes(entry['end'])
+    return starts, ends
+
+
+def break_arrays(horizon, staff_list=None):
+    """Début et fin des pauses non payées : tableaux (semaines, employés, 7), 0/0 sans pause."""
+    staff_list = staff_list or STAFF
+    shape = (len(horizon), len(staff_list), 7)
+    starts = np.zeros(shape, dtype=np.int16)
+    ends = np.zeros(shape, dtype=np.int16)
+    for w, (_, _, schedule, _) in enumerate(horizon):
+        for e, emp in enumerate(staff_list):
+            for d, entry in enumerate(schedule.get(emp.name) or ()):
+                minutes = unpaid_break_minutes(entry) if entry and entry.get('hours', 0) > 0 else 0
+                if minutes:
+                    starts[w, e, d] = parse_minutes(entry['break_start'])
+                    ends[w, e, d] = starts[w, e, d] + minutes
+    return starts, ends
+
+
+def _band_hours(hours, bands, scale=1.0):
+    """Heures dans chaque tranche [de, à) × scale, sommées avec leur majoration."""
+    weighted = np.zeros_like(hours)
+    for lo, hi, rate in bands:
+        width = np.inf if hi == float('inf') else (hi - lo) * scale  # pas de inf × 0 (contrat nul)
+        weighted += rate * np.clip(hours - lo * scale, 0, width)
+    return weighted
+
+
+def cost_arrays(starts, ends, staff_list=None, breaks=None):
+    """Coût d'un horizon en une passe vectorisée (cf. shift_arrays).
+
+    `breaks` : (débuts, fins) des pauses non payées (break_arrays), déduites
+    des heures et des majorations.
+
+    Retourne un dict de tableaux (semaines, employés) : heures, équivalent
+    heures des majorations dimanche / soirée, heures sup ou complémentaires
+    et équivalent heures de leur majoration, brut et coût employeur.
+
+    Heures sup : au-delà de 35h, +25% jusqu'à 43h puis +50%. Temps partiel :
+    heures complémentaires au-delà du contrat, +10% jusqu'à 10% du contrat
+    puis +25%. Alternants : toute heure au-delà du contrat en entreprise
+    (le reste des 35h est en formation) est une heure sup.
+    """
+    staff_list = staff_list or STAFF
+    days = np.arange(7)
+    base_min = (ends - starts).astype(np.int32)
+    premium_min = (PREMIUM_CUMSUM[days, ends.astype(np.intp)]
+                   - PREMIUM_CUMSUM[days, starts.astype(np.intp)])
+    if breaks is not None:
+        b_starts, b_ends = breaks
+        base_min -= (b_ends - b_starts).astype(np.int32)
+        premium_min -= (PREMIUM_CUMSUM[days, b_ends.astype(np.intp)]
+                        - PREMIUM_CUMSUM[days, b_starts.astype(np.intp)])
+    hours = base_min.sum(axis=2) / 60
+    premium_hours = premium_min.sum(axis=2) / 60
+
+    contract = np.array([emp.contract_hours for emp in staff_list], dtype=float)
+    kinds = [contract_type(emp) for emp in staff_list]
+    rate = np.array([emp.hourly_rate or CONTRACT_RATES[k]['taux'] for emp, k in zip(staff_list, kinds)])
+    charges = np.array([CONTRACT_RATES[k]['charges'] for k in kinds])
+
+    full_time = np.array([k in ('cdi', 'extra') or c >= LEGAL_WEEK for k, c in zip(kinds, contract)])
+    apprentice = np.array([k == 'alternant' for k in kinds])
+    part_time = ~full_time & ~apprentice
+
+    above_contract = np.maximum(hours - contract, 0)
+    overtime = np.where(full_time, np.maximum(hours - LEGAL_WEEK, 0), above_contract)
+    overtime_premium = np.zeros_like(hours)
+    overtime_premium += np.where(full_time, _band_hours(hours, OVERTIME_BANDS), 0)
+    overtime_premium += np.where(
+        apprentice, _band_hours(above_contract, APPRENTICE_OVERTIME_BANDS), 0)
+    overtime_premium += np.where(
+        part_time, _band_hours(above_contract, COMPLEMENTARY_BANDS, contract), 0)
+
+    gross = rate * (hours + premium_hours + overtime_premium)
+    return {
+        'hours': hours,
+        'premium_hours': premium_hours,
+        'overtime_hours': overtime,
+        'overtime_premium_hours': overtime_premium,
+        'gross': gross,
+        'cost': gross * charges,
     }
-    h1 { font-size: 22px !important; font-weight: 700 !important; letter-spacing: 5px !important; }
-    h2 { font-size: 13px !important; font-weight: 600 !important; letter-spacing: 3px !important;
-         border-bottom: 1px solid rgba(255,255,255,0.1); padding-bottom: 8px; margin-top: 32px !important; }
-    h3 { font-size: 12px !important; font-weight: 600 !important; }
-
-    /* Captions */
-    .stCaptionContainer p, .stCaption p { color: rgba(255,255,255,0.3) !important; font-size: 11px !important; }
-
-    /* Labels */
-    .stSelectbox label, .stCheckbox label, .stNumberInput label,
-    .stDateInput label, .stTextInput label, .stMultiSelect label {
-        color: rgba(255,255,255,0.4) !important;
-        font-family: 'Space Grotesk', sans-serif !important;
-        font-size: 10px !important;
-        font-weight: 600 !important;
-        letter-spacing: 2px !important;
-        text-transform: uppercase !important;
+
+
+def horizon_cost(horizon, staff_list=None):
+    """Coût salarial d'un horizon issu de generate_horizon (cf. cost_arrays)."""
+    starts, ends = shift_arrays(horizon, staff_list)
+    return cost_arrays(starts, ends, staff_list, break_arrays(horizon, staff_list))
+
+
+def week_cost(schedule, staff_list=None):
+    """Coût d'une semaine : {nom: {heures, majorations, heures_sup, maj_heures_sup, brut, cout}}."""
+    staff_list = staff_list or STAFF
+    costs = horizon_cost([(None, None, schedule, None)], staff_list)
+    return {
+        emp.name: {
+            'heures': float(costs['hours'][0, e]),
+            'majorations': float(costs['premium_hours'][0, e]),
+            'heures_sup': float(costs['overtime_hours'][0, e]),
+            'maj_heures_sup': float(costs['overtime_premium_hours'][0, e]),
+            'brut': float(costs['gross'][0, e]),
+            'cout': float(costs['cost'][0, e]),
+        }
+        for e, emp in enumerate(staff_list)
     }
 
-    /* Inputs */
-    .stSelectbox > div > div,
-    .stTextInput input,
-    .stNumberInput input,
-    .stDateInput input {
-        background: rgba(255,255,255,0.04) !important;
-        border: 1px solid rgba(255,255,255,0.12) !important;
-        border-radius: 6px !important;
-        color: #ffffff !important;
-        font-family: 'Space Grotesk', sans-serif !important;
+
+# ── Score multi-objectif des plannings ──────────────────────────────────
+
+# Pondérations (score à minimiser). Les contraintes dures dominent le reste.
+SCORE_WEIGHTS = {
+    'violations': 1000.0,   # par alerte droit du travail
+    'closers': 500.0,       # par personne manquante à la fermeture
+    'contract': 10.0,       # par heure d'écart au contrat
+    'cost': 0.01,           # par euro de coût employeur
+    'fairness': 20.0,       # écart de fermetures entre CDI
+    'preferences': -5.0,    # par shift dans la plage préférée (bonus)
+}
+
+
+def _slot_cumsum(staff_list, masks_of):
+    """Sommes cumulées (employés, 7, 97) des quarts d'heure à 1 des masques par jour.
+
+    Un shift [a, b) en quarts d'heure est inclus dans le masque si
+    cum[b] - cum[a] == b - a.
+    """
+    slots = np.zeros((len(staff_list), 7, SLOTS_PER_DAY + 1), dtype=np.int16)
+    bits = np.arange(SLOTS_PER_DAY)
+    for e, emp in enumerate(staff_list):
+        for d in range(7):
+            mask = masks_of(emp, d)
+            if mask:
+                row = np.array([(mask >> int(b)) & 1 for b in bits], dtype=np.int16)
+                slots[e, d, 1:] = np.cumsum(row)
+    return slots
+
+
+def _inside(cum, starts, ends):
+    """(N, employés, 7) : shift entièrement couvert par le masque (cf. _slot_cumsum)."""
+    lo = starts // SLOT_MINUTES
+    hi = -(-ends // SLOT_MINUTES)
+    e_idx = np.arange(cum.shape[0])[None, :, None]
+    d_idx = np.arange(7)[None, None, :]
+    return cum[e_idx, d_idx, hi] - cum[e_idx, d_idx, lo] == hi - lo
+
+
+def _profile_limits(staff_list, profiles=None):
+    """Limites par employé (tableaux) des règles de son profil LABOR_PROFILES.
+
+    Règle absente du profil : inf (plafonds) ou 0 (minimums) ; les règles
+    `cdi_only` valent 0 hors CDI. `daily_max` tient compte de Employee.max_daily_hours.
+    """
+    profiles = profiles or {}
+    limits = {kind: np.full(len(staff_list), np.inf)
+              for kind in ('daily_max', 'weekly_max', 'consecutive_days', 'latest_end')}
+    limits.update({kind: np.zeros(len(staff_list)) for kind in ('min_rest', 'days_off', 'consecutive_off')})
+    limits['availability'] = np.zeros(len(staff_list), dtype=bool)
+    for e, emp in enumerate(staff_list):
+        for rule in LABOR_PROFILES[profiles.get(emp.name, emp.labor_profile)]:
+            if rule.cdi_only and emp.name not in CDI_NAMES:
+                continue
+            limits[rule.kind][e] = True if rule.kind == 'availability' else rule.limit
+    limits['daily_max'] = np.minimum(limits['daily_max'], [emp.max_daily_hours for emp in staff_list])
+    return limits
+
+
+def score_components(starts, ends, staff_list=None, preferences=None, breaks=None, opening=None,
+                     profiles=None):
+    """Composantes du score pour N plannings candidats, en une passe vectorisée.
+
+    `starts`/`ends` : (N, employés, 7) comme shift_arrays. `preferences` :
+    {nom: {jour: masque}} plages préférées, par défaut Employee.preferences.
+    `breaks` : pauses non payées (break_arrays), déduites des heures.
+    `opening` : table d'ouverture de la semaine (fermeture et minimum à la
+    fermeture par jour), DEFAULT_OPENING par défaut. `profiles` : {nom: profil}
+    comme check_labor_law, dont les violations reprennent les règles.
+    Retourne un dict de tableaux (N,) : violations, closers, contract, cost,
+    fairness, preferences.
+    """
+    staff_list = staff_list or STAFF
+    starts = starts.astype(np.int32)
+    ends = ends.astype(np.int32)
+    worked = ends > starts
+    hours = (ends - starts) / 60
+    if breaks is not None:
+        hours = hours - (breaks[1] - breaks[0]) / 60
+    weekly = hours.sum(axis=2)
+    limits = _profile_limits(staff_list, profiles)
+    contract = np.array([emp.contract_hours for emp in staff_list], dtype=float)
+    is_cdi = np.array([emp.name in CDI_NAMES for emp in staff_list])
+
+    # Contraintes dures (une alerte par jour ou par semaine, comme check_labor_law)
+    violations = (hours > limits['daily_max'][None, :, None] + 0.01).sum(axis=(1, 2))
+    violations += (weekly > limits['weekly_max']).sum(axis=1)
+    run = longest = np.zeros(worked.shape[:2], dtype=np.int32)
+    for d in range(7):
+        run = np.where(worked[:, :, d], run + 1, 0)
+        longest = np.maximum(longest, run)
+    violations += (longest > limits['consecutive_days']).sum(axis=1)
+    both = worked[:, :, :-1] & worked[:, :, 1:]
+    rest = 24 * 60 - ends[:, :, :-1] + starts[:, :, 1:]
+    violations += (both & (rest < limits['min_rest'][None, :, None] * 60)).sum(axis=(1, 2))
+    violations += (worked & (ends > limits['latest_end'][None, :, None] * 60)).sum(axis=(1, 2))
+    off = ~worked
+    violations += (off.sum(axis=2) < limits['days_off']).sum(axis=1)
+    for span in np.unique(limits['consecutive_off'][limits['consecutive_off'] > 0]):
+        window = off.copy()
+        for i in range(1, int(span)):
+            window &= np.roll(off, -i, axis=2)  # Dimanche + Lundi compris
+        applies = limits['consecutive_off'] == span
+        violations += (applies & off.any(axis=2) & ~window.any(axis=2)).sum(axis=1)
+    avail_cum = _slot_cumsum(staff_list, day_availability)
+    violations += (worked & ~_inside(avail_cum, starts, ends) & limits['availability'][None, :, None]).sum(axis=(1, 2))
+
+    # Fermeture : minimum de la table d'ouverture, jours fermés exclus
+    table = DEFAULT_OPENING if opening is None else opening
+    open_days = np.array([not is_closed(d, opening) for d in range(7)])
+    closing = table[:, CLOSE].astype(np.int32)
+    at_close = worked & (ends == closing) & open_days
+    closers = at_close.sum(axis=1)  # (N, 7)
+    closer_gap = (np.maximum(table[:, CLOSERS_MIN] - closers, 0) * open_days).sum(axis=1)
+
+    contract_dev = np.abs(weekly - contract).sum(axis=1)
+    cost = cost_arrays(starts, ends, staff_list, breaks)['cost'].sum(axis=1)
+
+    cdi_closings = at_close[:, is_cdi].sum(axis=2)
+    fairness = (cdi_closings.max(axis=1) - cdi_closings.min(axis=1)) if is_cdi.any() else np.zeros(len(starts))
+
+    if preferences is None:
+        preferences = {emp.name: emp.preferences for emp in staff_list if emp.preferences}
+    pref_hits = np.zeros(len(starts))
+    if preferences:
+        pref_cum = _slot_cumsum(staff_list, lambda emp, d: (preferences.get(emp.name) or {}).get(d, 0))
+        pref_hits = (worked & _inside(pref_cum, starts, ends)).sum(axis=(1, 2))
+
+    return {
+        'violations': violations.astype(float),
+        'closers': closer_gap.astype(float),
+        'contract': contract_dev,
+        'cost': cost,
+        'fairness': fairness.astype(float),
+        'preferences': pref_hits.astype(float),
     }
-    .stSelectbox svg { fill: rgba(255,255,255,0.4) !important; }
 
-    /* Multiselect */
-    .stMultiSelect > div > div {
-        background: rgba(255,255,255,0.04) !important;
-        border: 1px solid rgba(255,255,255,0.12) !important;
-        border-radius: 6px !important;
+
+def score_batch(schedules, staff_list=None, weights=None, preferences=None, opening=None, profiles=None):
+    """Score pondéré de plusieurs plannings semaine (plus bas = meilleur).
+
+    Retourne (scores (N,), composantes) ; `weights` complète SCORE_WEIGHTS.
+    """
+    staff_list = staff_list or STAFF
+    weights = {**SCORE_WEIGHTS, **(weights or {})}
+    horizon = [(None, None, sch, None) for sch in schedules]
+    starts, ends = shift_arrays(horizon, staff_list)
+    components = score_components(starts, ends, staff_list, preferences, break_arrays(horizon, staff_list),
+                                  opening, profiles)
+    scores = sum(weights[k] * v for k, v in components.items())
+    return scores, components
+
+
+def score_schedule(schedule, staff_list=None, weights=None, preferences=None, opening=None, profiles=None):
+    """Score d'un seul planning : (score, {composante: valeur})."""
+    scores, components = score_batch([schedule], staff_list, weights, preferences, opening, profiles)
+    return float(scores[0]), {k: float(v[0]) for k, v in components.items()}
+
+
+# ── Prévision de la demande (lissage exponentiel au quart d'heure) ───────
+
+GUESTS_PER_STAFF = 12       # clients présents pris en charge par une personne
+DEMAND_MIN_DAYS = 14        # historique minimal avant de prévoir
+DEMAND_ALPHAS = (0.05, 0.1, 0.2, 0.4)   # lissage du niveau (grille ajustée)
+DEMAND_GAMMAS = (0.05, 0.1, 0.2, 0.3)   # lissage de la saison hebdo (grille ajustée)
+DEMAND_BETA = 0.02          # lissage de la tendance
+DEMAND_DAMPING = 0.9        # amortissement de la tendance par jour d'avance
+BOOKING_DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d')
+BOOKING_CHUNK = 20_000      # réservations lues par bloc
+
+# Colonnes de l'export des réservations (en minuscules) : première présente retenue
+BOOKING_COLUMNS = {
+    'date': ('date', 'booking date', 'start date'),
+    'start': ('start', 'start time', 'début', 'heure'),
+    'end': ('end', 'end time', 'fin'),
+    'duration': ('duration', 'durée'),
+    'guests': ('guests', 'players', 'joueurs', 'personnes'),
+}
+
+
+def booking_history(source, chunk_rows=BOOKING_CHUNK, history=None):
+    """Historique de réservations → clients présents par quart d'heure, par date.
+
+    CSV lu par blocs : date, début, fin ou durée (minutes ou 'H:MM'), nombre de
+    joueurs (1 par défaut). Une réservation compte sur chaque quart d'heure
+    qu'elle chevauche, tronquée à minuit. Les dates lues complètent `history`.
+    Retourne {date: tableau (96,)}.
+    """
+    import pandas as pd
+
+    history = dict(history or {})
+    columns = None
+    reader = pd.read_csv(source, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+                         encoding='utf-8-sig', skipinitialspace=True)
+    loaded = {}
+    for chunk in reader:
+        if columns is None:
+            columns = _match_columns(chunk.columns, BOOKING_COLUMNS)
+            missing = [f for f in ('date', 'start') if f not in columns]
+            if 'end' not in columns and 'duration' not in columns:
+                missing.append('end')
+            if missing:
+                raise ValueError(f"colonnes manquantes : {', '.join(missing)}")
+        dates = pd.to_datetime(chunk[columns['date']], format=BOOKING_DATE_FORMATS[0], errors='coerce')
+        for fmt in BOOKING_DATE_FORMATS[1:]:
+            dates = dates.fillna(pd.to_datetime(chunk[columns['date']], format=fmt, errors='coerce'))
+        start = _parse_distinct(chunk[columns['start']], _parse_clock)
+        if 'end' in columns:
+            end = _parse_distinct(chunk[columns['end']], _parse_clock)
+            end = np.where(end < start, end + 24 * 60, end)  # fin après minuit
+        else:
+            end = start + _parse_distinct(chunk[columns['duration']], _parse_break)
+        guests = (pd.to_numeric(chunk[columns['guests']], errors='coerce').fillna(1).to_numpy()
+                  if 'guests' in columns else np.ones(len(chunk)))
+        valid = dates.notna().to_numpy() & ~np.isnan(start) & ~np.isnan(end) & (end > start)
+        codes, days = dates[valid].factorize()
+        first = (start[valid] // SLOT_MINUTES).astype(int)
+        last = np.ceil(np.minimum(end[valid], 24 * 60) / SLOT_MINUTES).astype(int)
+        delta = np.zeros((len(days), SLOTS_PER_DAY + 1))
+        np.add.at(delta, (codes, first), guests[valid])
+        np.add.at(delta, (codes, last), -guests[valid])
+        for day, row in zip(days, np.cumsum(delta, axis=1)[:, :-1]):
+            date = day.date()
+            loaded[date] = loaded[date] + row if date in loaded else row
+    history.update(loaded)
+    return history
+
+
+class DemandModel:
+    """Holt-Winters additif par quart d'heure : niveau, tendance amortie, saison hebdo.
+
+    Les 96 quarts d'heure sont lissés ensemble (tableaux NumPy), pour toute la
+    grille DEMAND_ALPHAS × DEMAND_GAMMAS à la fois : chaque combinaison cumule
+    son erreur de prévision à un jour et la meilleure sert à prévoir. `update`
+    n'apprend que les jours postérieurs au dernier jour appris ; un historique
+    modifié en amont (empreinte crc32 différente) est réappris depuis le début.
+    """
+
+    def __init__(self):
+        alphas, gammas = np.meshgrid(DEMAND_ALPHAS, DEMAND_GAMMAS, indexing='ij')
+        self.alpha = alphas.reshape(-1, 1)
+        self.gamma = gammas.reshape(-1, 1)
+        self.reset()
+
+    def reset(self):
+        grid = len(self.alpha)
+        self.level = np.zeros((grid, SLOTS_PER_DAY))
+        self.trend = np.zeros((grid, SLOTS_PER_DAY))
+        self.season = np.zeros((grid, 7, SLOTS_PER_DAY))
+        self.sse = np.zeros(grid)      # erreur quadratique cumulée de chaque combinaison
+        self.dates = []                # jours appris, dans l'ordre
+        self.digest = 0                # crc32 des jours appris
+        self._warmup = []              # première semaine, avant initialisation
+
+    @property
+    def ready(self):
+        return len(self.dates) >= DEMAND_MIN_DAYS
+
+    @property
+    def best(self):
+        return int(np.argmin(self.sse))
+
+    def _learn(self, date, demand):
+        self.dates.append(date)
+        self.digest = zlib.crc32(demand.tobytes(), self.digest)
+        if len(self._warmup) < 7:
+            self._warmup.append((date.weekday(), demand))
+            if len(self._warmup) == 7:
+                level = np.mean([row for _, row in self._warmup], axis=0)
+                self.level[:] = level
+                for weekday, row in self._warmup:
+                    self.season[:, weekday] = row - level
+            return
+        weekday = date.weekday()
+        season = self.season[:, weekday]
+        damped = DEMAND_DAMPING * self.trend
+        error = demand - (self.level + damped + season)
+        self.sse += (error ** 2).sum(axis=1)
+        level = self.alpha * (demand - season) + (1 - self.alpha) * (self.level + damped)
+        self.trend = DEMAND_BETA * (level - self.level) + (1 - DEMAND_BETA) * damped
+        self.season[:, weekday] = self.gamma * (demand - level) + (1 - self.gamma) * season
+        self.level = level
+
+    def update(self, history):
+        """Apprend les jours de `history` ({date: (96,)}) pas encore vus ; retourne leur nombre."""
+        dates = sorted(history)
+        known = len(self.dates)
+        digest = 0
+        for date in dates[:known]:
+            digest = zlib.crc32(np.asarray(history[date], dtype=float).tobytes(), digest)
+        if dates[:known] != self.dates or digest != self.digest:
+            self.reset()
+            known = 0
+        for date in dates[known:]:
+            self._learn(date, np.asarray(history[date], dtype=float))
+        return len(dates) - known
+
+    def forecast(self, dates):
+        """Clients prévus par quart d'heure pour ces dates : tableau (len(dates), 96)."""
+        best = self.best
+        ahead = np.array([max((date - self.dates[-1]).days, 1) for date in dates])
+        damping = DEMAND_DAMPING * (1 - DEMAND_DAMPING ** ahead) / (1 - DEMAND_DAMPING)
+        weekdays = [date.weekday() for date in dates]
+        guests = self.level[best] + damping[:, None] * self.trend[best] + self.season[best, weekdays]
+        return np.maximum(guests, 0)
+
+    def rmse(self):
+        """Erreur de prévision à un jour de la combinaison retenue (clients par quart d'heure)."""
+        learned = max(len(self.dates) - 7, 1)
+        return float(np.sqrt(self.sse[self.best] / (learned * SLOTS_PER_DAY)))
+
+
+def week_demand(model, monday, opening=None):
+    """Effectif prévu (7, 96) de la semaine : ceil(clients / GUESTS_PER_STAFF) pendant l'ouverture.
+
+    None tant que le modèle n'a pas DEMAND_MIN_DAYS jours d'historique.
+    """
+    if not model.ready:
+        return None
+    guests = model.forecast([monday + datetime.timedelta(days=d) for d in range(7)])
+    demand = np.ceil(guests / GUESTS_PER_STAFF - 1e-9).astype(np.int16)
+    for day in range(7):
+        row = DEFAULT_OPENING[day] if opening is None else opening[day]
+        open_slot = int(row[OPEN]) // SLOT_MINUTES
+        close_slot = -(-int(row[CLOSE]) // SLOT_MINUTES)
+        demand[day, :open_slot] = 0
+        demand[day, close_slot:] = 0
+    return demand
+
+
+# ── Recommandation de renforts ───────────────────────────────────────────
+
+EXTRA_MIN_HOURS = 3.0
+
+
+def coverage_deficit(schedule, day, staff_list=None, opening=None, demand=None):
+    """Manque d'effectif par quart d'heure (96) face à required_coverage, pauses ignorées."""
+    cover = coverage_profile(schedule, day, staff_list, with_breaks=False)
+    missing = np.maximum(required_coverage(day, opening, demand) - cover, 0)
+    return missing.reshape(SLOTS_PER_DAY, SLOT_MINUTES).max(axis=1)
+
+
+def extra_shift_cost(emp, day, start_min, end_min):
+    """Coût employeur d'un shift isolé (taux, majorations dimanche / soirée, charges)."""
+    kind = contract_type(emp)
+    rate = emp.hourly_rate or CONTRACT_RATES[kind]['taux']
+    premium = PREMIUM_CUMSUM[day, end_min] - PREMIUM_CUMSUM[day, start_min]
+    return float(rate * ((end_min - start_min) + premium) / 60 * CONTRACT_RATES[kind]["charges"])
+
+
+def extra_pool(rows):
+    """Vivier d'extras saisi dans l'interface → ([Employee], [erreurs]).
+
+    Chaque ligne : {'name', 'rate' (€/h, 0 → taux extra), 'days' ("Ven, Sam"),
+    'window' ("17:00-23:15", vide → journée entière)}.
+    """
+    short = {j.lower(): d for d, j in enumerate(JOURS_SHORT)}
+    pool, errors = [], []
+    for row in rows:
+        name = (row.get('name') or '').strip()
+        if not name:
+            continue
+        try:
+            days = {short[part.strip().lower()[:3]] for part in (row.get('days') or '').split(',') if part.strip()}
+            window = (row.get('window') or '').strip()
+            availability = windows({d: window for d in days}) if window else None
+        except (KeyError, ValueError):
+            errors.append(f"{name} : jours ou plage horaire illisibles")
+            continue
+        pool.append(Employee(name, "Extra", 0, days, availability=availability,
+                             hourly_rate=float(row.get('rate') or 0.0)))
+    return pool, errors
+
+
+def recommend_extras(schedule, candidates, staff_list=None, days=range(7), opening=None, demand=None):
+    """Ensemble de shifts d'extras le moins cher qui comble tous les trous de couverture.
+
+    Recherche par séparation-évaluation, jour par jour : le premier quart
+    d'heure encore en manque est couvert par un shift qui y commence (allongé
+    à EXTRA_MIN_HOURS si besoin) et finit à une rupture du manque restant ou
+    à la durée max ; pour chaque créneau, seul le candidat libre le moins cher
+    est essayé. Une branche est coupée dès que son coût atteint la meilleure
+    solution. `demand` (week_demand) ajoute l'effectif prévu aux minimums.
+    Retourne {'shifts': [{employee, day, start, end, hours, cost}],
+    'cost': total, 'uncovered': [jours sans solution]}.
+    """
+    staff_list = staff_list or STAFF
+    min_slots = int(EXTRA_MIN_HOURS * 60) // SLOT_MINUTES
+    shifts, uncovered = [], []
+    for day in days:
+        deficit = coverage_deficit(schedule, day, staff_list, opening,
+                                   None if demand is None else demand[day])
+        if not deficit.any():
+            continue
+        sh, sm, eh, em = opening_hours(day, opening)
+        open_slot = to_minutes(sh, sm) // SLOT_MINUTES
+        close_slot = to_minutes(eh, em) // SLOT_MINUTES
+        pool = [
+            emp for emp in candidates
+            if not (schedule.get(emp.name) and schedule[emp.name][day]
+                    and schedule[emp.name][day].get('hours', 0) > 0)
+        ]
+        max_slots = max((int(emp.max_daily_hours * 60) // SLOT_MINUTES for emp in pool), default=0)
+        priced = {}
+
+        def options(span):
+            """Candidats pouvant tenir ce créneau, du moins cher au plus cher."""
+            if span not in priced:
+                s_min, e_min = span[0] * SLOT_MINUTES, span[1] * SLOT_MINUTES
+                priced[span] = sorted(
+                    ((extra_shift_cost(emp, day, s_min, e_min), emp) for emp in pool
+                     if span[1] - span[0] <= emp.max_daily_hours * 60 // SLOT_MINUTES
+                     and fits_availability(emp, day, s_min, e_min)),
+                    key=lambda o: o[0],
+                )
+            return priced[span]
+
+        def spans(missing, q):
+            ends = {min(q + max_slots, close_slot)}
+            ends.update(e for e in range(q + 1, close_slot + 1)
+                        if e == close_slot or missing[e] != missing[e - 1])
+            result = set()
+            for e in ends:
+                if e - q > max_slots:
+                    continue
+                e = min(max(e, q + min_slots), close_slot)
+                result.add((max(min(q, e - min_slots), open_slot), e))
+            return result
+
+        best = [float('inf'), None]
+
+        def search(missing, used, cost, chosen):
+            todo = np.flatnonzero(missing)
+            if not len(todo):
+                best[0], best[1] = cost, list(chosen)
+                return
+            branches = []
+            for span in spans(missing, int(todo[0])):
+                pick = next(((c, emp) for c, emp in options(span) if emp.name not in used), None)
+                if pick is not None and cost + pick[0] < best[0]:
+                    branches.append((pick[0], span, pick))
+            for price, span, pick in sorted(branches, key=lambda b: b[0]):
+                if cost + price >= best[0]:
+                    break
+                child = missing.copy()
+                child[span[0]:span[1]] -= 1
+                chosen.append((span, pick))
+                search(np.maximum(child, 0), used | {pick[1].name}, cost + price, chosen)
+                chosen.pop()
+
+        search(deficit, frozenset(), 0.0, [])
+        if best[1] is None:
+            uncovered.append(day)
+            continue
+        for (start, end), (cost, emp) in best[1]:
+            shifts.append({
+                'employee': emp.name,
+                'day': day,
+                'start': time_str(*from_minutes(start * SLOT_MINUTES)),
+                'end': time_str(*from_minutes(end * SLOT_MINUTES)),
+                'hours': (end - start) * SLOT_MINUTES / 60,
+                'cost': cost,
+            })
+    return {'shifts': shifts, 'cost': sum(s['cost'] for s in shifts), 'uncovered': uncovered}
+
+
+# ── Réparation rapide (absence de dernière minute) ───────────────────────
+
+REPAIR_MAX_CHANGES = 3
+MIN_REST_MINUTES = 11 * 60
+# Ordre de préférence des gestes : prolonger < inverser matin/soir < rappeler
+# quelqu'un de repos < appeler un extra
+REPAIR_PENALTY = {'extend': 1.0, 'swap': 2.0, 'call': 3.0, 'extra': 4.0}
+REPAIR_LABELS = {'extend': "Prolonger", 'swap': "Inverser matin/soir", 'call': "Rappeler", 'extra': "Extra"}
+
+
+def _slot_margin(schedule, day, staff_list, opening=None):
+    """Effectif moins minimum requis, par quart d'heure (négatif = manque), pauses ignorées."""
+    cover = coverage_profile(schedule, day, staff_list, with_breaks=False)
+    return (cover - required_coverage(day, opening)).reshape(SLOTS_PER_DAY, SLOT_MINUTES).min(axis=1)
+
+
+def _slot_presence(entry):
+    """Présence d'un shift par quart d'heure (0/1)."""
+    presence = np.zeros(SLOTS_PER_DAY, dtype=np.int16)
+    if entry and entry.get('hours', 0) > 0:
+        presence[parse_minutes(entry['start']) // SLOT_MINUTES:parse_minutes(entry['end']) // SLOT_MINUTES] = 1
+    return presence
+
+
+def _rest_ok(days, day, start_min, end_min):
+    """11h de repos avec la veille et le lendemain de la semaine."""
+    prev = days[day - 1] if day > 0 else None
+    nxt = days[day + 1] if day < 6 else None
+    if prev and prev.get('hours', 0) > 0 and 24 * 60 - parse_minutes(prev['end']) + start_min < MIN_REST_MINUTES:
+        return False
+    if nxt and nxt.get('hours', 0) > 0 and 24 * 60 - end_min + parse_minutes(nxt['start']) < MIN_REST_MINUTES:
+        return False
+    return True
+
+
+def _can_call_in(emp, days, day):
+    """Rappel un jour de repos : 6 jours max, et 2 jours off consécutifs gardés pour un CDI."""
+    worked = {d for d, e in enumerate(days) if e and e.get('hours', 0) > 0} | {day}
+    if len(worked) > 6:
+        return False
+    if emp.name in CDI_NAMES:
+        # Dimanche(6) + Lundi(0) compte, comme check_labor_law et score_components
+        return any(d not in worked and (d + 1) % 7 not in worked for d in range(7))
+    return True
+
+
+def _repair_moves(schedule, weekly_hours, day, margin, staff_list, candidates, opening=None):
+    """Gestes possibles pour combler le manque d'un jour, un shift touché par geste."""
+    sh, sm, eh, em = opening_hours(day, opening)
+    open_min, close_min = to_minutes(sh, sm), to_minutes(eh, em)
+    short = margin < 0
+    slots = np.flatnonzero(short)
+    starts = [int(q) * SLOT_MINUTES for q in slots if q == 0 or not short[q - 1]]
+    ends = [(int(q) + 1) * SLOT_MINUTES for q in slots if q == SLOTS_PER_DAY - 1 or not short[q + 1]]
+    min_len = int(EXTRA_MIN_HOURS * 60)
+
+    max_len = int(max([emp.max_daily_hours for emp in staff_list] + [emp.max_daily_hours for emp in candidates]) * 60)
+    spans = set()
+    for lo, hi in list(zip(starts, ends)) + [(starts[0], ends[-1])]:
+        if hi - lo < min_len:
+            hi = min(lo + min_len, close_min)
+            lo = max(hi - min_len, open_min)
+        if hi - lo > max_len:
+            # Trou trop long pour un seul shift : on en couvre le début ou la fin
+            spans.update({(lo, lo + max_len), (hi - max_len, hi)})
+        else:
+            spans.add((lo, hi))
+
+    moves = []
+
+    def add(kind, emp, before, shift_type, start, end, cost=0.0):
+        if end - start > emp.max_daily_hours * 60 or not fits_availability(emp, day, start, end):
+            return
+        days = schedule.get(emp.name)
+        if days is not None and not _rest_ok(days, day, start, end):
+            return
+        old_h = before['hours'] if before and before.get('hours', 0) > 0 else 0
+        new_h = (end - start) / 60
+        if weekly_hours.get(emp.name, 0) + new_h - old_h > 48:
+            return
+        entry = make_shift(shift_type, *from_minutes(start), *from_minutes(end))
+        delta = _slot_presence(entry) - _slot_presence(before)
+        if not (delta[short] > 0).any():
+            return
+        moves.append({
+            'kind': kind, 'employee': emp.name, 'day': day, 'before': before, 'entry': entry,
+            'delta': delta, 'cost': cost,
+            'penalty': REPAIR_PENALTY[kind] + abs(new_h - old_h) / 10 + cost / 100,
+        })
+
+    for emp in staff_list:
+        days = schedule.get(emp.name)
+        if days is None:
+            continue
+        entry = days[day]
+        if entry and entry['type'] in ABSENCE_TYPES:
+            continue
+        if entry and entry.get('hours', 0) > 0:
+            start, end = parse_minutes(entry['start']), parse_minutes(entry['end'])
+            longest = int(emp.max_daily_hours * 60)
+            for new_end in set(ends) | {min(start + longest, close_min)}:
+                if new_end > end:
+                    add('extend', emp, entry, 'soir' if new_end == close_min else entry['type'], start, new_end)
+            for new_start in set(starts) | {max(end - longest, open_min)}:
+                if new_start < start:
+                    add('extend', emp, entry, entry['type'], new_start, end)
+            length = end - start
+            if entry['type'] == 'matin':
+                add('swap', emp, entry, 'soir', close_min - length, close_min)
+            elif entry['type'] == 'soir':
+                add('swap', emp, entry, 'matin', open_min, open_min + length)
+        elif _can_call_in(emp, days, day):
+            for lo, hi in spans:
+                add('call', emp, entry, 'soir' if hi == close_min else 'matin', lo, hi)
+
+    for emp in candidates:
+        if emp.name in schedule:
+            continue
+        for lo, hi in spans:
+            add('extra', emp, None, 'soir' if hi == close_min else 'matin', lo, hi,
+                cost=extra_shift_cost(emp, day, lo, hi))
+    moves.sort(key=lambda m: m['penalty'])
+    return moves
+
+
+def _best_repair(margin, moves_for, max_changes):
+    """Moins de gestes possible, puis pénalité minimale (séparation-évaluation).
+
+    `moves_for(margin)` rend les gestes utiles pour une marge donnée : ils
+    sont recalculés après chaque geste, un renfort du soir pouvant suivre
+    un passage du soir au matin.
+    """
+    best = [(max_changes, float('inf')), None]
+    cache = {}
+
+    def search(margin, chosen, used, penalty):
+        todo = np.flatnonzero(margin < 0)
+        if not len(todo):
+            best[0], best[1] = (len(chosen), penalty), list(chosen)
+            return
+        if len(chosen) + 1 > best[0][0]:
+            return
+        key = margin.tobytes()
+        if key not in cache:
+            cache[key] = moves_for(margin)
+        for move in cache[key]:
+            if move['employee'] in used or move['delta'][todo[0]] <= 0:
+                continue
+            score = (len(chosen) + 1, penalty + move['penalty'])
+            if len(chosen) + 1 == best[0][0] and score >= best[0]:
+                continue
+            chosen.append(move)
+            search(margin + move['delta'], chosen, used | {move['employee']}, penalty + move['penalty'])
+            chosen.pop()
+
+    search(margin, [], frozenset(), 0.0)
+    return best[1]
+
+
+def repair_schedule(schedule, weekly_hours, name, days, kind='maladie', staff_list=None,
+                    candidates=(), max_changes=REPAIR_MAX_CHANGES, breaks=False, opening=None):
+    """Répare un planning publié après une absence imprévue, en touchant le moins de shifts.
+
+    Les jours `days` de `name` passent en absence `kind` ; pour chaque jour
+    où la couverture (fermeture à 2, 1 personne minimum, ou minimums de la
+    table `opening`) n'est plus assurée, cherche la plus petite combinaison
+    de gestes (prolonger un présent, inverser son matin/soir, rappeler
+    quelqu'un de repos, appeler un extra de `candidates`) qui respecte repos
+    de 11h, durée max, disponibilités et 48h. Le planning d'origine n'est pas modifié.
+
+    Les extras appelés sont ajoutés au planning rendu (et à 'extras').
+    Retourne {'schedule', 'weekly_hours', 'changes': [geste], 'extras':
+    [Employee], 'unresolved': [jours]}.
+    """
+    staff_list = staff_list or STAFF
+    schedule, weekly_hours = copy_schedule(schedule), dict(weekly_hours)
+    changes, unresolved, extras = [], [], []
+    by_name = {emp.name: emp for emp in candidates}
+    for day in sorted(days):
+        entry = schedule[name][day]
+        if entry and entry.get('hours', 0) > 0:
+            weekly_hours[name] -= entry['hours']
+        schedule[name][day] = {'type': kind, 'start': '', 'end': '', 'hours': 0}
+
+    for day in sorted(days):
+        margin = _slot_margin(schedule, day, staff_list, opening)
+        if (margin >= 0).all():
+            continue
+        chosen = _best_repair(
+            margin,
+            lambda m: _repair_moves(schedule, weekly_hours, day, m, staff_list, candidates, opening),
+            max_changes)
+        if chosen is None:
+            unresolved.append(day)
+            continue
+        for move in chosen:
+            if move['employee'] not in schedule:
+                schedule[move['employee']] = [None] * 7
+                weekly_hours[move['employee']] = 0.0
+                extras.append(by_name[move['employee']])
+            old_h = move['before']['hours'] if move['before'] and move['before'].get('hours', 0) > 0 else 0
+            schedule[move['employee']][day] = dict(move['entry'])
+            weekly_hours[move['employee']] += move['entry']['hours'] - old_h
+            changes.append(move)
+    if breaks:
+        schedule, weekly_hours = place_breaks(schedule, weekly_hours, staff_list + extras, opening=opening)
+    return {'schedule': schedule, 'weekly_hours': weekly_hours, 'changes': changes, 'extras': extras,
+            'unresolved': unresolved}
+
+
+# ── Scénarios « et si… ? » ──────────────────────────────────────────────
+
+def _scenario_result(label, schedule, weekly_hours, staff_list, opening=None, profiles=None):
+    warnings, staffing_issues = check_labor_law(schedule, weekly_hours, staff_list, opening, profiles)
+    score, parts = score_schedule(schedule, staff_list, opening=opening, profiles=profiles)
+    return {
+        'label': label,
+        'schedule': schedule,
+        'weekly_hours': weekly_hours,
+        'staff': staff_list,
+        'warnings': warnings,
+        'staffing_issues': staffing_issues,
+        'score': score,
+        'parts': parts,
     }
-    .stMultiSelect span[data-baseweb="tag"] {
-        background: rgba(255,255,255,0.12) !important;
-        color: #ffffff !important;
-        border-radius: 4px !important;
+
+
+def run_scenario(base, scenario, params, staff_list, overrides=(), profiles=None):
+    """Planning d'une variante à partir du planning de base partagé.
+
+    `scenario` : {'label', 'off_days': {nom: {jours}}, 'extras': [Employee],
+    'overrides': [modifs]}. Sans absence ni extra, la variante repart d'une
+    copie de `base` et n'applique que ses propres modifications ; sinon la
+    semaine est régénérée avec les paramètres fusionnés, puis les
+    modifications de base (`overrides`) et de la variante sont appliquées.
+    `profiles` : profils droit du travail par employé (cf. check_labor_law).
+    """
+    off_days = scenario.get('off_days') or {}
+    extras = scenario.get('extras') or []
+    own_overrides = list(scenario.get('overrides') or [])
+    if off_days or extras:
+        merged_off = {n: set(days) for n, days in (params.get('custom_off_days') or {}).items()}
+        for name, days in off_days.items():
+            merged_off.setdefault(name, set()).update(days)
+        schedule, weekly_hours = generate_week(**dict(
+            params, custom_off_days=merged_off or None, extras=(params.get('extras') or []) + extras,
+        ))
+        staff_list = staff_list + extras
+        own_overrides = list(overrides) + own_overrides
+    else:
+        schedule, weekly_hours = copy_schedule(base['schedule']), dict(base['weekly_hours'])
+    if own_overrides:
+        schedule, weekly_hours = apply_manual_overrides(schedule, weekly_hours, own_overrides)
+        if params.get('breaks'):
+            schedule, weekly_hours = place_breaks(schedule, weekly_hours, staff_list, opening=params.get('opening'))
+    return _scenario_result(scenario.get('label', ''), schedule, weekly_hours, staff_list, params.get('opening'),
+                            profiles)
+
+
+def compare_scenarios(scenarios, params, staff_list, overrides=(), base=None, profiles=None):
+    """Génère la base une seule fois puis les variantes, l'une après l'autre.
+
+    Pas de threads : la génération est du Python pur (GIL) et partage le
+    cache de semaines (_week_cache) ; quelques variantes tiennent en
+    quelques millisecondes.
+
+    `params` : arguments de generate_week de la base ; `base` : (planning,
+    heures) déjà calculé pour la base, modifications comprises, sinon il est
+    généré ici. Retourne (résultat de base, [résultats des variantes]).
+    """
+    if base is None:
+        schedule, weekly_hours = generate_week_cached(**params)
+        if overrides:
+            schedule, weekly_hours = apply_manual_overrides(schedule, weekly_hours, list(overrides))
+            if params.get('breaks'):
+                schedule, weekly_hours = place_breaks(schedule, weekly_hours, staff_list,
+                                                      opening=params.get('opening'))
+        base = (schedule, weekly_hours)
+    base_result = _scenario_result('Base', base[0], base[1], staff_list, params.get('opening'),
+                                   profiles)
+    return base_result, [run_scenario(base_result, sc, params, staff_list, overrides, profiles)
+                         for sc in scenarios]
+
+
+def _shift_label(entry):
+    if not entry:
+        return ''
+    if entry.get('hours', 0) > 0:
+        return f"{entry['type']} {entry['start']}-{entry['end']}"
+    return entry['type']
+
+
+def diff_scenario(base, variant):
+    """Différences d'une variante avec la base : shifts, heures et alertes.
+
+    Retourne {'shifts': [(nom, jour, base, variante)], 'hours': {nom: (base,
+    variante)}, 'added': [alertes], 'removed': [alertes]}.
+    """
+    shifts = []
+    hours = {}
+    names = [emp.name for emp in variant['staff']]
+    for name in names:
+        base_days = base['schedule'].get(name)
+        for d, entry in enumerate(variant['schedule'][name]):
+            if base_days is None and not (entry and entry.get('hours', 0) > 0):
+                continue  # employé ajouté par la variante : seuls ses shifts comptent
+            before = _shift_label(base_days[d]) if base_days else ''
+            after = _shift_label(entry)
+            if before != after:
+                shifts.append((name, JOURS[d], before, after))
+        before_h = base['weekly_hours'].get(name, 0.0)
+        after_h = variant['weekly_hours'].get(name, 0.0)
+        if abs(after_h - before_h) > 1e-6:
+            hours[name] = (before_h, after_h)
+
+    def alerts(result):
+        return result['warnings'] + [
+            f"{issue['day']} : {issue['count']} personne(s) à la fermeture"
+            for issue in result['staffing_issues']
+        ]
+
+    base_alerts, variant_alerts = alerts(base), alerts(variant)
+    return {
+        'shifts': shifts,
+        'hours': hours,
+        'added': [a for a in variant_alerts if a not in base_alerts],
+        'removed': [a for a in base_alerts if a not in variant_alerts],
     }
 
-    /* Checkbox */
-    .stCheckbox input[type="checkbox"] { accent-color: #ffffff; }
-
-    /* Boutons */
-    .stButton > button {
-        background: transparent !important;
-        color: rgba(255,255,255,0.7) !important;
-        border: 1px solid rgba(255,255,255,0.2) !important;
-        border-radius: 6px !important;
-        font-family: 'Montserrat', sans-serif !important;
-        font-size: 10px !important;
-        letter-spacing: 2px !important;
-        text-transform: uppercase !important;
-        font-weight: 600 !important;
-        transition: all 0.2s !important;
+
+# ── Diagnostic d'infaisabilité (relaxation incrémentale) ────────────────
+
+def hard_failures(schedule, opening=None):
+    """Règles bloquantes violées : {clé: libellé}.
+
+    ('fermeture', jour) : moins de personnes à la fermeture que le minimum ;
+    ('repos', nom, jour) : moins de 11h de repos entre `jour` et le lendemain.
+    """
+    failures = {}
+    for d in range(7):
+        if is_closed(d, opening):
+            continue
+        required = int((DEFAULT_OPENING if opening is None else opening)[d, CLOSERS_MIN])
+        closing_time = time_str(*opening_hours(d, opening)[2:])
+        count = sum(1 for days in schedule.values()
+                    if days[d] and days[d].get('hours', 0) > 0 and days[d].get('end') == closing_time)
+        if count < required:
+            failures[('fermeture', d)] = f"{JOURS[d]} : {count} personne(s) à la fermeture (min {required})"
+    for name, days in schedule.items():
+        for d, rest in _week_features(days, 0.0)['rests']:
+            if rest * 60 < MIN_REST_MINUTES:
+                failures[('repos', name, d)] = (
+                    f"{name.split()[0]} : {rest:.1f}h de repos après le {JOURS[d]} (min 11h)"
+                )
+    return failures
+
+
+def week_constraints(params, overrides=()):
+    """Contraintes de la semaine qui retirent quelqu'un d'un jour : {clé: libellé}.
+
+    Rotation et congés ('off'), absences datées ('absence'),
+    disponibilités restreintes ('dispo'), vacances ('vacances') et
+    modifications manuelles ('modif', index).
+    """
+    constraints = {}
+    vacation = params.get('vacation')
+    staff = [emp for emp in STAFF if emp.name != vacation] + list(params.get('extras') or [])
+    for name, days in get_off_days(params['week_num'], params.get('meeting_week', False),
+                                   params.get('rotation')).items():
+        if name != vacation:
+            for d in sorted(days):
+                constraints[('off', name, d)] = f"{name.split()[0]} off {JOURS[d]} (rotation)"
+    for name, days in (params.get('custom_off_days') or {}).items():
+        for d in sorted(days):
+            constraints.setdefault(('off', name, d), f"{name.split()[0]} en congé {JOURS[d]}")
+    dated = params.get('dated_off') or {}
+    if params.get('absences') and params.get('monday'):
+        dated = params['absences'].week_off_days(params['monday'])
+    for name, days in dated.items():
+        for d, kind in sorted(days.items()):
+            constraints[('absence', name, d)] = (
+                f"{name.split()[0]} {ABSENCE_TYPES.get(kind, kind).lower()} {JOURS[d]}"
+            )
+    for emp in staff:
+        for d in range(7):
+            mask = day_availability(emp, d)
+            if mask != FULL_DAY_MASK:
+                detail = "indisponible" if not mask else "disponibilités restreintes"
+                constraints[('dispo', emp.name, d)] = f"{emp.name.split()[0]} {detail} {JOURS[d]}"
+    if vacation:
+        constraints[('vacances', vacation)] = f"{vacation.split()[0]} en vacances"
+    for i, ov in enumerate(overrides):
+        constraints[('modif', i)] = (
+            f"Modification : {ov['employee'].split()[0]} {JOURS[ov['day']]} "
+            + (f"{ov['start']}-{ov['end']}" if ov.get('start') else ov['type'])
+        )
+    return constraints
+
+
+def _relaxed_week(params, overrides, relaxed):
+    """Planning régénéré avec les contraintes `relaxed` levées.
+
+    Lever une affectation ('shift', nom, jour) retire ce shift du planning.
+    """
+    kwargs = dict(params, breaks=False, relax=frozenset(k for k in relaxed if k[0] in ('off', 'absence', 'dispo')))
+    if any(k[0] == 'vacances' for k in relaxed):
+        kwargs['vacation'] = None
+    schedule, weekly_hours = generate_week(**kwargs)
+    kept = [ov for i, ov in enumerate(overrides) if ('modif', i) not in relaxed]
+    if kept:
+        schedule, weekly_hours = apply_manual_overrides(schedule, weekly_hours, kept)
+    for k in relaxed:
+        if k[0] == 'shift':
+            schedule[k[1]][k[2]] = None
+    return schedule
+
+
+def diagnose_week(params, overrides=()):
+    """Explique pourquoi la semaine ne respecte pas les règles bloquantes.
+
+    `params` : arguments de generate_week (comme compare_scenarios),
+    `overrides` : modifications manuelles. Chaque échec est expliqué à part :
+    seules les contraintes de son jour (et de la veille, ou du lendemain
+    pour le repos) sont candidates ; pour le repos s'y ajoutent la règle
+    violée et les deux shifts qui l'encadrent ('shift', nom, jour).
+    Chacune est d'abord levée seule (corrections en un geste ; le repos
+    n'est jamais proposé), puis le conflit est réduit par relaxation
+    incrémentale : une contrainte est levée pour de bon si l'échec persiste
+    sans elle. Il reste un ensemble minimal de contraintes qui, à elles
+    seules, provoquent l'échec. Retourne None si la semaine est faisable,
+    sinon [{'failure', 'fixes', 'conflict', 'understaffed'}] (libellés).
+    """
+    opening = params.get('opening')
+    overrides = list(overrides)
+    schedule = _relaxed_week(params, overrides, ())
+    failures = hard_failures(schedule, opening)
+    if not failures:
+        return None
+    constraints = week_constraints(params, overrides)
+    week_keys = list(constraints)  # sans les règles et shifts ajoutés par échec ci-dessous
+    cache = {}
+
+    def failing(relaxed):
+        relaxed = frozenset(relaxed)
+        if relaxed not in cache:
+            cache[relaxed] = hard_failures(_relaxed_week(params, overrides, relaxed), opening).keys() - relaxed
+        return cache[relaxed]
+
+    report = []
+    for key, label in failures.items():
+        day = key[-1]
+        days = (day, day + 1) if key[0] == 'repos' else (day - 1, day)
+        candidates = [k for k in week_keys
+                      if k[0] == 'vacances' or (overrides[k[1]]['day'] if k[0] == 'modif' else k[2]) in days]
+        if key[0] == 'repos':
+            # La règle de repos elle-même fait partie du conflit (levée = non vérifiée),
+            # avec les shifts de la veille et du lendemain
+            name = key[1]
+            constraints[key] = f"{name.split()[0]} : 11h de repos après le {JOURS[day]}"
+            for d in days:
+                entry = schedule[name][d]
+                constraints[('shift', name, d)] = (
+                    f"{name.split()[0]} {entry['type']} {JOURS[d]} {entry['start']}-{entry['end']}"
+                )
+            candidates += [('shift', name, d) for d in days] + [key]
+        fixes = [k for k in candidates if k[0] != 'repos' and not failing({k})]
+        understaffed = key in failing(candidates)
+        relaxed = set()
+        if not understaffed:
+            for k in candidates:
+                if key in failing(relaxed | {k}):
+                    relaxed.add(k)
+        report.append({
+            'failure': label,
+            'fixes': [constraints[k] for k in fixes],
+            'conflict': [] if understaffed else [constraints[k] for k in candidates if k not in relaxed],
+            'understaffed': understaffed,
+        })
+    return report
+
+
+# ── Export Connecteam ─────────────────────────────────────────────────────
+
+def time_24_to_12(t):
+    """Convertit '09:45' → '09:45am', '15:00' → '03:00pm', '23:15' → '11:15pm'."""
+    parts = t.split(':')
+    h, m = int(parts[0]), int(parts[1])
+    if h == 0:
+        return f"12:{m:02d}am"
+    elif h < 12:
+        return f"{h:02d}:{m:02d}am"
+    elif h == 12:
+        return f"12:{m:02d}pm"
+    else:
+        return f"{h - 12:02d}:{m:02d}pm"
+
+
+SHIFT_TITLES = {'matin': 'Matin', 'soir': 'Soir', 'journee': 'Journée'}
+
+CONNECTEAM_HEADER = "Date,Start,End,Timezone,Unpaid break,Paid break,Shift title,Job,Sub item,Shift tags,Users,Address,Note,Number of users,Require Approval,Tasks"
+
+# Table 24h → am/pm pour les 1440 minutes de la journée, indexée par la chaîne
+# 'H:MM' produite par time_str (pas de re-parsing par shift). Les saisies
+# non normalisées ('09:45') repassent par time_24_to_12.
+TIME_12H = {time_str(*from_minutes(m)): time_24_to_12(time_str(*from_minutes(m))) for m in range(24 * 60)}
+
+
+def connecteam_rows(horizon, staff_list):
+    """Lignes CSV Connecteam (sans en-tête) d'un horizon issu de generate_horizon.
+
+    Les dates de tout l'horizon sont formatées une seule fois, les heures
+    passent par TIME_12H et la fin de ligne (titre, employé) est précalculée.
+    Les pauses (place_breaks) remplissent les colonnes Unpaid/Paid break, en minutes.
+    """
+    first = horizon[0][0].toordinal() if horizon else 0
+    dates = []
+    for ordinal in range(first, first + 7 * len(horizon)):
+        d = datetime.date.fromordinal(ordinal)
+        dates.append(f"{d.month:02d}/{d.day:02d}/{d.year}")  # = strftime('%m/%d/%Y'), en plus rapide
+    names = [emp.name for emp in staff_list]
+    suffixes = {
+        (shift_type, name): f",{title},,,,{name},,,,,,"
+        for shift_type, title in SHIFT_TITLES.items()
+        for name in names
     }
-    .stButton > button:hover {
-        background: rgba(255,255,255,0.08) !important;
-        border-color: rgba(255,255,255,0.5) !important;
-        color: #ffffff !important;
+    time_12h = TIME_12H.get
+    rows = []
+    append = rows.append
+    for w, (_, _, schedule, _) in enumerate(horizon):
+        for day in range(7):
+            date_str = dates[w * 7 + day]
+            for name in names:
+                entry = schedule[name][day]
+                if not entry or entry.get('hours', 0) == 0:
+                    continue
+                shift_type = entry['type']
+                if shift_type in ('conge', 'indispo') or shift_type in ABSENCE_TYPES:
+                    continue
+                suffix = suffixes.get((shift_type, name)) or f",{shift_type},,,,{name},,,,,,"
+                start, end = entry['start'], entry['end']
+                start = time_12h(start) or time_24_to_12(start)
+                end = time_12h(end) or time_24_to_12(end)
+                unpaid = paid = ''
+                if entry.get('break_start'):
+                    if entry.get('break_paid'):
+                        paid = entry['break_min']
+                    else:
+                        unpaid = entry['break_min']
+                append(f"{date_str},{start},{end},,{unpaid},{paid}{suffix}")
+    return rows
+
+
+def export_connecteam_csv(start_date, num_weeks, first_week_type, extras=None, vacation=None,
+                          absences=None, breaks=False, exceptions=None):
+    """Génère un CSV Connecteam pour une plage de dates (absences et horaires exceptionnels inclus)."""
+    base_staff = [emp for emp in STAFF if emp.name != vacation] if vacation else list(STAFF)
+    all_staff = base_staff + (extras or [])
+    horizon = generate_horizon(start_date, num_weeks, first_week_type, extras=extras,
+                               vacation=vacation, absences=absences, breaks=breaks, exceptions=exceptions)
+    return '\n'.join([CONNECTEAM_HEADER] + connecteam_rows(horizon, all_staff))
+
+
+# ── Pointages Connecteam : prévu / réel ──────────────────────────────────
+
+TIMESHEET_CHUNK = 20_000             # lignes de pointage lues par bloc
+TIMESHEET_DATE_FORMAT = '%m/%d/%Y'   # dates de l'export Connecteam (comme CONNECTEAM_HEADER)
+LATE_GRACE_MINUTES = 5               # retard toléré à l'arrivée
+OVERTIME_GRACE_MINUTES = 15          # dépassement toléré avant heures sup non prévues
+
+# Colonnes de l'export pointeuse (en minuscules) : première présente retenue
+TIMESHEET_COLUMNS = {
+    'user': ('users', 'user', 'employee'),
+    'first': ('first name',),
+    'last': ('last name',),
+    'start_date': ('start date', 'clock in date', 'date'),
+    'start': ('in', 'start time', 'clock in', 'start'),
+    'end_date': ('end date', 'clock out date'),
+    'end': ('out', 'end time', 'clock out', 'end'),
+    'unpaid': ('unpaid breaks', 'unpaid break', 'total unpaid break'),
+}
+
+
+def _match_columns(columns, spec):
+    """Champ → colonne du CSV, d'après `spec` ({champ: noms en minuscules})."""
+    lower = {str(c).strip().lower(): c for c in columns}
+    found = {}
+    for field, candidates in spec.items():
+        for candidate in candidates:
+            if candidate in lower:
+                found[field] = lower[candidate]
+                break
+    return found
+
+
+def _timesheet_columns(columns):
+    """Colonnes de l'export pointeuse (ValueError si incomplet)."""
+    found = _match_columns(columns, TIMESHEET_COLUMNS)
+    missing = [f for f in ('start_date', 'start', 'end') if f not in found]
+    if 'user' not in found and 'first' not in found:
+        missing.append('user')
+    if missing:
+        raise ValueError(f"colonnes manquantes : {', '.join(missing)}")
+    return found
+
+
+# Inverse de TIME_12H : '09:45am' → minutes, pour les heures de la pointeuse
+CLOCK_MINUTES_12H = {text: minute for minute, text in enumerate(TIME_12H.values())}
+CLOCK_PATTERN = re.compile(r'(\d{1,2}):(\d{2})\s*([ap]m)?')
+BREAK_PATTERN = re.compile(r'(\d+)(?::(\d{2}))?')
+
+
+def _parse_clock(text):
+    """'09:45am', '9:45 PM' ou '21:45' → minutes depuis minuit (NaN si illisible)."""
+    text = text.strip().lower()
+    minute = CLOCK_MINUTES_12H.get(text)
+    if minute is not None:
+        return minute
+    match = CLOCK_PATTERN.fullmatch(text)
+    if not match:
+        return np.nan
+    h, m = int(match[1]), int(match[2])
+    if match[3]:
+        h = h % 12 + (12 if match[3] == 'pm' else 0)
+    return h * 60 + m
+
+
+def _parse_break(text):
+    """Durée de pause '0:20' ou '20' → minutes (0 si vide ou illisible)."""
+    match = BREAK_PATTERN.fullmatch(text.strip())
+    if not match:
+        return 0
+    return int(match[1]) * 60 + int(match[2]) if match[2] else int(match[1])
+
+
+def _parse_distinct(values, parse):
+    """Applique `parse` une fois par valeur distincte d'une colonne (heures : ≤ 1440 valeurs)."""
+    codes, uniques = values.factorize()
+    parsed = np.array([parse(v) for v in uniques] + [np.nan], dtype=float)
+    return parsed[codes]  # code -1 (valeur manquante) → NaN
+
+
+def timesheet_chunks(source, chunk_rows=TIMESHEET_CHUNK):
+    """Lit un export de pointage Connecteam par blocs de `chunk_rows` lignes.
+
+    `source` : chemin ou fichier (texte ou binaire). Chaque bloc est normalisé en
+    colonnes employee, date, start, end, worked ; heures en minutes depuis minuit
+    du jour d'arrivée (une sortie après minuit dépasse 1440), pauses non payées
+    déduites. Les lignes illisibles (pointage en cours, date vide) sont écartées.
+    Génère (bloc normalisé, nombre de lignes lues).
+    """
+    import pandas as pd
+
+    columns = None
+    reader = pd.read_csv(source, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+                         encoding='utf-8-sig', skipinitialspace=True)
+    for chunk in reader:
+        if columns is None:
+            columns = _timesheet_columns(chunk.columns)
+        if 'user' in columns:
+            employee = chunk[columns['user']].str.strip()
+        else:
+            last = chunk[columns['last']] if 'last' in columns else ''
+            employee = (chunk[columns['first']].str.strip() + ' ' + last).str.strip()
+        day = pd.to_datetime(chunk[columns['start_date']], format=TIMESHEET_DATE_FORMAT, errors='coerce')
+        start = _parse_distinct(chunk[columns['start']], _parse_clock)
+        end = _parse_distinct(chunk[columns['end']], _parse_clock)
+        if 'end_date' in columns:
+            end_day = pd.to_datetime(chunk[columns['end_date']], format=TIMESHEET_DATE_FORMAT, errors='coerce')
+            end = end + (end_day.fillna(day) - day).dt.days.to_numpy() * 24 * 60
+        end = np.where(end >= start, end, end + 24 * 60)
+        unpaid = _parse_distinct(chunk[columns['unpaid']], _parse_break) if 'unpaid' in columns else 0
+        punches = pd.DataFrame({'employee': employee, 'date': day, 'start': start, 'end': end,
+                                'worked': end - start - unpaid}).dropna()
+        yield punches[punches['employee'] != ''], len(chunk)
+
+
+def _planned_shifts(schedule, monday, index):
+    """Ajoute les shifts travaillés d'une semaine à l'index (nom, date) → (début, fin, heures)."""
+    for name, days in schedule.items():
+        for day, entry in enumerate(days):
+            if not entry or entry.get('hours', 0) == 0:
+                continue
+            if entry['type'] in ('conge', 'indispo') or entry['type'] in ABSENCE_TYPES:
+                continue
+            date = monday + datetime.timedelta(days=day)
+            index[(name, date)] = (parse_minutes(entry['start']), parse_minutes(entry['end']), entry['hours'])
+
+
+def _clock_label(start, end):
+    return f"{time_str(*from_minutes(int(start) % (24 * 60)))}-{time_str(*from_minutes(int(end) % (24 * 60)))}"
+
+
+def reconcile_timesheet(source, plan_of, staff_list=None, chunk_rows=TIMESHEET_CHUNK,
+                        late_grace=LATE_GRACE_MINUTES, overtime_grace=OVERTIME_GRACE_MINUTES):
+    """Rapproche un export de pointage du planning prévu, employé-jour par employé-jour.
+
+    Les pointages sont lus par blocs (timesheet_chunks) et agrégés au fil de
+    l'eau par (employé, date) : première arrivée, dernière sortie, minutes
+    travaillées. La mémoire dépend du nombre d'employés-jours, pas du nombre
+    de lignes. `plan_of(lundi)` donne le planning prévu d'une semaine (None hors
+    horizon) ; chaque semaine pointée est indexée une fois par (employé, date).
+    Un shift prévu sans pointage entre la première et la dernière date pointée
+    est compté absent.
+
+    Retourne {'shifts': DataFrame (une ligne par employé-jour, trié par date),
+    'rows': lignes lues, 'skipped': lignes illisibles, 'unknown': noms hors
+    staff, 'outside': employés-jours pointés hors horizon}.
+    """
+    import pandas as pd
+
+    names = {emp.name for emp in (staff_list or STAFF)}
+    clocked = {}  # (nom, date) → [arrivée, sortie, minutes travaillées]
+    rows = kept = 0
+    unknown = set()
+    for punches, read in timesheet_chunks(source, chunk_rows):
+        rows += read
+        kept += len(punches)
+        known = punches['employee'].isin(names)
+        unknown.update(punches.loc[~known, 'employee'].unique())
+        daily = punches[known].groupby(['employee', 'date']).agg(
+            start=('start', 'min'), end=('end', 'max'), worked=('worked', 'sum'))
+        for (name, day), start, end, worked in daily.itertuples(name=None):
+            key = (name, day.date())
+            acc = clocked.get(key)
+            if acc is None:
+                clocked[key] = [start, end, worked]
+            else:
+                acc[0] = min(acc[0], start)
+                acc[1] = max(acc[1], end)
+                acc[2] += worked
+
+    planned = {}  # (nom, date) → (début, fin, heures)
+    outside = set()
+    if clocked:
+        first = min(date for _, date in clocked)
+        last = max(date for _, date in clocked)
+        monday = monday_of(first)
+        while monday <= last:
+            schedule = plan_of(monday)
+            if schedule is None:
+                outside.add(monday)
+            else:
+                _planned_shifts(schedule, monday, planned)
+            monday += datetime.timedelta(weeks=1)
+
+    records = []
+    skipped_outside = 0
+    for key in sorted(planned.keys() | clocked.keys(), key=lambda k: (k[1], k[0])):
+        name, date = key
+        if name not in names or not first <= date <= last:
+            continue
+        if monday_of(date) in outside:
+            skipped_outside += 1
+            continue
+        plan = planned.get(key)
+        punch = clocked.get(key)
+        planned_min = round(plan[2] * 60) if plan else 0
+        worked_min = punch[2] if punch else 0
+        late = punch[0] - plan[0] if plan and punch else 0
+        late = late if late > late_grace else 0
+        extra = worked_min - planned_min
+        overtime = extra if punch and extra > overtime_grace else 0
+        if not punch:
+            status = 'absent'
+        elif not plan:
+            status = 'non prévu'
+        elif late:
+            status = 'retard'
+        elif overtime:
+            status = 'heures sup'
+        else:
+            status = 'ok'
+        records.append({
+            'employee': name,
+            'date': date,
+            'planned': _clock_label(plan[0], plan[1]) if plan else '',
+            'clocked': _clock_label(punch[0], punch[1]) if punch else '',
+            'planned_hours': planned_min / 60,
+            'clocked_hours': worked_min / 60,
+            'delta_hours': extra / 60,
+            'late_min': int(late),
+            'overtime_hours': overtime / 60,
+            'status': status,
+        })
+    columns = ['employee', 'date', 'planned', 'clocked', 'planned_hours', 'clocked_hours',
+               'delta_hours', 'late_min', 'overtime_hours', 'status']
+    return {
+        'shifts': pd.DataFrame(records, columns=columns),
+        'rows': rows,
+        'skipped': rows - kept,
+        'unknown': sorted(unknown),
+        'outside': skipped_outside,
     }
 
-    /* Download button */
-    .stDownloadButton > button {
-        background: #ffffff !important;
-        color: #080808 !important;
-        border: none !important;
-        border-radius: 6px !important;
-        font-family: 'Montserrat', sans-serif !important;
-        font-size: 10px !important;
-        letter-spacing: 2px !important;
-        text-transform: uppercase !important;
-        font-weight: 700 !important;
+
+# ── Exports iCalendar et snapshots Arrow/Parquet ─────────────────────────
+
+ICS_VENUE = "Birdieland Réaumur"
+
+# Fuseau Europe/Paris (règles UE en vigueur) pour les DTSTART/DTEND locaux
+ICS_VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Paris",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+
+def _ics_escape(text):
+    """Échappement des valeurs TEXT iCalendar."""
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _slug(name):
+    """'Baptiste Le Moing' → 'baptiste-le-moing' (UID iCalendar, chemins du portail)."""
+    return ''.join(c if c.isalnum() else '-' for c in name.lower())
+
+
+def ics_lines(horizon, name):
+    """Lignes iCalendar des shifts d'un employé, produites au fil de l'eau.
+
+    Un VEVENT par shift travaillé de l'horizon (generate_horizon). L'UID ne
+    dépend que de la date et de l'employé : un nouvel import met à jour les
+    événements au lieu de les dupliquer.
+    """
+    slug = _slug(name)
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield "BEGIN:VCALENDAR"
+    yield "VERSION:2.0"
+    yield "PRODID:-//Birdieland//Planning Staff//FR"
+    yield "CALSCALE:GREGORIAN"
+    yield f"X-WR-CALNAME:{_ics_escape(f'Planning {ICS_VENUE} — {name.split()[0]}')}"
+    yield "X-WR-TIMEZONE:Europe/Paris"
+    yield from ICS_VTIMEZONE
+    for monday, _, schedule, _ in horizon:
+        days = schedule.get(name)
+        if days is None:
+            continue
+        for day, entry in enumerate(days):
+            if not entry or entry.get('hours', 0) == 0 or entry['type'] not in SHIFT_TITLES:
+                continue
+            date = monday + datetime.timedelta(days=day)
+            sh, sm = from_minutes(parse_minutes(entry['start']))
+            eh, em = from_minutes(parse_minutes(entry['end']))
+            title = SHIFT_TITLES[entry['type']]
+            yield "BEGIN:VEVENT"
+            yield f"UID:{date:%Y%m%d}-{slug}@birdieland-reaumur"
+            yield f"DTSTAMP:{stamp}"
+            yield f"DTSTART;TZID=Europe/Paris:{date:%Y%m%d}T{sh:02d}{sm:02d}00"
+            yield f"DTEND;TZID=Europe/Paris:{date:%Y%m%d}T{eh:02d}{em:02d}00"
+            yield f"SUMMARY:{_ics_escape(f'{title} — {ICS_VENUE}')}"
+            description = f"{entry['start']} - {entry['end']} ({entry['hours']:.2f}h)"
+            if entry.get('break_start'):
+                description += f", pause {entry['break_start']} ({entry['break_min']} min)"
+            yield f"DESCRIPTION:{_ics_escape(description)}"
+            yield "END:VEVENT"
+    yield "END:VCALENDAR"
+
+
+def _ics_fold(line):
+    """Replie une ligne à 75 octets (RFC 5545 §3.1) sans couper un caractère UTF-8."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    chunks = []
+    limit = 75
+    while data:
+        cut = min(limit, len(data))
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+        limit = 74  # la ligne de continuation commence par une espace
+    return '\r\n '.join(chunks)
+
+
+def export_ics(horizon, name):
+    """Calendrier .ics complet d'un employé (lignes CRLF, RFC 5545)."""
+    return ''.join(_ics_fold(line) + '\r\n' for line in ics_lines(horizon, name))
+
+
+def horizon_table(horizon, staff_list=None):
+    """Table Arrow en colonnes d'un horizon : une ligne par employé-jour planifié.
+
+    Les heures et pauses sont en minutes depuis minuit (nulles sans shift) ; employé,
+    rôle et type sont encodés en dictionnaire.
+    """
+    import pyarrow as pa
+
+    staff_list = staff_list or STAFF
+    roles = {emp.name: emp.role for emp in staff_list}
+    cols = {k: [] for k in ('date', 'week_type', 'meeting_week', 'employee', 'role',
+                            'type', 'start_min', 'end_min', 'hours', 'break_start_min', 'break_min',
+                            'break_paid')}
+    for monday, week_type, schedule, _ in horizon:
+        meeting = week_type == 3 and is_meeting_week(monday)
+        for day in range(7):
+            date = monday + datetime.timedelta(days=day)
+            for emp in staff_list:
+                days = schedule.get(emp.name)
+                entry = days[day] if days else None
+                if not entry:
+                    continue
+                worked = entry.get('hours', 0) > 0
+                cols['date'].append(date)
+                cols['week_type'].append(week_type)
+                cols['meeting_week'].append(meeting)
+                cols['employee'].append(emp.name)
+                cols['role'].append(roles[emp.name])
+                cols['type'].append(entry['type'])
+                cols['start_min'].append(parse_minutes(entry['start']) if worked else None)
+                cols['end_min'].append(parse_minutes(entry['end']) if worked else None)
+                cols['hours'].append(float(entry.get('hours', 0)))
+                has_break = worked and bool(entry.get('break_start'))
+                cols['break_start_min'].append(parse_minutes(entry['break_start']) if has_break else None)
+                cols['break_min'].append(entry['break_min'] if has_break else 0)
+                cols['break_paid'].append(bool(entry.get('break_paid')) if has_break else None)
+
+    return pa.table({
+        'date': pa.array(cols['date'], pa.date32()),
+        'week_type': pa.array(cols['week_type'], pa.int8()),
+        'meeting_week': pa.array(cols['meeting_week'], pa.bool_()),
+        'employee': pa.array(cols['employee'], pa.string()).dictionary_encode(),
+        'role': pa.array(cols['role'], pa.string()).dictionary_encode(),
+        'type': pa.array(cols['type'], pa.string()).dictionary_encode(),
+        'start_min': pa.array(cols['start_min'], pa.int16()),
+        'end_min': pa.array(cols['end_min'], pa.int16()),
+        'hours': pa.array(cols['hours'], pa.float32()),
+        'break_start_min': pa.array(cols['break_start_min'], pa.int16()),
+        'break_min': pa.array(cols['break_min'], pa.int16()),
+        'break_paid': pa.array(cols['break_paid'], pa.bool_()),
+    })
+
+
+def write_snapshot(horizon, sink, staff_list=None, fmt='parquet'):
+    """Écrit le snapshot d'un horizon en Parquet (zstd) ou Arrow IPC (Feather v2).
+
+    `sink` : chemin ou fichier binaire ouvert.
+    """
+    table = horizon_table(horizon, staff_list)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, sink, compression='zstd')
+    elif fmt == 'arrow':
+        import pyarrow.feather as feather
+        feather.write_feather(table, sink, compression='zstd')
+    else:
+        raise ValueError(f"Format de snapshot inconnu : {fmt}")
+
+
+# ── Portail statique du staff ────────────────────────────────────────────
+
+# Pages HTML autonomes à servir par n'importe quel serveur statique (le
+# service statique de Streamlit renvoie le HTML en text/plain).
+PORTAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'portal')
+PORTAL_MANIFEST = 'manifest.json'
+PORTAL_DATA = 'data'  # plannings publiés en JSON (point de départ de warm_start)
+PORTAL_FORMAT = 3     # gabarit des pages et données (3 : absences masquées) ; le changer republie tout
+
+
+def _portal_page(title, body, back=None):
+    """Document HTML autonome, CSS du planning embarqué."""
+    nav = f'<p><a href="{back}">← Retour</a></p>' if back else ''
+    return (
+        '<!DOCTYPE html><html lang="fr"><head><meta charset="utf-8">'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">'
+        f'<title>{title} — {ICS_VENUE}</title>'
+        f'<style>{read_static("planning.css")}'
+        'body { font-family:sans-serif; max-width:1100px; margin:24px auto; padding:0 12px; }'
+        '@media (prefers-color-scheme: dark) { body { background:#111; color:#eee; } a { color:#6cb6ff; } }'
+        '</style></head><body>'
+        f'{nav}<h1 style="font-size:22px;">{title}</h1>{body}'
+        f'<p class="pl-hours">{ICS_VENUE} · mis à jour le '
+        f'{datetime.datetime.now().strftime("%d/%m/%Y %H:%M")}</p></body></html>'
+    )
+
+
+def mask_absences(schedule):
+    """Copie du planning où chaque absence (ABSENCE_TYPES) devient un 'absent' sans motif.
+
+    Pour ce qui est partagé avec toute l'équipe : le motif (maladie…) ne
+    regarde que l'employé et le manager.
+    """
+    return {name: [dict(entry, type='absent') if entry and entry['type'] in ABSENCE_TYPES else entry
+                   for entry in days]
+            for name, days in schedule.items()}
+
+
+def week_fingerprint(schedule, weekly_hours, staff_list):
+    """Empreinte du contenu publié d'une semaine (planning, heures, staff, CSS, versions)."""
+    content = json.dumps(
+        [APP_VERSION, PORTAL_FORMAT, _static_hash('planning.css'),
+         [(emp.name, emp.role, emp.contract_hours, schedule.get(emp.name), weekly_hours.get(emp.name))
+          for emp in staff_list]],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def publish_portal(horizon, staff_list=None, out_dir=PORTAL_DIR, exceptions=None):
+    """Publie un horizon (generate_horizon) en pages statiques, semaine par semaine.
+
+    Une page équipe `<lundi>.html` (absences sans motif, mask_absences) et
+    une page par employé `<employé>/<lundi>.html` par semaine, un .ics par employé et des index.
+    Une semaine dont l'empreinte (week_fingerprint) n'a pas changé depuis
+    la dernière publication n'est pas réécrite ; les index et .ics ne le
+    sont que si au moins une semaine a changé. Retourne les chemins écrits,
+    relatifs à `out_dir`. `exceptions` : horaires exceptionnels de l'horizon
+    (couverture).
+    """
+    staff_list = staff_list or STAFF
+    openings = horizon_openings(exceptions, horizon[0][0], len(horizon)) if horizon else []
+    manifest_path = os.path.join(out_dir, PORTAL_MANIFEST)
+    manifest = {'weeks': {}, 'employees': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    written = []
+    for (monday, week_type, schedule, weekly_hours), opening in zip(horizon, openings):
+        key = monday.isoformat()
+        fingerprint = week_fingerprint(schedule, weekly_hours, staff_list)
+        if manifest['weeks'].get(key) == fingerprint:
+            continue
+        label = f"Semaine du {monday.strftime('%d/%m/%Y')}"
+        _write_atomic(os.path.join(out_dir, f"{key}.html"), _portal_page(
+            label, build_schedule_html(mask_absences(schedule), weekly_hours, staff_list, with_css=False)
+            + '<h2 style="font-size:16px;">Couverture</h2>' + build_coverage_html(schedule, staff_list, opening),
+            back='index.html',
+        ))
+        written.append(f"{key}.html")
+        _write_atomic(os.path.join(out_dir, PORTAL_DATA, f"{key}.json"), json.dumps(
+            {'week_type': week_type, 'schedule': mask_absences(schedule), 'weekly_hours': weekly_hours},
+            sort_keys=True,
+        ))
+        written.append(f"{PORTAL_DATA}/{key}.json")
+        for emp in staff_list:
+            slug = _slug(emp.name)
+            _write_atomic(os.path.join(out_dir, slug, f"{key}.html"), _portal_page(
+                f"{emp.name.split()[0]} — {label}",
+                build_schedule_html(schedule, weekly_hours, [emp], with_css=False),
+                back='index.html',
+            ))
+            written.append(f"{slug}/{key}.html")
+            manifest['employees'][slug] = emp.name
+        manifest['weeks'][key] = fingerprint
+
+    if written:
+        for emp in staff_list:
+            slug = _slug(emp.name)
+            _write_atomic(os.path.join(out_dir, slug, "planning.ics"), export_ics(horizon, emp.name))
+            written.append(f"{slug}/planning.ics")
+        weeks = sorted(manifest['weeks'])
+        for slug, name in manifest['employees'].items():
+            links = ''.join(
+                f'<li><a href="{w}.html">Semaine du {datetime.date.fromisoformat(w).strftime("%d/%m/%Y")}</a></li>'
+                for w in weeks if os.path.exists(os.path.join(out_dir, slug, f"{w}.html"))
+            )
+            _write_atomic(os.path.join(out_dir, slug, "index.html"), _portal_page(
+                f"Planning de {name.split()[0]}",
+                f'<ul>{links}</ul><p><a href="planning.ics">Ajouter à mon agenda (.ics)</a></p>',
+                back='../index.html',
+            ))
+            written.append(f"{slug}/index.html")
+        week_links = ''.join(
+            f'<li><a href="{w}.html">Semaine du {datetime.date.fromisoformat(w).strftime("%d/%m/%Y")}</a></li>'
+            for w in weeks
+        )
+        emp_links = ''.join(
+            f'<li><a href="{slug}/index.html">{name}</a></li>'
+            for slug, name in sorted(manifest['employees'].items(), key=lambda kv: kv[1])
+        )
+        _write_atomic(os.path.join(out_dir, "index.html"), _portal_page(
+            "Planning staff",
+            f'<h2 style="font-size:16px;">Équipe</h2><ul>{week_links}</ul>'
+            f'<h2 style="font-size:16px;">Par personne</h2><ul>{emp_links}</ul>',
+        ))
+        written.append("index.html")
+        _write_atomic(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+    return written
+
+
+def published_week(monday, out_dir=PORTAL_DIR):
+    """Semaine publiée du lundi `monday` : {'week_type', 'schedule', 'weekly_hours'} ou None.
+
+    Les absences y sont sans motif ('absent', cf. mask_absences).
+    """
+    path = os.path.join(out_dir, PORTAL_DATA, f"{monday.isoformat()}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def warm_start_source(monday, out_dir=PORTAL_DIR):
+    """Planning publié servant de départ à la semaine `monday` : (libellé, planning) ou None.
+
+    Par ordre de préférence : la semaine elle-même (re-planification), la
+    même semaine du cycle précédent, puis la semaine calendaire précédente.
+    """
+    for label, weeks_back in (("la semaine publiée", 0), ("le cycle précédent", len(ROTATION)),
+                              ("la semaine précédente", 1)):
+        source_monday = monday - datetime.timedelta(weeks=weeks_back)
+        published = published_week(source_monday, out_dir)
+        if published:
+            return f"{label} (du {source_monday.strftime('%d/%m/%Y')})", published['schedule']
+    return None
+
+
+def portal_zip(out_dir=PORTAL_DIR):
+    """Archive zip du portail publié (pour un hébergement statique externe)."""
+    import io
+    import zipfile
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for root, _, files in os.walk(out_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                zf.write(path, os.path.relpath(path, out_dir))
+    return buffer.getvalue()
+
+
+# ── Sauvegarde / restauration de l'état du planning ─────────────────────
+
+PLAN_STATE_VERSION = 1
+
+# Clés de session sauvegardées telles quelles (widgets à clé et compteurs)
+PLAN_STATE_KEYS = ('week_num', 'meeting_week', 'breaks', 'vacation_choice', 'theme',
+                   'extra_name', 'extra_hours', 'override_counter', 'absence_counter', 'extra_pool',
+                   'lessons', 'labor_profiles', 'warm_start')
+
+# Lignes de session dont les dates sont sauvegardées en ISO
+PLAN_STATE_DATED = {'absences': ('start', 'end'), 'opening_exceptions': ('start', 'end')}
+
+# Type attendu de chaque clé d'un état décodé (validate_state)
+PLAN_STATE_TYPES = {
+    'week_num': int, 'meeting_week': bool, 'breaks': bool, 'warm_start': bool, 'vacation_choice': str,
+    'theme': str, 'extra_name': str, 'extra_hours': (int, float), 'override_counter': int,
+    'absence_counter': int, 'extra_pool': list, 'lessons': list, 'labor_profiles': dict,
+    'week_monday': str, 'extra_days': list, 'off_days': dict, 'week_overrides': dict,
+    'absences': list, 'opening_exceptions': list, 'rotation': dict,
+}
+PLAN_STATE_MAX_BYTES = 1 << 20  # JSON décompressé ; au-delà, jeton refusé (bombe zlib)
+
+
+def snapshot_state(session):
+    """État complet du planning (session Streamlit ou dict) en structure JSON.
+
+    Dates en ISO, jours en indices ; seuls les jours d'absence non vides
+    et les clés présentes dans la session sont conservés.
+    """
+    state = {'v': PLAN_STATE_VERSION}
+    for key in PLAN_STATE_KEYS:
+        if key in session:
+            state[key] = session[key]
+    if 'week_monday' in session:
+        state['week_monday'] = session['week_monday'].isoformat()
+    state['extra_days'] = [JOURS.index(j) for j in session.get('extra_days', [])]
+    state['off_days'] = {
+        emp.name: [JOURS.index(j) for j in session[f"abs_{emp.name}"]]
+        for emp in STAFF
+        if session.get(f"abs_{emp.name}")
     }
-    .stDownloadButton > button:hover { background: #e0e0e0 !important; }
-
-    /* Expanders */
-    .streamlit-expanderHeader {
-        background: rgba(255,255,255,0.03) !important;
-        border: 1px solid rgba(255,255,255,0.08) !important;
-        border-radius: 6px !important;
-        color: rgba(255,255,255,0.6) !important;
-        font-family: 'Space Grotesk', sans-serif !important;
-        font-size: 12px !important;
-        letter-spacing: 1px !important;
+    state['week_overrides'] = {
+        str(w): [dict(ov) for ov in ovs]
+        for w, ovs in session.get('week_overrides', {}).items()
+        if ovs
     }
-    .streamlit-expanderContent {
-        background: rgba(255,255,255,0.02) !important;
-        border: 1px solid rgba(255,255,255,0.06) !important;
-        border-top: none !important;
-        border-radius: 0 0 6px 6px !important;
+    for key, fields in PLAN_STATE_DATED.items():
+        state[key] = [
+            dict(row, **{f: row[f].isoformat() if row.get(f) else None for f in fields})
+            for row in session.get(key, [])
+        ]
+    if session.get('rotation'):
+        state['rotation'] = {
+            'rotation': {str(w): {name: sorted(days) for name, days in off.items()}
+                         for w, off in session['rotation']['rotation'].items()},
+            'sunday': {str(w): name for w, name in session['rotation']['sunday'].items()},
+        }
+    return state
+
+
+def encode_state(state):
+    """JSON compact → zlib → base64 URL-safe sans padding (utilisable en paramètre d'URL)."""
+    raw = json.dumps(state, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+    return base64.urlsafe_b64encode(zlib.compress(raw.encode('utf-8'), 9)).rstrip(b'=').decode('ascii')
+
+
+def decode_state(token):
+    """Inverse de encode_state. Lève ValueError si le jeton est illisible ou mal formé.
+
+    La décompression s'arrête à PLAN_STATE_MAX_BYTES ; l'état est ensuite
+    vérifié par validate_state.
+    """
+    try:
+        packed = base64.urlsafe_b64decode(token.strip() + '=' * (-len(token.strip()) % 4))
+        inflater = zlib.decompressobj()
+        raw = inflater.decompress(packed, PLAN_STATE_MAX_BYTES)
+        if inflater.unconsumed_tail:
+            raise ValueError(f"plus de {PLAN_STATE_MAX_BYTES // 1024} Kio une fois décompressée")
+        if not inflater.eof:
+            raise ValueError("données tronquées")
+        state = json.loads(raw.decode('utf-8'))
+    except (ValueError, zlib.error) as exc:
+        raise ValueError(f"Sauvegarde de planning illisible : {exc}") from None
+    if not isinstance(state, dict) or state.get('v') != PLAN_STATE_VERSION:
+        raise ValueError("Version de sauvegarde de planning non supportée")
+    validate_state(state)
+    return state
+
+
+def _is_day(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < 7
+
+
+def _is_iso_date(value):
+    try:
+        datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def validate_state(state):
+    """Vérifie la forme d'un état décodé avant restore_state. Lève ValueError.
+
+    Types des clés (PLAN_STATE_TYPES), jours en indices 0-6, lignes de
+    modifications et d'absences complètes, dates ISO.
+    """
+    def require(ok, key):
+        if not ok:
+            raise ValueError(f"Sauvegarde de planning invalide : champ « {key} »")
+
+    for key, kind in PLAN_STATE_TYPES.items():
+        require(key not in state or isinstance(state[key], kind), key)
+    require(state.get('week_num', 1) in ROTATION, 'week_num')
+    require('week_monday' not in state or _is_iso_date(state['week_monday']), 'week_monday')
+    require(all(_is_day(d) for d in state.get('extra_days', [])), 'extra_days')
+    require(all(isinstance(days, list) and all(_is_day(d) for d in days)
+                for days in state.get('off_days', {}).values()), 'off_days')
+    require(all(isinstance(text, str) for text in state.get('lessons', [])), 'lessons')
+    require(all(isinstance(row, dict) for row in state.get('extra_pool', [])), 'extra_pool')
+    for w, ovs in state.get('week_overrides', {}).items():
+        require(w.isdigit() and int(w) in ROTATION and isinstance(ovs, list), 'week_overrides')
+        require(all(isinstance(ov, dict) and isinstance(ov.get('id'), int) and _is_day(ov.get('day'))
+                    and all(isinstance(ov.get(f), str) for f in ('employee', 'type', 'start', 'end'))
+                    for ov in ovs), 'week_overrides')
+    for key, fields in PLAN_STATE_DATED.items():
+        require(all(isinstance(row, dict) and all(row.get(f) is None or _is_iso_date(row[f]) for f in fields)
+                    for row in state.get(key, [])), key)
+    require(all(isinstance(row.get('id'), int) and isinstance(row.get('employee'), str)
+                and row.get('kind') in ABSENCE_TYPES for row in state.get('absences', [])), 'absences')
+    if 'rotation' in state:
+        off, sunday = state['rotation'].get('rotation'), state['rotation'].get('sunday')
+        require(isinstance(off, dict) and isinstance(sunday, dict)
+                and set(off) == set(sunday) == {str(w) for w in ROTATION}, 'rotation')
+        require(all(isinstance(days, dict) and all(isinstance(d, list) and all(_is_day(x) for x in d)
+                                                    for d in days.values()) for days in off.values())
+                and all(isinstance(name, str) for name in sunday.values()), 'rotation')
+
+
+def restore_state(session, state):
+    """Réécrit la session à partir d'un état décodé (avant la création des widgets).
+
+    Les clés des lignes de formulaire (ov_*, del_*) et des éditeurs de
+    tableaux sont purgées pour que les widgets reprennent les valeurs
+    restaurées.
+    """
+    purged = ('ov_', 'del_ov_', 'del_abs_', 'abs_', 'lesson_', 'labor_profile_', 'extra_pool_editor',
+              'opening_editor')
+    for key in [k for k in session.keys() if k.startswith(purged)]:
+        del session[key]
+    for key in PLAN_STATE_KEYS:
+        if key in state:
+            session[key] = state[key]
+    if 'labor_profiles' in state:
+        # Profil inconnu (sauvegarde modifiée ou profil retiré) : profil par défaut de l'employé
+        session['labor_profiles'] = {name: key for name, key in dict(state['labor_profiles']).items()
+                                     if key in LABOR_PROFILES}
+    if 'week_monday' in state:
+        session['week_monday'] = datetime.date.fromisoformat(state['week_monday'])
+    session['extra_days'] = [JOURS[d] for d in state.get('extra_days', [])]
+    for name, days in state.get('off_days', {}).items():
+        session[f"abs_{name}"] = [JOURS[d] for d in days]
+    overrides = {1: [], 2: [], 3: []}
+    for w, ovs in state.get('week_overrides', {}).items():
+        overrides[int(w)] = ovs
+    session['week_overrides'] = overrides
+    for key, fields in PLAN_STATE_DATED.items():
+        session[key] = [
+            dict(row, **{f: datetime.date.fromisoformat(row[f]) if row.get(f) else None for f in fields})
+            for row in state.get(key, [])
+        ]
+    session['rotation'] = {
+        'rotation': {int(w): {name: set(days) for name, days in off.items()}
+                     for w, off in state['rotation']['rotation'].items()},
+        'sunday': {int(w): name for w, name in state['rotation']['sunday'].items()},
+    } if 'rotation' in state else None
+
+
+# ── Interface Streamlit ────────────────────────────────────────────────────
+
+def _birdieland_css():
+    return stylesheets("fonts.css", "birdieland.css")
+
+
+def off_days_from_state(session, vacation_choice=None):
+    """Absences par jour saisies (clés abs_<nom>) → {nom: {jours}}."""
+    return {
+        emp.name: {JOURS.index(j) for j in session[f"abs_{emp.name}"]}
+        for emp in STAFF
+        if emp.name != vacation_choice and session.get(f"abs_{emp.name}")
     }
 
-    /* Alertes */
-    .stAlert { border-radius: 6px !important; }
-    .stInfo { background: rgba(255,255,255,0.05) !important; border-left-color: rgba(255,255,255,0.3) !important; }
-    .stWarning { background: rgba(255,200,50,0.08) !important; }
-    .stSuccess { background: rgba(46,204,113,0.08) !important; }
-    .stError { background: rgba(231,76,60,0.1) !important; }
 
-    /* Dataframe */
-    .stDataFrame { border: 1px solid rgba(255,255,255,0.08) !important; border-radius: 6px !important; }
+def extras_from_state(session):
+    """Extra saisi (clés extra_*) → [Employee], vide tant que nom ou jours manquent."""
+    name, days = session.get('extra_name'), session.get('extra_days')
+    if not (name and days):
+        return []
+    return [Employee(name, "Extra", session.get('extra_hours', 7.0) * len(days), {JOURS.index(j) for j in days})]
+
+
+def overrides_from_state(session, week_num):
+    """Modifications manuelles de la semaine du cycle, sans leurs identifiants."""
+    return [
+        {k: ov[k] for k in ('employee', 'day', 'type', 'start', 'end')}
+        for ov in session.get('week_overrides', {}).get(week_num, [])
+    ]
+
+
+def week_ledger(week_monday, week_num, extras, absences, breaks, exceptions=None, vacation=None,
+                custom_off_days=None, rotation=None):
+    """Compteur d'heures de l'année de la semaine affichée, conservé en session."""
+    ledger_start, ledger_weeks = year_horizon(week_monday.year)
+    ledger_type = cycle_week_type(ledger_start, week_monday, week_num)
+    ledger_key = (ledger_start, ledger_type, repr(st.session_state.absences), repr(extras), breaks,
+                  repr(st.session_state.get('opening_exceptions', [])), vacation,
+                  repr(sorted((name, sorted(days)) for name, days in (custom_off_days or {}).items())),
+                  _freeze(rotation))
+    if st.session_state.get('ledger_key') != ledger_key:
+        st.session_state.ledger = HourLedger(
+            ledger_start, ledger_type, ledger_weeks, extras=extras, absences=absences, breaks=breaks,
+            exceptions=exceptions, rotation=rotation,
+        )
+        if st.session_state.get('timesheet') is not None:
+            st.session_state.ledger.record_timesheet(st.session_state.timesheet['shifts'])
+        st.session_state.ledger_key = ledger_key
+    ledger = st.session_state.ledger
+    return ledger, ledger.week_of(week_monday)
+
+
+def fairness_table(week_monday, week_num, extras, absences, breaks, exceptions, staff_list, rotation=None):
+    """Statistiques d'équité sur 52 semaines, recalculées seulement quand leurs entrées changent."""
+    key = (week_monday, week_num, repr(extras), repr(st.session_state.absences), breaks,
+           repr(st.session_state.get('opening_exceptions', [])), repr(staff_list), _freeze(rotation))
+    if st.session_state.get('fairness_key') != key:
+        horizon = generate_horizon(week_monday, 52, week_num, extras=extras, absences=absences, breaks=breaks,
+                                   exceptions=exceptions, rotation=rotation)
+        st.session_state.fairness = fairness_stats(horizon, staff_list)
+        st.session_state.fairness_key = key
+    return st.session_state.fairness
+
+
+def export_horizon(start_date, num_weeks, first_week, extras, vacation, absences, breaks, exceptions, staff_list,
+                   rotation=None):
+    """Horizon des exports (modifications manuelles comprises), conservé en session.
+
+    Retourne {'key', 'horizon', 'snapshot'} ; l'horizon n'est regénéré que
+    si ses entrées changent et le snapshot Parquet est écrit une fois par
+    horizon, à la première demande.
+    """
+    key = (start_date, num_weeks, first_week, vacation, repr(extras), repr(st.session_state.absences), breaks,
+           repr(st.session_state.get('opening_exceptions', [])), repr(st.session_state.get('week_overrides', {})),
+           repr(staff_list), _freeze(rotation))
+    export = st.session_state.get('export')
+    if export is None or export['key'] != key:
+        horizon = generate_horizon(start_date, num_weeks, first_week, extras=extras,
+                                   vacation=vacation, absences=absences, breaks=breaks, exceptions=exceptions,
+                                   overrides={w: overrides_from_state(st.session_state, w) for w in ROTATION},
+                                   staff_list=staff_list, rotation=rotation)
+        export = {'key': key, 'horizon': horizon, 'snapshot': None}
+        st.session_state.export = export
+    return export
+
+
+def demand_model(history):
+    """Modèle de demande de la session, complété avec les jours nouveaux de `history`."""
+    if st.session_state.get('demand_model') is None:
+        st.session_state.demand_model = DemandModel()
+    model = st.session_state.demand_model
+    model.update(history)
+    return model
+
+
+def displayed_week(week_num, week_monday, meeting_week, vacation, custom_off_days, extras, absences, breaks,
+                   overrides, staff_list, ledger, ledger_week, opening=None, previous=None, rotation=None):
+    """Planning affiché : génération (cibles du compteur), modifications manuelles, pauses.
+
+    Avec `previous` (planning publié), la génération repart de ses shifts (warm_start).
+    """
+    params = dict(
+        extras=extras, meeting_week=meeting_week, vacation=vacation, custom_off_days=custom_off_days or None,
+        absences=absences, monday=week_monday,
+        targets=ledger.targets(ledger_week) if ledger_week is not None else None, breaks=breaks, opening=opening,
+        rotation=rotation,
+    )
+    if previous is not None:
+        schedule, weekly_hours, _ = warm_start(previous, week_num, **params)
+    else:
+        schedule, weekly_hours = generate_week_cached(week_num, **params)
+    if overrides:
+        schedule, weekly_hours = apply_manual_overrides(schedule, weekly_hours, overrides)
+        if breaks:
+            schedule, weekly_hours = place_breaks(schedule, weekly_hours, staff_list, opening=opening)
+    if ledger_week is not None:
+        if ledger.overrides.get(ledger_week, []) != overrides:
+            ledger.set_overrides(ledger_week, overrides)
+        ledger.record_week(ledger_week, weekly_hours)
+    return schedule, weekly_hours
+
+
+def staff_view():
+    """Vue lecture seule (rôle staff) : le planning publié, sans éditeurs ni aides à la décision.
 
-    /* Divider */
-    hr { border-color: rgba(255,255,255,0.08) !important; }
-    </style>
+    Les paramètres (absences, extra, modifications) viennent de l'état
+    restauré depuis le lien ?plan= partagé par un manager.
     """
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        week_num = st.selectbox("Semaine du cycle", [1, 2, 3], format_func=lambda w: f"Semaine {w}/3",
+                                key="week_num")
+    with col2:
+        week_monday = monday_of(st.date_input("Semaine du", key="week_monday"))
+
+    vacation_choice = st.session_state.get('vacation_choice', "Aucun")
+    vacation = vacation_choice if vacation_choice != "Aucun" else None
+    meeting_week = st.session_state.get('meeting_week', False)
+    breaks = st.session_state.breaks
+    custom_off_days = off_days_from_state(st.session_state, vacation_choice)
+    extras = extras_from_state(st.session_state)
+    absences = AbsenceCalendar.from_records(st.session_state.absences)
+    exceptions, _ = opening_exceptions(st.session_state.get('opening_exceptions', []))
+    opening = exceptions.week_opening(week_monday)
+    rotation = st.session_state.get('rotation')
+    all_staff = [emp for emp in STAFF if emp.name != vacation_choice] + extras
+
+    ledger, ledger_week = week_ledger(week_monday, week_num, extras, absences, breaks, exceptions,
+                                     vacation, custom_off_days, rotation)
+    schedule, weekly_hours = displayed_week(
+        week_num, week_monday, meeting_week, vacation, custom_off_days, extras, absences, breaks,
+        overrides_from_state(st.session_state, week_num), all_staff, ledger, ledger_week, opening,
+        rotation=rotation,
+    )
+
+    opening_labels = exceptions.week_labels(week_monday)
+    if opening_labels:
+        st.info("Horaires exceptionnels : " + " | ".join(
+            f"**{JOURS[d]}** : {text}" for d, text in sorted(opening_labels.items())
+        ))
+    st.subheader("Planning de la semaine")
+    st.markdown(build_schedule_html(schedule, weekly_hours, all_staff), unsafe_allow_html=True)
+    st.subheader("Couverture journalière")
+    st.markdown(build_coverage_html(schedule, all_staff, opening), unsafe_allow_html=True)
+
+    names = [emp.name for emp in all_staff]
+    own = _users().get(st.session_state.get("user"), {}).get('employee')
+    ics_emp = st.selectbox("Mon calendrier", names, index=names.index(own) if own in names else 0)
+    horizon = [(week_monday, week_num, schedule, weekly_hours)]
+    st.download_button(
+        "Télécharger le .ics de la semaine",
+        data=export_ics(horizon, ics_emp),
+        file_name=f"planning_{ics_emp.split()[0].lower()}_{week_monday.strftime('%Y%m%d')}.ics",
+        mime="text/calendar",
+    )
+
+
+def users_panel():
+    """Gestion des comptes (manager) : création, changement de rôle ou de mot de passe, suppression."""
+    users = dict(_users())
+    st.caption(
+        "Mots de passe stockés salés (PBKDF2) dans .streamlit/users.json. "
+        "Le rôle staff ne voit que le planning, en lecture seule."
+    )
+    for login, rec in sorted(users.items()):
+        st.markdown(f"**{login}** — {ROLES.get(rec['role'], rec['role'])}"
+                    + (f" · {rec['employee']}" if rec.get('employee') else ''))
+    with st.form("users_form", border=False):
+        uc1, uc2, uc3, uc4 = st.columns([2, 2, 1, 2])
+        with uc1:
+            login = st.text_input("Identifiant", key="user_login")
+        with uc2:
+            password = st.text_input("Mot de passe", type="password", key="user_password",
+                                     help="Laisser vide pour conserver le mot de passe actuel.")
+        with uc3:
+            role = st.selectbox("Rôle", list(ROLES), format_func=ROLES.get, key="user_role")
+        with uc4:
+            employee = st.selectbox("Employé", [''] + [emp.name for emp in STAFF], key="user_employee")
+        bc1, bc2 = st.columns(2)
+        with bc1:
+            save = st.form_submit_button("Enregistrer le compte")
+        with bc2:
+            delete = st.form_submit_button("Supprimer le compte")
+    login = login.strip()
+    if save:
+        if not login or '|' in login:
+            st.error("Identifiant invalide.")
+        elif login not in users and not password:
+            st.error("Mot de passe requis pour un nouveau compte.")
+        else:
+            save_users(set_user(users, login, password, role, employee))
+            st.rerun()
+    if delete and login in users:
+        if login == st.session_state.get("user"):
+            st.error("Impossible de supprimer le compte connecté.")
+        else:
+            del users[login]
+            save_users(users)
+            st.rerun()
+
+
+def _footer():
+    st.markdown("<br><br>", unsafe_allow_html=True)
+    st.markdown(
+        '<hr style="border-color:rgba(255,255,255,0.06); margin-bottom:16px;">',
+        unsafe_allow_html=True,
+    )
+    fc1, fc2, fc3, fc4 = st.columns([3, 1, 1, 1])
+    with fc2:
+        st.caption(f"v{APP_VERSION} · {st.session_state.get('user', '')}")
+    with fc3:
+        label = "☀ Mode clair" if st.session_state.theme == 'birdieland' else "◑ Mode Birdieland"
+        if st.button(label, key="theme_toggle"):
+            st.session_state.theme = 'white' if st.session_state.theme == 'birdieland' else 'birdieland'
+            st.rerun()
+    with fc4:
+        if st.button("Déconnexion", key="logout"):
+            logout()
+            st.rerun()
 
 
 def main():
     if not check_auth():
         return
 
+    import pandas as pd
+
+    # Restauration d'un planning sauvegardé (fichier importé ou lien ?plan=)
+    plan_token = st.session_state.pop('pending_plan', None) or st.query_params.get("plan")
+    if plan_token and plan_token != st.session_state.get('plan_token'):
+        try:
+            restore_state(st.session_state, decode_state(plan_token))
+        except ValueError as exc:
+            st.error(str(exc))
+        except (KeyError, TypeError) as exc:
+            st.error(f"Sauvegarde de planning illisible : {exc!r}")
+        st.session_state.plan_token = plan_token
+
     if 'theme' not in st.session_state:
         st.session_state.theme = 'birdieland'
+    if 'week_monday' not in st.session_state:
+        st.session_state.week_monday = next_monday()
+    if 'breaks' not in st.session_state:
+        st.session_state.breaks = True
+    if 'warm_start' not in st.session_state:
+        st.session_state.warm_start = False
+    if 'extra_hours' not in st.session_state:
+        st.session_state.extra_hours = 7.0
+    if 'absences' not in st.session_state:
+        st.session_state.absences = []
+    if 'absence_counter' not in st.session_state:
+        st.session_state.absence_counter = 0
+    if 'week_overrides' not in st.session_state:
+        st.session_state.week_overrides = {1: [], 2: [], 3: []}
+    if 'override_counter' not in st.session_state:
+        st.session_state.override_counter = 0
 
     if st.session_state.theme == 'birdieland':
         st.markdown(_birdieland_css(), unsafe_allow_html=True)
@@ -1027,23 +4609,46 @@ def main():
         "*(staff : +15min avant/après)*"
     )
 
+    # Rôle staff : lecture seule, aucun éditeur ni calcul d'aide à la décision
+    if st.session_state.get("role") != 'manager':
+        staff_view()
+        _footer()
+        return
+
     col1, col2, col3 = st.columns([1, 1, 2])
     with col1:
         week_num = st.selectbox(
             "Semaine du cycle",
             [1, 2, 3],
             format_func=lambda w: f"Semaine {w}/3",
+            key="week_num",
         )
+        week_monday = monday_of(st.date_input(
+            "Semaine du",
+            help="Date de la semaine affichée, pour appliquer le calendrier des absences.",
+            key="week_monday",
+        ))
     with col2:
         meeting_week = st.checkbox(
             "Réunion direction ce lundi",
-            value=False,
             help="Cocher si Baptiste a sa réunion direction ce lundi (1 lundi sur 2). Impacte uniquement la Semaine 3.",
+            key="meeting_week",
         )
         if meeting_week and week_num == 3:
             st.caption("Baptiste off Mar+Mer (travaille Lundi)")
         elif week_num == 3:
             st.caption("Baptiste off Lun+Mar")
+        breaks = st.checkbox(
+            "Pauses 20 min (> 6h)",
+            help="Place une pause non payée de 20 min dans chaque shift de 6h ou plus, en gardant la couverture.",
+            key="breaks",
+        )
+        use_published = st.checkbox(
+            "Partir du planning publié",
+            help="Reprend les shifts de la dernière publication (même semaine, cycle précédent ou semaine "
+                 "précédente) pour les jours dont les entrées n'ont pas changé : le planning reste stable.",
+            key="warm_start",
+        )
 
     # ── Vacances ──
     with col3:
@@ -1052,49 +4657,229 @@ def main():
             "Employé en vacances (semaine entière)",
             vacation_options,
             help="Sélectionner un employé absent toute la semaine.",
+            key="vacation_choice",
         )
 
     # ── Absences par jour ──
-    custom_off_days = {}
     with st.expander("Absences par jour (vacances partielles)"):
         st.caption("Ajouter des jours d'absence pour un ou plusieurs employés")
-        for emp in STAFF:
-            if emp.name == vacation_choice:
-                continue
-            abs_days = st.multiselect(
-                f"{emp.name.split()[0]}",
-                JOURS,
-                default=[],
-                key=f"abs_{emp.name}",
-            )
-            if abs_days:
-                jour_map = {j: i for i, j in enumerate(JOURS)}
-                custom_off_days[emp.name] = {jour_map[j] for j in abs_days}
+        # Formulaire : les sélections ne relancent le calcul qu'à la validation
+        with st.form("abs_days_form", border=False):
+            for emp in STAFF:
+                if emp.name == vacation_choice:
+                    continue
+                st.multiselect(
+                    f"{emp.name.split()[0]}",
+                    JOURS,
+                    key=f"abs_{emp.name}",
+                )
+            st.form_submit_button("Appliquer les absences")
+    custom_off_days = off_days_from_state(st.session_state, vacation_choice)
+    rotation = st.session_state.get('rotation')  # appliquée depuis la recherche, sinon ROTATION
+
+    # ── Calendrier des absences datées ──
+    with st.expander("Calendrier des absences (vacances, maladie, formation)"):
+        st.caption("Absences datées, appliquées au planning affiché et à l'export Connecteam")
+        with st.form("abs_calendar_form", border=False):
+            for rec in st.session_state.absences:
+                ac1, ac2 = st.columns([6, 1])
+                with ac1:
+                    st.markdown(
+                        f"**{rec['employee'].split()[0]}** — {ABSENCE_TYPES[rec['kind']]} "
+                        f"du {rec['start'].strftime('%d/%m/%Y')} au {rec['end'].strftime('%d/%m/%Y')}"
+                    )
+                with ac2:
+                    st.checkbox("Suppr.", key=f"del_abs_{rec['id']}", help="Supprimer à la validation")
+            if not st.session_state.absences:
+                st.caption("Aucune absence enregistrée.")
+
+            nc1, nc2, nc3 = st.columns([2, 1, 2])
+            with nc1:
+                new_abs_emp = st.selectbox("Employé", [emp.name for emp in STAFF], key="new_abs_emp")
+            with nc2:
+                new_abs_kind = st.selectbox("Type", list(ABSENCE_TYPES), format_func=ABSENCE_TYPES.get,
+                                            key="new_abs_kind")
+            with nc3:
+                new_abs_range = st.date_input("Du … au", value=(week_monday, week_monday), key="new_abs_range")
+            bc1, bc2 = st.columns(2)
+            with bc1:
+                add_abs = st.form_submit_button("+ Ajouter une absence")
+            with bc2:
+                apply_abs = st.form_submit_button("Appliquer les suppressions")
+
+        # Application groupée à la validation du formulaire
+        if add_abs or apply_abs:
+            st.session_state.absences = [
+                a for a in st.session_state.absences
+                if not st.session_state.get(f"del_abs_{a['id']}")
+            ]
+        if add_abs:
+            if len(new_abs_range) == 2:
+                st.session_state.absence_counter += 1
+                st.session_state.absences.append({
+                    'id': st.session_state.absence_counter,
+                    'employee': new_abs_emp,
+                    'kind': new_abs_kind,
+                    'start': new_abs_range[0],
+                    'end': new_abs_range[1],
+                })
+            else:
+                st.error("Sélectionner une date de début et une date de fin.")
+        if add_abs or apply_abs:
+            st.rerun()
+
+    absences = AbsenceCalendar.from_records(st.session_state.absences)
 
     # ── Extra ──
-    extras = []
     with st.expander("Ajouter un extra"):
-        ex_col1, ex_col2, ex_col3 = st.columns(3)
-        with ex_col1:
-            extra_name = st.text_input("Nom complet de l'extra")
-        with ex_col2:
-            extra_hours = st.number_input("Heures par jour", min_value=3.0, max_value=10.0, value=7.0, step=0.5)
-        with ex_col3:
-            jour_options = {j: i for i, j in enumerate(JOURS)}
-            extra_days = st.multiselect("Jours disponibles", JOURS, default=[])
-
-        if extra_name and extra_days:
-            day_set = {jour_options[j] for j in extra_days}
-            extras.append(Employee(
-                extra_name, "Extra",
-                extra_hours * len(extra_days),
-                day_set,
-            ))
-            st.success(f"Extra ajouté : **{extra_name}** — {', '.join(extra_days)} ({extra_hours}h/jour)")
+        with st.form("extra_form", border=False):
+            ex_col1, ex_col2, ex_col3 = st.columns(3)
+            with ex_col1:
+                st.text_input("Nom complet de l'extra", key="extra_name")
+            with ex_col2:
+                st.number_input("Heures par jour", min_value=3.0, max_value=10.0, step=0.5, key="extra_hours")
+            with ex_col3:
+                st.multiselect("Jours disponibles", JOURS, key="extra_days")
+            st.form_submit_button("Appliquer l'extra")
+
+        extras = extras_from_state(st.session_state)
+        if extras:
+            st.success(
+                f"Extra ajouté : **{extras[0].name}** — {', '.join(st.session_state.extra_days)} "
+                f"({st.session_state.extra_hours}h/jour)"
+            )
+
+    # ── Vivier d'extras (recommandation de renforts) ──
+    if 'extra_pool' not in st.session_state:
+        st.session_state.extra_pool = []
+    if 'opening_exceptions' not in st.session_state:
+        st.session_state.opening_exceptions = []
+    with st.expander("Vivier d'extras (renforts)"):
+        st.caption(
+            "Extras mobilisables : jours (ex. « Ven, Sam »), plage horaire (ex. « 17:00-23:15 », "
+            "vide = toute la journée) et taux horaire (0 = taux extra par défaut)."
+        )
+        with st.form("extra_pool_form", border=False):
+            pool_df = st.data_editor(
+                pd.DataFrame(st.session_state.extra_pool, columns=['name', 'rate', 'days', 'window']),
+                num_rows="dynamic",
+                column_config={
+                    'name': st.column_config.TextColumn("Nom"),
+                    'rate': st.column_config.NumberColumn("Taux (€/h)", min_value=0.0, step=0.5, default=0.0),
+                    'days': st.column_config.TextColumn("Jours"),
+                    'window': st.column_config.TextColumn("Plage"),
+                },
+                hide_index=True,
+                key="extra_pool_editor",
+            )
+            if st.form_submit_button("Enregistrer le vivier"):
+                st.session_state.extra_pool = [
+                    {k: (None if pd.isna(v) else v) for k, v in row.items()}
+                    for row in pool_df.to_dict('records')
+                ]
+                del st.session_state["extra_pool_editor"]
+                st.rerun()
+    candidates, pool_errors = extra_pool(st.session_state.extra_pool)
+    for err in pool_errors:
+        st.error(err)
+
+    # ── Horaires exceptionnels (événements, tournois, saisons) ──
+    with st.expander("Horaires exceptionnels (événements, saisons)"):
+        st.caption(
+            "Une date ou une plage avec ses propres horaires staff (ex. « 9:45 » - « 23:45 », "
+            "vides = fermé, fin avant minuit) et ses minimums : personnes pendant l'ouverture et à la fermeture."
+        )
+        with st.form("opening_form", border=False):
+            opening_df = st.data_editor(
+                pd.DataFrame(st.session_state.opening_exceptions,
+                             columns=['start', 'end', 'open', 'close', 'min_staff', 'min_closers', 'label']),
+                num_rows="dynamic",
+                column_config={
+                    'start': st.column_config.DateColumn("Du", format="DD/MM/YYYY"),
+                    'end': st.column_config.DateColumn("Au", format="DD/MM/YYYY"),
+                    'open': st.column_config.TextColumn("Début staff"),
+                    'close': st.column_config.TextColumn("Fin staff"),
+                    'min_staff': st.column_config.NumberColumn("Min. présents", min_value=0, step=1,
+                                                               default=MIN_STAFF),
+                    'min_closers': st.column_config.NumberColumn("Min. fermeture", min_value=0, step=1,
+                                                                 default=MIN_CLOSERS),
+                    'label': st.column_config.TextColumn("Événement"),
+                },
+                hide_index=True,
+                key="opening_editor",
+            )
+            if st.form_submit_button("Enregistrer les horaires"):
+                st.session_state.opening_exceptions = [
+                    {k: (None if pd.isna(v) else v.date() if isinstance(v, datetime.datetime) else v)
+                     for k, v in row.items()}
+                    for row in opening_df.to_dict('records')
+                ]
+                del st.session_state["opening_editor"]
+                st.rerun()
+    exceptions, opening_errors = opening_exceptions(st.session_state.opening_exceptions)
+    for err in opening_errors:
+        st.error(err)
+    opening = exceptions.week_opening(week_monday)
+
+    # ── Cours réservés (compétence coach requise) ──
+    if 'lessons' not in st.session_state:
+        st.session_state.lessons = [''] * 7
+    with st.expander("Cours réservés (coach requis)"):
+        st.caption(
+            "Plages de cours de la semaine type (ex. « 10:00-12:00, 18:00-20:00 ») : un coach doit "
+            "être présent sur chacune. Un manager ou un CDI senior doit aussi être présent à la fermeture."
+        )
+        with st.form("lessons_form", border=False):
+            lesson_cols = st.columns(7)
+            for d, col in enumerate(lesson_cols):
+                with col:
+                    st.text_input(JOURS_SHORT[d], value=st.session_state.lessons[d], key=f"lesson_{d}")
+            if st.form_submit_button("Enregistrer les cours"):
+                st.session_state.lessons = [st.session_state[f"lesson_{d}"].strip() for d in range(7)]
+                st.rerun()
+    try:
+        rules = skill_rules(dict(enumerate(st.session_state.lessons)))
+    except ValueError:
+        st.error("Plages de cours illisibles : format attendu « 10:00-12:00, 18:00-20:00 ».")
+        rules = skill_rules()
 
     # Filtrer le staff en vacances
     active_staff = [emp for emp in STAFF if emp.name != vacation_choice]
-    all_staff = list(active_staff) + extras
+    cycle_staff = list(active_staff) + extras
+    # Extras du vivier appelés par une modification de la semaine (réparation d'absence)
+    called = {ov['employee'] for ov in st.session_state.week_overrides[week_num]}
+    all_staff = cycle_staff + [emp for emp in candidates
+                               if emp.name in called and emp.name not in {e.name for e in cycle_staff}]
+
+    # ── Profils droit du travail (par employé) ──
+    if 'labor_profiles' not in st.session_state:
+        st.session_state.labor_profiles = {}
+    with st.expander("Profils droit du travail"):
+        st.caption(
+            "Règles appliquées à chaque employé : Code du travail (10h/jour, 48h/semaine, 11h de repos), "
+            "apprenti de moins de 18 ans (8h/jour, 35h/semaine, 12h de repos, pas de travail après 22h) "
+            "ou convention HCR (11h/jour, 2 jours de repos)."
+        )
+        profile_keys = list(LABOR_PROFILES)
+        with st.form("labor_profiles_form", border=False):
+            profile_cols = st.columns(min(len(all_staff), 4) or 1)
+            for i, emp in enumerate(all_staff):
+                with profile_cols[i % len(profile_cols)]:
+                    current = st.session_state.labor_profiles.get(emp.name, emp.labor_profile)
+                    st.selectbox(emp.name, profile_keys, index=profile_keys.index(current),
+                                 format_func=LABOR_PROFILE_LABELS.get, key=f"labor_profile_{emp.name}")
+            if st.form_submit_button("Enregistrer les profils"):
+                # Fusion : les absents de la semaine (vacances, extras retirés) gardent leur profil
+                profiles = dict(st.session_state.labor_profiles)
+                for emp in all_staff:
+                    choice = st.session_state[f"labor_profile_{emp.name}"]
+                    if choice != emp.labor_profile:
+                        profiles[emp.name] = choice
+                    else:
+                        profiles.pop(emp.name, None)
+                st.session_state.labor_profiles = profiles
+                st.rerun()
+    labor_profiles = st.session_state.labor_profiles
 
     if vacation_choice != "Aucun":
         st.warning(f"**{vacation_choice}** est en vacances cette semaine. Planning ajusté.")
@@ -1104,111 +4889,201 @@ def main():
             for n, ds in custom_off_days.items()
         )
         st.warning(f"Absences : {abs_text}")
+    dated_off = absences.week_off_days(week_monday)
+    if dated_off:
+        abs_text = " | ".join(
+            f"**{n.split()[0]}** : " + ', '.join(
+                f"{JOURS[d]} ({ABSENCE_TYPES[k].lower()})" for d, k in sorted(days.items())
+            )
+            for n, days in dated_off.items()
+        )
+        st.warning(f"Absences du {week_monday.strftime('%d/%m/%Y')} : {abs_text}")
 
     # Afficher les congés
-    off = get_off_days(week_num, meeting_week)
+    off = get_off_days(week_num, meeting_week, rotation)
     off_text = " | ".join(
         f"**{name.split()[0]}** : {', '.join(JOURS[d] for d in sorted(days))}"
         for name, days in off.items()
         if name != vacation_choice
     )
     st.info(f"Congés : {off_text}")
+    opening_labels = exceptions.week_labels(week_monday)
+    if opening_labels:
+        st.info("Horaires exceptionnels : " + " | ".join(
+            f"**{JOURS[d]}** : {text}" for d, text in sorted(opening_labels.items())
+        ))
 
-    # Générer
     vacation = vacation_choice if vacation_choice != "Aucun" else None
-    schedule, weekly_hours = generate_week(
-        week_num, extras=extras, meeting_week=meeting_week,
-        vacation=vacation, custom_off_days=custom_off_days or None,
-    )
 
     # ── Modifications manuelles de shifts ──
-    if 'week_overrides' not in st.session_state:
-        st.session_state.week_overrides = {1: [], 2: [], 3: []}
-    if 'override_counter' not in st.session_state:
-        st.session_state.override_counter = 0
 
     jour_map = {j: idx for idx, j in enumerate(JOURS)}
-    manual_overrides = []
-    to_delete = None
+    type_opts = ["matin", "soir", "journee", "conge"] + list(ABSENCE_TYPES)
 
     with st.expander(f"Modifier un shift — Semaine {week_num}/3"):
         st.caption(f"Modifications actives pour la semaine {week_num}/3")
         current_ovs = st.session_state.week_overrides[week_num]
-
+        emp_names = [e.name for e in all_staff]
+
+        # Formulaire : aucune saisie ne relance le calcul avant validation,
+        # puis toutes les lignes sont appliquées en une fois.
+        with st.form(f"ov_form_{week_num}", border=False):
+            for ov in current_ovs:
+                oid = ov['id']
+                oc1, oc2, oc3, oc4, oc5, oc6 = st.columns([2, 1, 1, 1, 1, 0.6])
+                with oc1:
+                    default_emp_idx = emp_names.index(ov['employee']) if ov['employee'] in emp_names else 0
+                    st.selectbox("Employé", emp_names, index=default_emp_idx, key=f"ov_emp_{oid}")
+                with oc2:
+                    st.selectbox("Jour", JOURS, index=ov['day'], key=f"ov_day_{oid}")
+                with oc3:
+                    default_type_idx = type_opts.index(ov['type']) if ov['type'] in type_opts else 0
+                    st.selectbox("Type", type_opts, index=default_type_idx, key=f"ov_type_{oid}")
+                with oc4:
+                    st.text_input("Début", value=ov['start'], key=f"ov_start_{oid}")
+                with oc5:
+                    st.text_input("Fin", value=ov['end'], key=f"ov_end_{oid}")
+                with oc6:
+                    st.markdown("<div style='margin-top:24px'></div>", unsafe_allow_html=True)
+                    st.checkbox("×", key=f"del_ov_{oid}", help="Supprimer à la validation")
+
+            if not current_ovs:
+                st.caption("Aucune modification pour cette semaine.")
+
+            fc1, fc2 = st.columns(2)
+            with fc1:
+                apply_ov = st.form_submit_button("Appliquer les modifications")
+            with fc2:
+                add_ov = st.form_submit_button("+ Ajouter une modification")
+
+    if apply_ov or add_ov:
+        edited = []
+        deleted = False
         for ov in current_ovs:
             oid = ov['id']
-            oc1, oc2, oc3, oc4, oc5, oc6 = st.columns([2, 1, 1, 1, 1, 0.4])
-            emp_names = [e.name for e in all_staff]
-            with oc1:
-                default_emp_idx = emp_names.index(ov['employee']) if ov['employee'] in emp_names else 0
-                ov_emp = st.selectbox("Employé", emp_names, index=default_emp_idx, key=f"ov_emp_{oid}")
-            with oc2:
-                ov_day = st.selectbox("Jour", JOURS, index=ov['day'], key=f"ov_day_{oid}")
-            with oc3:
-                type_opts = ["matin", "soir", "journee", "conge"]
-                default_type_idx = type_opts.index(ov['type']) if ov['type'] in type_opts else 0
-                ov_type = st.selectbox("Type", type_opts, index=default_type_idx, key=f"ov_type_{oid}")
-            with oc4:
-                ov_start = st.text_input("Début", value=ov['start'], key=f"ov_start_{oid}",
-                                         disabled=(ov_type == "conge"))
-            with oc5:
-                ov_end = st.text_input("Fin", value=ov['end'], key=f"ov_end_{oid}",
-                                       disabled=(ov_type == "conge"))
-            with oc6:
-                st.markdown("<div style='margin-top:24px'></div>", unsafe_allow_html=True)
-                if st.button("×", key=f"del_ov_{oid}", help="Supprimer cette modification"):
-                    to_delete = oid
-
-            manual_overrides.append({
-                'employee': ov_emp,
-                'day': jour_map[ov_day],
-                'type': ov_type,
-                'start': ov_start,
-                'end': ov_end,
-            })
-
-        if not current_ovs:
-            st.caption("Aucune modification pour cette semaine.")
-
-        if st.button("+ Ajouter une modification", key=f"add_ov_{week_num}"):
-            st.session_state.override_counter += 1
-            oid = st.session_state.override_counter
-            emp_default = all_staff[0].name if all_staff else ''
-            st.session_state.week_overrides[week_num].append({
+            if st.session_state.get(f"del_ov_{oid}"):
+                deleted = True
+                continue
+            row = {
                 'id': oid,
-                'employee': emp_default,
+                'employee': st.session_state[f"ov_emp_{oid}"],
+                'day': jour_map[st.session_state[f"ov_day_{oid}"]],
+                'type': st.session_state[f"ov_type_{oid}"],
+                'start': st.session_state[f"ov_start_{oid}"].strip(),
+                'end': st.session_state[f"ov_end_{oid}"].strip(),
+            }
+            if row['type'] != 'conge' and row['type'] not in ABSENCE_TYPES:
+                try:
+                    valid = parse_minutes(row['end']) > parse_minutes(row['start'])
+                except ValueError:
+                    valid = False
+                if not valid:
+                    st.error(f"{JOURS[row['day']]} — {row['employee']} : horaires invalides "
+                             f"({row['start']} - {row['end']}), modification ignorée.")
+                    row = ov
+            edited.append(row)
+        if add_ov:
+            st.session_state.override_counter += 1
+            edited.append({
+                'id': st.session_state.override_counter,
+                'employee': all_staff[0].name if all_staff else '',
                 'day': 0,
                 'type': 'matin',
                 'start': '9:45',
                 'end': '18:15',
             })
+        st.session_state.week_overrides[week_num] = edited
+        if add_ov or deleted:
             st.rerun()
 
-    if to_delete is not None:
-        st.session_state.week_overrides[week_num] = [
-            o for o in st.session_state.week_overrides[week_num] if o['id'] != to_delete
-        ]
-        st.rerun()
-
-    # Appliquer les modifications manuelles
-    if manual_overrides:
-        schedule, weekly_hours = apply_manual_overrides(schedule, weekly_hours, manual_overrides)
+    # Générer (compteur d'heures de l'année, puis modifications manuelles)
+    manual_overrides = overrides_from_state(st.session_state, week_num)
+    ledger, ledger_week = week_ledger(week_monday, week_num, extras, absences, breaks, exceptions,
+                                     vacation, custom_off_days, rotation)
+    source = warm_start_source(week_monday) if use_published else None
+    schedule, weekly_hours = displayed_week(
+        week_num, week_monday, meeting_week, vacation, custom_off_days, extras, absences, breaks,
+        manual_overrides, all_staff, ledger, ledger_week, opening, previous=source[1] if source else None,
+        rotation=rotation,
+    )
 
-    warnings, staffing_issues = check_labor_law(schedule, weekly_hours, all_staff)
+    warnings, staffing_issues = check_labor_law(schedule, weekly_hours, all_staff, opening, labor_profiles)
+    # Arguments de generate_week de la semaine affichée (diagnostic, scénarios)
+    week_params = dict(
+        week_num=week_num, extras=extras, meeting_week=meeting_week, vacation=vacation,
+        custom_off_days=custom_off_days or None, absences=absences, monday=week_monday,
+        targets=ledger.targets(ledger_week) if ledger_week is not None else None, breaks=breaks,
+        opening=opening, rotation=rotation,
+    )
+    skill_issues = check_skills(schedule, all_staff, rules, opening)
 
     # ── Grille planning ──
     st.subheader("Planning de la semaine")
+    if use_published:
+        if source:
+            kept = sum(all((source[1].get(emp.name) or [None] * 7)[d] == schedule[emp.name][d] for emp in all_staff)
+                       for d in range(7))
+            st.caption(f"Repris de {source[0]} : {kept}/7 jour(s) inchangé(s).")
+        else:
+            st.caption("Aucun planning publié pour cette semaine, le cycle précédent ou la semaine précédente.")
     html = build_schedule_html(schedule, weekly_hours, all_staff)
     st.markdown(html, unsafe_allow_html=True)
 
     # ── Couverture journalière ──
     st.subheader("Couverture journalière")
-    coverage_html = build_coverage_html(schedule, all_staff)
+    history = st.session_state.get('demand_history')
+    model = demand_model(history) if history else None
+    demand = week_demand(model, week_monday, opening) if model else None
+    coverage_html = build_coverage_html(schedule, all_staff, opening, demand)
     st.markdown(coverage_html, unsafe_allow_html=True)
+    if demand is not None:
+        st.caption(f"Présents / effectif prévu (1 personne pour {GUESTS_PER_STAFF} clients, d'après les réservations).")
+
+    with st.expander("Prévision de la demande (réservations)"):
+        st.caption(
+            "Historique de réservations (CSV : date, début, fin ou durée, joueurs). Lissage exponentiel "
+            "par quart d'heure (niveau, tendance, saison hebdo), mis à jour avec les nouveaux jours."
+        )
+        bookings_file = st.file_uploader("Réservations (CSV)", type=["csv"], key="demand_upload")
+        if bookings_file is not None and bookings_file.file_id != st.session_state.get('demand_upload_id'):
+            st.session_state.demand_upload_id = bookings_file.file_id
+            try:
+                st.session_state.demand_history = booking_history(bookings_file, history=history)
+            except (ValueError, UnicodeDecodeError) as exc:
+                st.error(f"Export de réservations illisible : {exc}")
+            else:
+                st.rerun()
+        if model is not None and not model.ready:
+            st.info(f"{len(model.dates)} jour(s) d'historique : il en faut au moins {DEMAND_MIN_DAYS}.")
+        elif model is not None:
+            best = model.best
+            st.caption(
+                f"{len(model.dates)} jours appris (jusqu'au {model.dates[-1].strftime('%d/%m/%Y')}). "
+                f"Lissage niveau {model.alpha[best, 0]:g}, saison {model.gamma[best, 0]:g} ; "
+                f"erreur à un jour {model.rmse():.1f} client(s) par quart d'heure."
+            )
+            guests = model.forecast([week_monday + datetime.timedelta(days=d) for d in range(7)])
+            st.line_chart(pd.DataFrame(
+                guests.T,
+                columns=JOURS_SHORT,
+                index=[time_str(*from_minutes(q * SLOT_MINUTES)) for q in range(SLOTS_PER_DAY)],
+            ))
+            if candidates:
+                rec = recommend_extras(schedule, candidates, all_staff, opening=opening, demand=demand)
+                if rec['shifts']:
+                    st.markdown(f"**Renforts pour la demande prévue** — coût employeur {rec['cost']:.0f} €")
+                    st.dataframe(pd.DataFrame(
+                        [(r['employee'], JOURS[r['day']], r['start'], r['end'], f"{r['hours']:.2f}h",
+                          f"{r['cost']:.2f} €") for r in rec['shifts']],
+                        columns=['Extra', 'Jour', 'Début', 'Fin', 'Heures', 'Coût'],
+                    ), hide_index=True)
+        if model is not None and st.button("Effacer l'historique", key="demand_clear"):
+            st.session_state.demand_history = None
+            st.session_state.demand_model = None
+            st.rerun()
 
     # ── Récap heures ──
     st.subheader("Heures par personne")
-    import pandas as pd
 
     rows = []
     for emp in all_staff:
@@ -1219,14 +5094,19 @@ def main():
             1 for d in range(7)
             if schedule[emp.name][d] and schedule[emp.name][d].get('hours', 0) > 0
         )
-        rows.append({
+        row = {
             'Nom': emp.name,
             'Rôle': emp.role,
             'Contrat': f"{target:.0f}h",
             'Planifié': f"{total:.1f}h",
             'Ecart': f"{ecart:+.1f}h",
             'Jours': days_worked,
-        })
+        }
+        if ledger_week is not None and emp.name in ledger.index:
+            i = ledger.index[emp.name]
+            row['Report'] = f"{ledger.carry(ledger_week)[i]:+.1f}h"
+            row['Compteur'] = f"{ledger.balance[i, ledger_week]:+.1f}h"
+        rows.append(row)
 
     df = pd.DataFrame(rows)
 
@@ -1242,6 +5122,87 @@ def main():
     styled = df.style.map(color_ecart, subset=['Ecart'])
     st.dataframe(styled, hide_index=True, width=700)
 
+    with st.expander("Coût salarial de la semaine"):
+        costs = week_cost(schedule, all_staff)
+        cost_rows = []
+        for emp in all_staff:
+            c = costs[emp.name]
+            cost_rows.append({
+                'Nom': emp.name,
+                'Contrat': contract_type(emp),
+                'Heures': f"{c['heures']:.2f}h",
+                'Maj. dim./soir': f"{c['majorations']:.2f}h",
+                'Heures sup': f"{c['heures_sup']:.2f}h",
+                'Maj. heures sup': f"{c['maj_heures_sup']:.2f}h",
+                'Brut': f"{c['brut']:.2f} €",
+                'Coût employeur': f"{c['cout']:.2f} €",
+            })
+        st.dataframe(pd.DataFrame(cost_rows), hide_index=True, width=900)
+        st.caption(
+            f"Total semaine : {sum(c['cout'] for c in costs.values()):.2f} € "
+            f"(brut {sum(c['brut'] for c in costs.values()):.2f} €). "
+            f"Majorations : dimanche +{SUNDAY_PREMIUM:.0%}, après 22h +{LATE_PREMIUM:.0%}."
+        )
+
+    with st.expander(f"Compteur d'heures {week_monday.year}"):
+        st.caption(
+            "Solde cumulé (planifié + écart pointé + absences - contrat) en fin de semaine. "
+            "Le solde est reporté sur la cible de la semaine suivante."
+        )
+        balance_df = pd.DataFrame(
+            ledger.balance.T,
+            columns=[emp.name.split()[0] for emp in ledger.staff],
+            index=[ledger.monday(w) for w in range(ledger.num_weeks)],
+        )
+        st.line_chart(balance_df)
+
+    with st.expander("Pointages : prévu / réel"):
+        st.caption(
+            "Export CSV de la pointeuse Connecteam, rapproché du planning prévu par employé et par jour. "
+            f"Retard au-delà de {LATE_GRACE_MINUTES} min, heures sup au-delà de {OVERTIME_GRACE_MINUTES} min. "
+            "Les écarts pointé - prévu sont reportés dans le compteur d'heures."
+        )
+        timesheet_file = st.file_uploader("Export de pointage (CSV)", type=["csv"], key="timesheet_upload")
+        if timesheet_file is not None and timesheet_file.file_id != st.session_state.get('timesheet_upload_id'):
+            st.session_state.timesheet_upload_id = timesheet_file.file_id
+            try:
+                timesheet = reconcile_timesheet(timesheet_file, ledger.plan_of, all_staff)
+            except (ValueError, UnicodeDecodeError) as exc:
+                st.error(f"Export de pointage illisible : {exc}")
+            else:
+                st.session_state.timesheet = timesheet
+                ledger.record_timesheet(timesheet['shifts'])
+                st.rerun()
+        timesheet = st.session_state.get('timesheet')
+        if timesheet is not None:
+            shifts = timesheet['shifts']
+            tc1, tc2, tc3, tc4 = st.columns(4)
+            tc1.metric("Écart pointé - prévu", f"{shifts['delta_hours'].sum():+.1f}h")
+            tc2.metric("Retards", int((shifts['late_min'] > 0).sum()))
+            tc3.metric("Heures sup non prévues", f"{shifts['overtime_hours'].sum():.1f}h")
+            tc4.metric("Absences non prévues", int((shifts['status'] == 'absent').sum()))
+            notes = [f"{timesheet['rows']} ligne(s) lue(s)"]
+            if timesheet['skipped']:
+                notes.append(f"{timesheet['skipped']} illisible(s)")
+            if timesheet['outside']:
+                notes.append(f"{timesheet['outside']} jour(s) hors {week_monday.year}")
+            if timesheet['unknown']:
+                notes.append("inconnus : " + ', '.join(timesheet['unknown']))
+            st.caption(' · '.join(notes) + '.')
+            anomalies = shifts[shifts['status'] != 'ok']
+            st.dataframe(
+                anomalies.rename(columns={
+                    'employee': 'Nom', 'date': 'Date', 'planned': 'Prévu', 'clocked': 'Pointé',
+                    'planned_hours': 'H. prévues', 'clocked_hours': 'H. pointées', 'delta_hours': 'Écart',
+                    'late_min': 'Retard (min)', 'overtime_hours': 'H. sup', 'status': 'Statut',
+                }).round(2),
+                hide_index=True, width=1000,
+            )
+            if st.button("Retirer les pointages", key="timesheet_clear"):
+                st.session_state.timesheet = None
+                st.session_state.pop('ledger_key', None)
+                st.rerun()
+
     # ── Alertes ──
     if staffing_issues:
         st.subheader("Sous-effectif fermeture")
@@ -1249,51 +5210,353 @@ def main():
             closers = ', '.join(issue['closers']) if issue['closers'] else 'personne'
             st.error(
                 f"**{issue['day']}** : {issue['count']} personne(s) a la fermeture "
-                f"(min 2). Présent(s) : {closers}. "
+                f"(min {issue['required']}). Présent(s) : {closers}. "
                 f"Effectif insuffisant — envisager un renfort."
             )
+        if candidates:
+            rec = recommend_extras(schedule, candidates, all_staff, opening=opening, demand=demand)
+            if rec['shifts']:
+                st.markdown(f"**Renforts recommandés** — coût employeur {rec['cost']:.0f} €")
+                st.dataframe(pd.DataFrame(
+                    [(r['employee'], JOURS[r['day']], r['start'], r['end'], f"{r['hours']:.2f}h", f"{r['cost']:.2f} €")
+                     for r in rec['shifts']],
+                    columns=['Extra', 'Jour', 'Début', 'Fin', 'Heures', 'Coût'],
+                ), hide_index=True)
+            if rec['uncovered']:
+                st.caption("Aucune combinaison du vivier ne couvre : "
+                           + ", ".join(JOURS[d] for d in rec['uncovered']))
+        else:
+            st.caption("Renseigner le vivier d'extras pour obtenir une recommandation de renforts.")
 
     if warnings:
         st.subheader("Alertes droit du travail")
         for w in warnings:
             st.warning(w)
 
-    if not warnings and not staffing_issues:
+    if skill_issues:
+        st.subheader("Compétences manquantes")
+        for issue in skill_issues:
+            st.warning(f"**{issue['day']}** {issue['start']}-{issue['end']} : {issue['rule']}")
+
+    # Diagnostic (plusieurs régénérations) seulement si une règle bloquante échoue
+    diagnosis = diagnose_week(week_params, manual_overrides) if hard_failures(schedule, opening) else None
+    if diagnosis:
+        with st.expander("Diagnostic : pourquoi la semaine ne tient pas", expanded=bool(staffing_issues)):
+            st.caption(
+                "Pour chaque règle non respectée : le plus petit ensemble de contraintes de la semaine "
+                "qui suffit à la faire échouer, et les contraintes dont la levée seule règle le problème."
+            )
+            for item in diagnosis:
+                st.markdown(f"**{item['failure']}**")
+                if item['understaffed']:
+                    st.caption("Même sans rotation, congés ni indisponibilités ce jour-là, l'équipe ne suffit "
+                               "pas : il faut un renfort.")
+                    continue
+                st.markdown("Conflit : " + " + ".join(item['conflict']))
+                if item['fixes']:
+                    st.markdown("Corrigé en levant une seule contrainte : " + " ; ".join(item['fixes']))
+
+    if not warnings and not staffing_issues and not skill_issues:
         st.success("Planning conforme — aucune alerte")
 
+    score, parts = score_schedule(schedule, all_staff, opening=opening, profiles=labor_profiles)
+    st.caption(
+        f"Score planning : {score:.0f} (plus bas = meilleur) — "
+        f"alertes {parts['violations']:.0f}, manque fermeture {parts['closers']:.0f}, "
+        f"écart contrats {parts['contract']:.1f}h, coût {parts['cost']:.0f} €, "
+        f"équité fermetures {parts['fairness']:.0f}"
+    )
+
+    # ── Absence de dernière minute ──
+    with st.expander("Absence de dernière minute"):
+        st.caption(
+            f"Passe les jours choisis en absence et propose la réparation qui touche le moins "
+            f"de shifts ({REPAIR_MAX_CHANGES} gestes max par jour) : prolonger, inverser matin/soir, "
+            f"rappeler quelqu'un de repos, puis appeler un extra du vivier. Les dates hors de la "
+            f"semaine affichée sont enregistrées comme absences datées à l'application."
+        )
+        with st.form("repair_form", border=False):
+            rc1, rc2, rc3 = st.columns([2, 3, 1])
+            with rc1:
+                repair_name = st.selectbox("Employé", [e.name for e in all_staff], key="repair_name")
+            with rc2:
+                repair_range = st.date_input("Du … au", value=(week_monday, week_monday), key="repair_range")
+            with rc3:
+                repair_kind = st.selectbox("Motif", list(ABSENCE_TYPES), key="repair_kind",
+                                           index=list(ABSENCE_TYPES).index('maladie'),
+                                           format_func=ABSENCE_TYPES.get)
+            run_repair = st.form_submit_button("Réparer")
+        # Une réparation ne vaut que pour les entrées qui ont produit le planning réparé
+        repair_key = (week_monday, week_num, vacation, breaks, repr(extras), repr(st.session_state.absences),
+                      repr(manual_overrides), None if opening is None else opening.tobytes())
+        if run_repair:
+            if len(repair_range) == 2:
+                repair_start, repair_end = repair_range
+                repair_days = [d for d in range(7)
+                               if repair_start <= week_monday + datetime.timedelta(days=d) <= repair_end]
+                st.session_state.repair = {
+                    'key': repair_key,
+                    'name': repair_name,
+                    'kind': repair_kind,
+                    'start': repair_start,
+                    'end': repair_end,
+                    'days': repair_days,
+                    'result': repair_schedule(
+                        schedule, weekly_hours, repair_name, repair_days,
+                        repair_kind, all_staff, candidates, breaks=breaks, opening=opening,
+                    ),
+                }
+            else:
+                st.session_state.pop('repair', None)
+                st.error("Sélectionner une date de début et une date de fin.")
+        repair = st.session_state.get('repair')
+        if repair and repair['key'] == repair_key:
+            result = repair['result']
+            if not repair['days']:
+                st.caption("Aucun jour de la semaine affichée dans cette période.")
+            if result['changes']:
+                st.dataframe(pd.DataFrame(
+                    [(REPAIR_LABELS[m['kind']], m['employee'], JOURS[m['day']],
+                      _shift_label(m['before']), _shift_label(m['entry']),
+                      f"{m['cost']:.2f} €" if m['kind'] == 'extra' else '')
+                     for m in result['changes']],
+                    columns=['Geste', 'Employé', 'Jour', 'Avant', 'Après', 'Coût extra'],
+                ), hide_index=True)
+            else:
+                st.caption("Couverture assurée sans changement.")
+            if result['unresolved']:
+                st.error("Aucune réparation possible pour : "
+                         + ", ".join(JOURS[d] for d in result['unresolved']))
+            if result['extras']:
+                st.info("Extras à appeler : " + ", ".join(e.name for e in result['extras'])
+                        + " (ajoutés au planning avec leurs shifts à l'application).")
+            st.markdown(build_schedule_html(result['schedule'], result['weekly_hours'],
+                                            all_staff + result['extras']),
+                        unsafe_allow_html=True)
+            if st.button("Appliquer comme modifications", key="repair_apply"):
+                ovs = st.session_state.week_overrides[week_num]
+                rows = [(repair['name'], d, {'type': repair['kind'], 'start': '', 'end': ''})
+                        for d in repair['days']]
+                rows += [(m['employee'], m['day'], m['entry']) for m in result['changes']]
+                for emp_name, d, entry in rows:
+                    st.session_state.override_counter += 1
+                    ovs.append({
+                        'id': st.session_state.override_counter,
+                        'employee': emp_name,
+                        'day': d,
+                        'type': entry['type'],
+                        'start': entry['start'],
+                        'end': entry['end'],
+                    })
+                # Dates hors de la semaine affichée : absences datées (employés permanents)
+                week_end = week_monday + datetime.timedelta(days=6)
+                outside = [(repair['start'], min(repair['end'], week_monday - datetime.timedelta(days=1))),
+                           (max(repair['start'], week_end + datetime.timedelta(days=1)), repair['end'])]
+                if repair['name'] in {emp.name for emp in STAFF}:
+                    for start, end in outside:
+                        if start <= end:
+                            st.session_state.absence_counter += 1
+                            st.session_state.absences.append({
+                                'id': st.session_state.absence_counter,
+                                'employee': repair['name'],
+                                'kind': repair['kind'],
+                                'start': start,
+                                'end': end,
+                            })
+                del st.session_state['repair']
+                st.rerun()
+
+    # ── Scénarios ──
+    with st.expander("Scénarios « et si… ? »"):
+        st.caption(
+            "Variantes de la semaine affichée, comparées à la base (planning ci-dessus). "
+            "Laisser une variante vide pour l'ignorer."
+        )
+        cell_options = [f"{emp.name.split()[0]} — {j}" for emp in all_staff for j in JOURS]
+        cell_map = {
+            f"{emp.name.split()[0]} — {j}": (emp.name, d)
+            for emp in all_staff for d, j in enumerate(JOURS)
+        }
+        with st.form("scenario_form", border=False):
+            scn_cols = st.columns(3)
+            for i, col in enumerate(scn_cols, start=1):
+                with col:
+                    st.text_input("Nom", value=f"Variante {i}", key=f"scn_label_{i}")
+                    st.multiselect("Absents", cell_options, key=f"scn_off_{i}")
+                    st.multiselect("Extra (7h/jour)", JOURS, key=f"scn_extra_{i}")
+                    st.selectbox("Shift modifié", ["—"] + cell_options, key=f"scn_ov_{i}")
+                    oc1, oc2 = st.columns(2)
+                    with oc1:
+                        st.text_input("Début", value="9:45", key=f"scn_ov_start_{i}")
+                    with oc2:
+                        st.text_input("Fin", value="18:15", key=f"scn_ov_end_{i}")
+            run_scn = st.form_submit_button("Comparer")
+
+        if run_scn:
+            scenarios = []
+            for i in range(1, 4):
+                label = st.session_state[f"scn_label_{i}"].strip() or f"Variante {i}"
+                off_days = {}
+                for cell in st.session_state[f"scn_off_{i}"]:
+                    name, d = cell_map[cell]
+                    off_days.setdefault(name, set()).add(d)
+                extra_days = {JOURS.index(j) for j in st.session_state[f"scn_extra_{i}"]}
+                scn_extras = [Employee(f"Extra {label}", "Extra", 7.0 * len(extra_days), extra_days)] if extra_days else []
+                scn_overrides = []
+                if st.session_state[f"scn_ov_{i}"] != "—":
+                    name, d = cell_map[st.session_state[f"scn_ov_{i}"]]
+                    start = st.session_state[f"scn_ov_start_{i}"].strip()
+                    end = st.session_state[f"scn_ov_end_{i}"].strip()
+                    try:
+                        valid = parse_minutes(end) > parse_minutes(start)
+                    except ValueError:
+                        valid = False
+                    if valid:
+                        shift_type = 'soir' if end == time_str(*HORAIRES[d][2:]) else 'matin'
+                        scn_overrides.append({'employee': name, 'day': d, 'type': shift_type,
+                                              'start': start, 'end': end})
+                    else:
+                        st.error(f"{label} : horaires invalides ({start} - {end}), modification ignorée.")
+                if off_days or scn_extras or scn_overrides:
+                    scenarios.append({'label': label, 'off_days': off_days, 'extras': scn_extras,
+                                      'overrides': scn_overrides})
+
+            base_result, results = compare_scenarios(
+                scenarios, week_params, all_staff, manual_overrides, base=(schedule, weekly_hours),
+                profiles=labor_profiles,
+            )
+            if not results:
+                st.info("Aucune variante renseignée.")
+            else:
+                summary = {}
+                for res in [base_result] + results:
+                    row = {emp.name.split()[0]: round(res['weekly_hours'].get(emp.name, 0.0), 1)
+                           for emp in res['staff']}
+                    row['Alertes'] = len(res['warnings']) + len(res['staffing_issues'])
+                    row['Coût (€)'] = round(res['parts']['cost'])
+                    row['Score'] = round(res['score'])
+                    summary[res['label']] = row
+                st.dataframe(pd.DataFrame.from_dict(summary, orient='index').fillna(0), width=900)
+
+                for col, res in zip(st.columns(len(results)), results):
+                    diff = diff_scenario(base_result, res)
+                    with col:
+                        st.markdown(f"**{res['label']}**")
+                        if diff['shifts']:
+                            st.dataframe(pd.DataFrame(
+                                [(n.split()[0], j, b, a) for n, j, b, a in diff['shifts']],
+                                columns=['Employé', 'Jour', 'Base', 'Variante'],
+                            ), hide_index=True)
+                        else:
+                            st.caption("Aucun shift modifié.")
+                        for name, (before, after) in diff['hours'].items():
+                            st.caption(f"{name.split()[0]} : {before:.1f}h → {after:.1f}h")
+                        for alert in diff['added']:
+                            st.error(alert)
+                        for alert in diff['removed']:
+                            st.success(f"Résolu : {alert}")
+                        st.markdown(build_schedule_html(res['schedule'], res['weekly_hours'], res['staff']),
+                                    unsafe_allow_html=True)
+
+    # ── Équité long terme ──
+    with st.expander("Équité des rotations sur 52 semaines"):
+        stats = fairness_table(week_monday, week_num, extras, absences, breaks, exceptions, cycle_staff, rotation)
+        fair_df = pd.DataFrame.from_dict(stats, orient='index', columns=FAIRNESS_COLUMNS)
+        fair_df.index = [n.split()[0] for n in fair_df.index]
+        fair_df['Heures'] = fair_df['Heures'].round(1)
+        st.dataframe(fair_df, width=900)
+        spread = fairness_spread(stats, sorted(CDI_NAMES))
+        st.caption(
+            f"Du {week_monday.strftime('%d/%m/%Y')}, semaine {week_num}/3. Écart max entre CDI : "
+            + ", ".join(f"{col.lower()} {spread[col]:g}" for col in ('Dimanches', 'Fermetures', 'Soirs', 'Week-ends off'))
+        )
+
     # ── Vue 3 semaines ──
     with st.expander("Voir les 3 semaines du cycle"):
         for w in [1, 2, 3]:
             meeting_label = " (réunion)" if w == 3 and meeting_week else ""
             st.markdown(f"#### Semaine {w}{meeting_label}")
-            s, wh = generate_week(w, extras=extras, meeting_week=(meeting_week if w == 3 else False), vacation=vacation)
-            st.markdown(build_schedule_html(s, wh, all_staff), unsafe_allow_html=True)
-            _, issues = check_labor_law(s, wh, all_staff)
+            s, wh = generate_week_cached(w, extras=extras, meeting_week=(meeting_week if w == 3 else False),
+                                         vacation=vacation, breaks=breaks, rotation=rotation)
+            st.markdown(build_schedule_html(s, wh, cycle_staff), unsafe_allow_html=True)
+            _, issues = check_labor_law(s, wh, cycle_staff, profiles=labor_profiles)
             if issues:
                 for issue in issues:
                     st.error(f"{issue['day']} : {issue['count']} personne(s) a la fermeture")
 
+    # ── Recherche de rotations ──
+    with st.expander("Rechercher une rotation (nombre de CDI, durée du cycle)"):
+        st.caption(
+            "Propose des rotations de jours off : 2 jours consécutifs par semaine, un seul CDI le dimanche, "
+            "managers présents le lundi des semaines de réunion, 6 jours de travail d'affilée au plus. "
+            "Classées par équité (dimanches, week-ends off) puis par régularité des absences par jour."
+        )
+        with st.form("rotation_search_form", border=False):
+            rc1, rc2 = st.columns([1, 3])
+            with rc1:
+                cycle_weeks = st.number_input("Semaines du cycle", min_value=1, max_value=6, value=3)
+            with rc2:
+                more_cdis = st.text_input("CDI supplémentaires (noms séparés par des virgules)")
+            if st.form_submit_button("Rechercher"):
+                cdis = [emp.name for emp in STAFF if emp.name in CDI_NAMES]
+                cdis += [name.strip() for name in more_cdis.split(',') if name.strip() and name.strip() not in cdis]
+                with st.spinner("Recherche des rotations…"):
+                    st.session_state.rotation_search = search_rotations(cdis, int(cycle_weeks), week_monday)
+        if rotation is not None:
+            st.info("Rotation appliquée depuis la recherche (planning, compteur d'heures et exports).")
+            if st.button("Revenir à la rotation par défaut", key="rotation_reset"):
+                st.session_state.rotation = None
+                st.rerun()
+        found = st.session_state.get('rotation_search')
+        if found is not None:
+            if not found['rotations']:
+                st.warning("Aucune rotation ne respecte les règles avec ce nombre de CDI.")
+            if not found['exhaustive']:
+                st.warning(
+                    f"Résultat heuristique : recherche arrêtée après {found['nodes']} nœuds, meilleures "
+                    "rotations trouvées avant l'arrêt (l'optimum n'est pas garanti)."
+                )
+            cdis = {emp.name for emp in STAFF if emp.name in CDI_NAMES}
+            for rank, option in enumerate(found['rotations'], 1):
+                parts = option['parts']
+                st.markdown(
+                    f"**Rotation {rank}**{'' if found['exhaustive'] else ' (heuristique)'} — "
+                    f"score {option['score']:g} (écart dimanches {parts['sundays']}, "
+                    f"écart week-ends off {parts['weekends']}, déséquilibre {parts['coverage']})"
+                )
+                st.dataframe(pd.DataFrame(
+                    {f"S{w}": ["+".join(JOURS_SHORT[d] for d in ((6, 0) if days == {0, 6} else sorted(days)))
+                               + (" · dim." if option['sunday'][w] == name else "")
+                               for name, days in option['rotation'][w].items()]
+                     for w in option['rotation']},
+                    index=list(option['rotation'][1]),
+                ))
+                # Semaine w de la recherche (à partir de la semaine affichée) → type du cycle
+                applicable = len(option['rotation']) == len(ROTATION) and set(option['rotation'][1]) == cdis
+                if st.button("Appliquer cette rotation", key=f"rotation_apply_{rank}", disabled=not applicable,
+                             help=None if applicable else "Seulement pour un cycle de 3 semaines avec les CDI actuels"):
+                    types = {w: ((week_num - 1 + w - 1) % 3) + 1 for w in option['rotation']}
+                    st.session_state.rotation = {
+                        'rotation': {types[w]: {name: set(days) for name, days in off.items()}
+                                     for w, off in option['rotation'].items()},
+                        'sunday': {types[w]: name for w, name in option['sunday'].items()},
+                    }
+                    st.rerun()
+
     # ── Export Connecteam ──
     st.markdown("---")
     st.subheader("Export Connecteam")
 
-    today = datetime.date.today()
-    # Prochain lundi
-    days_until_monday = (7 - today.weekday()) % 7
-    if days_until_monday == 0:
-        days_until_monday = 7
-    next_monday = today + datetime.timedelta(days=days_until_monday)
-
     ec1, ec2, ec3 = st.columns(3)
     with ec1:
         start_date = st.date_input(
             "Date de début (lundi)",
-            value=next_monday,
+            value=next_monday(),
         )
     with ec2:
         num_weeks = st.number_input(
             "Nombre de semaines",
-            min_value=1, max_value=12, value=3,
+            min_value=1, max_value=52, value=3,
         )
     with ec3:
         first_week = st.selectbox(
@@ -1317,7 +5580,11 @@ def main():
         f"({num_weeks} semaines, rotation {first_week}→{((first_week - 1 + num_weeks - 1) % 3) + 1})"
     )
 
-    csv_data = export_connecteam_csv(start_date, num_weeks, first_week, extras=extras, vacation=vacation)
+    # Un seul horizon pour tous les exports (modifications manuelles comprises)
+    export = export_horizon(start_date, num_weeks, first_week, extras, vacation, absences, breaks, exceptions,
+                            all_staff, rotation)
+    horizon = export['horizon']
+    csv_data = '\n'.join([CONNECTEAM_HEADER] + connecteam_rows(horizon, all_staff))
     st.download_button(
         "Télécharger le CSV Connecteam",
         data=csv_data,
@@ -1326,79 +5593,96 @@ def main():
         type="primary",
     )
 
-    # ── Footer ──
-    st.markdown("<br><br>", unsafe_allow_html=True)
-    st.markdown(
-        '<hr style="border-color:rgba(255,255,255,0.06); margin-bottom:16px;">',
-        unsafe_allow_html=True,
-    )
-    fc1, fc2, fc3 = st.columns([3, 1, 1])
-    with fc2:
-        st.caption(f"v{APP_VERSION}")
-    with fc3:
-        label = "☀ Mode clair" if st.session_state.theme == 'birdieland' else "◑ Mode Birdieland"
-        if st.button(label, key="theme_toggle"):
-            st.session_state.theme = 'white' if st.session_state.theme == 'birdieland' else 'birdieland'
+    with st.expander("Calendriers .ics et snapshot analytique"):
+        ic1, ic2 = st.columns([2, 1])
+        with ic1:
+            ics_emp = st.selectbox("Calendrier de", [emp.name for emp in all_staff], key="ics_emp")
+        with ic2:
+            st.markdown("<div style='margin-top:24px'></div>", unsafe_allow_html=True)
+            st.download_button(
+                "Télécharger le .ics",
+                data=export_ics(horizon, ics_emp),
+                file_name=f"planning_{ics_emp.split()[0].lower()}_{start_date.strftime('%Y%m%d')}.ics",
+                mime="text/calendar",
+            )
+
+        if export['snapshot'] is None:
+            import io
+            snapshot = io.BytesIO()
+            write_snapshot(horizon, snapshot, all_staff)
+            export['snapshot'] = snapshot.getvalue()
+        st.download_button(
+            "Snapshot Parquet (une ligne par employé-jour)",
+            data=export['snapshot'],
+            file_name=f"planning_{start_date.strftime('%Y%m%d')}_{num_weeks}sem.parquet",
+            mime="application/vnd.apache.parquet",
+        )
+
+    with st.expander("Portail staff statique"):
+        st.caption(
+            "Publie l'horizon ci-dessus en pages HTML statiques (équipe et par personne, "
+            f"avec .ics) dans {os.path.relpath(PORTAL_DIR)}/. Seules les semaines modifiées "
+            "depuis la dernière publication sont régénérées."
+        )
+        if st.button("Publier sur le portail"):
+            written = publish_portal(horizon, all_staff, exceptions=exceptions)
+            if written:
+                st.success(f"{len(written)} fichier(s) mis à jour.")
+            else:
+                st.info("Portail déjà à jour.")
+            st.download_button(
+                "Télécharger le portail (.zip)",
+                data=portal_zip(),
+                file_name="portail_planning.zip",
+                mime="application/zip",
+            )
+
+    # ── Sauvegarde du planning ──
+    plan_state = snapshot_state(st.session_state)
+    token = encode_state(plan_state)
+    with st.expander("Sauvegarder / restaurer le planning"):
+        st.caption(
+            "L'état complet (semaine, absences, extra, modifications de shifts) est encodé "
+            "dans le lien de la page : un rafraîchissement ou un lien partagé le restaure."
+        )
+        st.code(f"?plan={token}", language=None)
+        sc1, sc2 = st.columns(2)
+        with sc1:
+            st.download_button(
+                "Télécharger la sauvegarde",
+                data=token,
+                file_name=f"planning_{week_monday.strftime('%Y%m%d')}.plan",
+                mime="text/plain",
+            )
+        with sc2:
+            uploaded = st.file_uploader("Restaurer une sauvegarde", type=["plan"], key="plan_upload")
+        if uploaded is not None and uploaded.file_id != st.session_state.get('plan_upload_id'):
+            st.session_state.plan_upload_id = uploaded.file_id
+            st.session_state.pending_plan = uploaded.getvalue().decode('ascii', errors='replace')
             st.rerun()
 
+    # ── Comptes utilisateurs ──
+    with st.expander("Comptes utilisateurs"):
+        users_panel()
+
+    _footer()
+
+    # Le lien de la page suit l'état courant (survit au refresh)
+    if token != st.session_state.get('plan_token'):
+        st.query_params["plan"] = token
+        st.session_state.plan_token = token
+
 
 JOURS_SHORT = ['Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim']
 
 
 def _planning_css():
     """CSS adaptatif light/dark mode + responsive mobile."""
-    return """<style>
-    .pl-scroll { width:100%; overflow-x:auto; -webkit-overflow-scrolling:touch; }
-    .pl-table { width:100%; border-collapse:collapse; font-size:13px; font-family:sans-serif; min-width:700px; }
-    .pl-table th, .pl-table td { padding:8px; border:1px solid rgba(128,128,128,0.3); }
-    .pl-table th { text-align:center; }
-    .pl-hdr { background:rgba(44,62,80,0.9); color:white; }
-    .pl-name { font-weight:bold; text-align:left; white-space:nowrap; }
-    .pl-role { font-size:11px; font-weight:normal; opacity:0.65; }
-    .pl-matin { background:rgba(52,152,219,0.2); }
-    .pl-soir { background:rgba(230,126,34,0.2); }
-    .pl-journee { background:rgba(46,204,113,0.2); }
-    .pl-conge { background:rgba(128,128,128,0.15); }
-    .pl-indispo { background:rgba(128,128,128,0.08); }
-    .pl-empty { opacity:0.5; }
-    .pl-total { font-weight:bold; text-align:center; }
-    .pl-hours { font-size:11px; opacity:0.65; }
-    .pl-ok { color:#27ae60; }
-    .pl-warn { color:#e67e22; }
-    .pl-cov0 { background:rgba(231,76,60,0.25); }
-    .pl-cov1 { background:rgba(241,196,15,0.25); }
-    .pl-cov2 { background:rgba(46,204,113,0.25); }
-    .pl-cov3 { background:rgba(52,152,219,0.25); }
-    .pl-covoff { background:rgba(128,128,128,0.1); opacity:0.4; }
-    .pl-covtip { font-size:10px; opacity:0.6; }
-    .pl-day-full { display:inline; }
-    .pl-day-short { display:none; }
-    @media (prefers-color-scheme: dark) {
-        .pl-matin { background:rgba(52,152,219,0.3); }
-        .pl-soir { background:rgba(230,126,34,0.3); }
-        .pl-journee { background:rgba(46,204,113,0.3); }
-        .pl-conge { background:rgba(128,128,128,0.25); }
-        .pl-cov0 { background:rgba(231,76,60,0.35); }
-        .pl-cov1 { background:rgba(241,196,15,0.3); }
-        .pl-cov2 { background:rgba(46,204,113,0.3); }
-        .pl-cov3 { background:rgba(52,152,219,0.35); }
-    }
-    @media (max-width: 768px) {
-        .pl-table { font-size:11px; min-width:580px; }
-        .pl-table th, .pl-table td { padding:4px 3px; }
-        .pl-name { font-size:11px; }
-        .pl-role { font-size:9px; }
-        .pl-hours { font-size:9px; }
-        .pl-covtip { font-size:8px; }
-        .pl-total { font-size:11px; }
-        .pl-day-full { display:none; }
-        .pl-day-short { display:inline; }
-    }
-    </style>"""
+    return stylesheets("planning.css")
 
 
-def build_schedule_html(schedule, weekly_hours=None, staff_list=None):
-    """Construit un tableau HTML coloré du planning."""
+def build_schedule_html(schedule, weekly_hours=None, staff_list=None, with_css=True):
+    """Construit un tableau HTML coloré du planning (`with_css=False` : sans la balise <link>)."""
     staff_list = staff_list or STAFF
     css_class = {
         'matin': 'pl-matin',
@@ -1406,6 +5690,11 @@ def build_schedule_html(schedule, weekly_hours=None, staff_list=None):
         'journee': 'pl-journee',
         'conge': 'pl-conge',
         'indispo': 'pl-indispo',
+        'ferme': 'pl-indispo',
+        'vacances': 'pl-conge',
+        'maladie': 'pl-absent',
+        'formation': 'pl-absent',
+        'absent': 'pl-absent',
     }
     labels = {
         'matin': 'MATIN',
@@ -1413,9 +5702,14 @@ def build_schedule_html(schedule, weekly_hours=None, staff_list=None):
         'journee': 'JOURNEE',
         'conge': 'CONGE',
         'indispo': '—',
+        'ferme': 'FERMÉ',
+        'vacances': 'VACANCES',
+        'maladie': 'MALADIE',
+        'formation': 'FORMATION',
+        'absent': 'ABSENT',
     }
 
-    html = _planning_css()
+    html = _planning_css() if with_css else ''
     html += '<div class="pl-scroll"><table class="pl-table">'
 
     # Header
@@ -1449,13 +5743,14 @@ def build_schedule_html(schedule, weekly_hours=None, staff_list=None):
                 cls = css_class[entry['type']]
                 label = labels[entry['type']]
                 total += entry['hours']
+                pause = f' · pause {entry["break_start"]}' if entry.get('break_start') else ''
                 html += (
                     f'<td class="{cls}" style="text-align:center; padding:6px;">'
                     f'<strong style="font-size:12px;">{label}</strong><br>'
                     f'<span style="font-size:12px;">'
                     f'{entry["start"]} - {entry["end"]}</span><br>'
                     f'<span class="pl-hours">'
-                    f'{entry["hours"]:.1f}h</span></td>'
+                    f'{entry["hours"]:.1f}h{pause}</span></td>'
                 )
 
         # Colonne total + indicateur contrat
@@ -1474,8 +5769,14 @@ def build_schedule_html(schedule, weekly_hours=None, staff_list=None):
     return html
 
 
-def build_coverage_html(schedule, staff_list=None):
-    """Tableau de couverture : nombre de personnes par créneau horaire."""
+def build_coverage_html(schedule, staff_list=None, opening=None, demand=None):
+    """Tableau de couverture : nombre de personnes par créneau horaire.
+
+    Avec `opening` (horaires exceptionnels), les créneaux s'étendent aux
+    heures d'ouverture hors HORAIRES et les jours fermés sont grisés.
+    Avec `demand` (week_demand), chaque cellule affiche présents / effectif
+    prévu et passe en rouge si la prévision n'est pas couverte.
+    """
     staff_list = staff_list or STAFF
     html = '<div class="pl-scroll"><table class="pl-table" style="font-size:12px;">'
     html += '<tr class="pl-hdr">'
@@ -1495,6 +5796,14 @@ def build_coverage_html(schedule, staff_list=None):
         (20, 0, 22, 0),
         (22, 0, 23, 15),
     ]
+    if opening is not None:
+        open_days = [d for d in range(7) if not is_closed(d, opening)]
+        first = min((int(opening[d, OPEN]) for d in open_days), default=to_minutes(9, 45))
+        last = max((int(opening[d, CLOSE]) for d in open_days), default=to_minutes(23, 15))
+        if first < to_minutes(9, 45):
+            slots.insert(0, (*from_minutes(first), 9, 45))
+        if last > to_minutes(23, 15):
+            slots.append((23, 15, *from_minutes(last)))
 
     for s_sh, s_sm, s_eh, s_em in slots:
         slot_start = to_minutes(s_sh, s_sm)
@@ -1506,8 +5815,8 @@ def build_coverage_html(schedule, staff_list=None):
         )
 
         for d in range(7):
-            open_min = to_minutes(*HORAIRES[d][:2])
-            close_min = to_minutes(*HORAIRES[d][2:])
+            sh, sm, eh, em = opening_hours(d, opening)
+            open_min, close_min = to_minutes(sh, sm), to_minutes(eh, em)
 
             # Hors horaires d'ouverture
             if slot_start >= close_min or slot_end <= open_min:
@@ -1529,7 +5838,13 @@ def build_coverage_html(schedule, staff_list=None):
                         count += 1
                         names.append(emp.name.split()[0][:3])
 
-            if count == 0:
+            need = 0
+            if demand is not None:
+                first_slot = max(slot_start, open_min) // SLOT_MINUTES
+                last_slot = -(-min(slot_end, close_min) // SLOT_MINUTES)
+                need = int(demand[d, first_slot:last_slot].max(initial=0))
+
+            if count == 0 or count < need:
                 cls = 'pl-cov0'
             elif count == 1:
                 cls = 'pl-cov1'
@@ -1539,10 +5854,11 @@ def build_coverage_html(schedule, staff_list=None):
                 cls = 'pl-cov3'
 
             tooltip = ', '.join(names)
+            forecast = f'/{need}' if need else ''
             html += (
                 f'<td class="{cls}" style="padding:4px; text-align:center;" '
                 f'title="{tooltip}">'
-                f'<strong>{count}</strong>'
+                f'<strong>{count}</strong>{forecast}'
                 f'<span class="pl-covtip"><br>{tooltip}</span>'
                 f'</td>'
             )